@@ -3,7 +3,7 @@ Face Recognition App with OpenCV Face Detection
 This version uses OpenCV's Haar Cascades for face detection instead of dlib
 """
 
-from flask import Flask, render_template, request, jsonify, redirect, url_for, session, Response
+from flask import Flask, render_template, request, jsonify, redirect, url_for, session, Response, stream_with_context, send_from_directory, g, has_request_context, make_response
 from flask_sqlalchemy import SQLAlchemy
 from flask_jwt_extended import JWTManager, jwt_required, create_access_token, get_jwt_identity, verify_jwt_in_request
 from werkzeug.security import generate_password_hash, check_password_hash
@@ -19,19 +19,182 @@ import base64
 import io
 from PIL import Image
 import threading
+import queue
+import atexit
+import csv
+import zlib
+import gzip
+import hashlib
+import bisect
+import random
+import cProfile
+import pstats
+import uuid
+import socket
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from sqlalchemy import event, inspect as sa_inspect
+
+# Storage configuration
+SQLITE_BUSY_TIMEOUT = float(os.environ.get('SQLITE_BUSY_TIMEOUT', 30))  # seconds
+SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')
+SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+
+def normalize_database_url(url):
+    """Use the PyMySQL driver for plain mysql:// URLs"""
+    if url.startswith('mysql://'):
+        return 'mysql+pymysql://' + url[len('mysql://'):]
+    return url
+
+def storage_engine_options(url):
+    """SQLAlchemy engine options for several workers and background threads sharing one database"""
+    if url.startswith('sqlite'):
+        return {
+            'connect_args': {
+                'timeout': SQLITE_BUSY_TIMEOUT,
+                'check_same_thread': False
+            }
+        }
+    if url.startswith('mysql'):
+        return {
+            'pool_size': int(os.environ.get('DB_POOL_SIZE', 5)),
+            'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+            'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', 30)),
+            # Recycle before MySQL's wait_timeout drops idle connections
+            'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 280)),
+            'pool_pre_ping': True,
+            'connect_args': {
+                'charset': 'utf8mb4',
+                'connect_timeout': 10
+            }
+        }
+    return {'pool_pre_ping': True}
+
+def configure_sqlite_connection(dbapi_connection, connection_record):
+    """Enable WAL, a busy timeout and relaxed fsyncs on every new SQLite connection"""
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA busy_timeout = {int(SQLITE_BUSY_TIMEOUT * 1000)}")
+    cursor.execute(f"PRAGMA journal_mode = {SQLITE_JOURNAL_MODE}")
+    cursor.execute(f"PRAGMA synchronous = {SQLITE_SYNCHRONOUS}")
+    cursor.close()
+
+def configure_storage_engine(engine):
+    """Attach per-connection settings to an engine"""
+    if engine.dialect.name == 'sqlite' and not event.contains(engine, 'connect', configure_sqlite_connection):
+        event.listen(engine, 'connect', configure_sqlite_connection)
 
 # Initialize Flask app
 app = Flask(__name__)
 
 # Configuration
 app.config['SECRET_KEY'] = 'dev-secret-key-change-in-production'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///face_recognition.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = normalize_database_url(os.environ.get('DATABASE_URL', 'sqlite:///face_recognition.db'))
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = storage_engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['JWT_SECRET_KEY'] = 'dev-jwt-secret-change-in-production'
 app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(hours=24)
 app.config['UPLOAD_FOLDER'] = 'static/uploads'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 
+# Recognition log writer (logs are buffered and written in batches off the request thread)
+app.config['LOG_WRITER_QUEUE_SIZE'] = int(os.environ.get('LOG_WRITER_QUEUE_SIZE', 10000))
+app.config['LOG_WRITER_BATCH_SIZE'] = int(os.environ.get('LOG_WRITER_BATCH_SIZE', 200))
+app.config['LOG_WRITER_FLUSH_INTERVAL'] = float(os.environ.get('LOG_WRITER_FLUSH_INTERVAL', 1.0))  # seconds
+app.config['LOG_WRITER_POLICY'] = os.environ.get('LOG_WRITER_POLICY', 'drop_oldest')  # block, drop_newest or drop_oldest
+app.config['LOG_WRITER_BLOCK_TIMEOUT'] = float(os.environ.get('LOG_WRITER_BLOCK_TIMEOUT', 0.05))  # seconds
+
+# Request threads per worker process. start.sh and the Procfile run gunicorn gthread workers with
+# SERVER_THREADS threads; 1 means sync workers (one request at a time per process)
+app.config['SERVER_THREADS'] = int(os.environ.get('SERVER_THREADS', 1))
+app.config['SERVER_MODE'] = os.environ.get('SERVER_MODE', 'wsgi')  # asgi_app.py sets asgi
+# Whether one process serves concurrent requests (threaded workers or the ASGI entry point)
+app.config['CONCURRENT_REQUESTS'] = app.config['SERVER_THREADS'] > 1 or app.config['SERVER_MODE'] == 'asgi'
+
+# CPU-bound face processing runs in a shared process pool
+app.config['PROCESS_POOL_WORKERS'] = int(os.environ.get('PROCESS_POOL_WORKERS', os.cpu_count() or 2))
+# Face models keep up to this many prototypes per user, matched with the combined correlation score
+app.config['FACE_PROTOTYPES'] = int(os.environ.get('FACE_PROTOTYPES', 3))
+app.config['FACE_MATCH_THRESHOLD'] = float(os.environ.get('FACE_MATCH_THRESHOLD', 0.65))
+# Published gallery versions, memory-mapped read-only by every worker ('' keeps galleries in process memory only)
+app.config['FACE_GALLERY_FOLDER'] = os.environ.get('FACE_GALLERY_FOLDER', 'face_gallery')
+app.config['FACE_GALLERY_KEEP'] = int(os.environ.get('FACE_GALLERY_KEEP', 3))  # versions kept on disk
+# Concurrent recognition matches are batched into one gallery product (0 ms window disables batching;
+# the default is off with sync workers, where a process never has two matches in flight)
+app.config['MATCH_BATCH_WINDOW_MS'] = float(os.environ.get('MATCH_BATCH_WINDOW_MS', 2 if app.config['CONCURRENT_REQUESTS'] else 0))
+app.config['MATCH_BATCH_MAX'] = int(os.environ.get('MATCH_BATCH_MAX', 32))
+app.config['MATCH_BATCH_TIMEOUT'] = float(os.environ.get('MATCH_BATCH_TIMEOUT', 1.0))  # seconds before matching directly
+# Consecutive frames from one client session are reverified against the last confident match only
+app.config['IDENTITY_CACHE_TTL'] = float(os.environ.get('IDENTITY_CACHE_TTL', 3))  # seconds; 0 disables
+app.config['IDENTITY_CACHE_IOU'] = float(os.environ.get('IDENTITY_CACHE_IOU', 0.5))
+app.config['IDENTITY_CACHE_MIN_CONFIDENCE'] = float(os.environ.get('IDENTITY_CACHE_MIN_CONFIDENCE', 0.7))
+app.config['IDENTITY_CACHE_MAX_SESSIONS'] = int(os.environ.get('IDENTITY_CACHE_MAX_SESSIONS', 1000))
+
+# Hot-path latency histograms exported at /metrics (per worker process)
+app.config['METRICS_ENABLED'] = os.environ.get('METRICS_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+
+# Opt-in cProfile captures: X-Profile header with an admin token, or a random sample of requests
+app.config['PROFILE_FOLDER'] = os.environ.get('PROFILE_FOLDER', 'profiles')
+app.config['PROFILE_SAMPLE_RATE'] = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))  # fraction of requests; 0 = header only
+app.config['PROFILE_MAX_BYTES'] = int(os.environ.get('PROFILE_MAX_BYTES', 50 * 1024 * 1024))
+app.config['PROFILE_STREAM_FRAMES'] = int(os.environ.get('PROFILE_STREAM_FRAMES', 100))  # frames profiled per stream
+
+# Admission control for CPU-heavy endpoints (per process): enrollment > recognition > preview.
+# On by default only when a process serves concurrent requests; a sync worker runs one request
+# at a time, so its slots would never fill. Host-wide, each worker process gets its own slots.
+app.config['ADMISSION_ENABLED'] = os.environ.get(
+    'ADMISSION_ENABLED', str(app.config['CONCURRENT_REQUESTS'])
+).lower() in ('1', 'true', 'yes')
+app.config['ADMISSION_MAX_CONCURRENT'] = int(os.environ.get('ADMISSION_MAX_CONCURRENT', max(2, app.config['PROCESS_POOL_WORKERS'])))
+app.config['ADMISSION_PREVIEW_MAX_CONCURRENT'] = int(os.environ.get('ADMISSION_PREVIEW_MAX_CONCURRENT', max(1, app.config['ADMISSION_MAX_CONCURRENT'] // 2)))
+app.config['ADMISSION_PREVIEW_QUEUE'] = int(os.environ.get('ADMISSION_PREVIEW_QUEUE', 0))
+app.config['ADMISSION_RECOGNITION_QUEUE'] = int(os.environ.get('ADMISSION_RECOGNITION_QUEUE', 64))
+app.config['ADMISSION_ENROLLMENT_QUEUE'] = int(os.environ.get('ADMISSION_ENROLLMENT_QUEUE', 16))
+app.config['ADMISSION_QUEUE_TIMEOUT'] = float(os.environ.get('ADMISSION_QUEUE_TIMEOUT', 10))  # seconds
+app.config['ADMISSION_RETRY_AFTER'] = int(os.environ.get('ADMISSION_RETRY_AFTER', 2))  # seconds
+
+# MJPEG streams: concurrency cap per process (default: half the request threads, so streams
+# never hold every thread), per-stream duration and frame-rate limits.
+# STREAMING_MODE=separate with STREAM_SERVER_PORT redirects streams to a dedicated server group on
+# that port (see start.sh); it needs a host that exposes both ports, so single-port platforms keep 'shared'.
+app.config['STREAM_MAX_CONCURRENT'] = int(os.environ.get('STREAM_MAX_CONCURRENT', max(1, app.config['SERVER_THREADS'] // 2)))
+app.config['STREAM_MAX_SECONDS'] = int(os.environ.get('STREAM_MAX_SECONDS', 600))  # 0 = unlimited
+app.config['STREAM_MAX_FPS'] = float(os.environ.get('STREAM_MAX_FPS', 15))
+app.config['STREAMING_MODE'] = os.environ.get('STREAMING_MODE', 'shared')  # shared or separate
+app.config['STREAM_SERVER_PORT'] = os.environ.get('STREAM_SERVER_PORT')
+
+# Camera enrollment runs as background jobs so request workers stay free
+app.config['ENROLLMENT_JOB_WORKERS'] = int(os.environ.get('ENROLLMENT_JOB_WORKERS', 1))  # concurrent captures per process
+app.config['ENROLLMENT_JOB_MAX_PENDING'] = int(os.environ.get('ENROLLMENT_JOB_MAX_PENDING', 4))  # queued + running, all processes
+app.config['ENROLLMENT_JOB_STALE_AFTER'] = int(os.environ.get('ENROLLMENT_JOB_STALE_AFTER', 120))  # seconds without progress
+# Enrolling a face that already matches another person: reject, warn (enroll and report it) or allow
+app.config['DUPLICATE_FACE_POLICY'] = os.environ.get('DUPLICATE_FACE_POLICY', 'warn')
+app.config['DUPLICATE_FACE_THRESHOLD'] = float(os.environ.get('DUPLICATE_FACE_THRESHOLD', 0.85))
+# Camera capture keeps up to CAPTURE_CANDIDATE_FACTOR x num_images faces that pass the quality gate,
+# then extracts features only for the best num_images of them
+app.config['CAPTURE_CANDIDATE_FACTOR'] = float(os.environ.get('CAPTURE_CANDIDATE_FACTOR', 2.0))
+app.config['FACE_QUALITY_MIN'] = float(os.environ.get('FACE_QUALITY_MIN', 0.35))
+# Stop training once this many usable faces are found (0 processes every uploaded image)
+app.config['TRAINING_TARGET_SAMPLES'] = int(os.environ.get('TRAINING_TARGET_SAMPLES', 0))
+
+# Bulk user import (image directories are resolved inside this folder)
+app.config['BULK_IMPORT_FOLDER'] = os.environ.get('BULK_IMPORT_FOLDER', 'imports')
+app.config['BULK_IMPORT_BATCH_SIZE'] = int(os.environ.get('BULK_IMPORT_BATCH_SIZE', 200))
+
+# Face crop archive (content-addressed JPEGs for recognition events and enrollments)
+app.config['CROP_ARCHIVE_FOLDER'] = os.environ.get('CROP_ARCHIVE_FOLDER', 'face_crops')
+app.config['CROP_ARCHIVE_MAX_BYTES'] = int(os.environ.get('CROP_ARCHIVE_MAX_BYTES', 500 * 1024 * 1024))  # recognition crops; 0 = no cap
+app.config['CROP_ARCHIVE_QUEUE_SIZE'] = int(os.environ.get('CROP_ARCHIVE_QUEUE_SIZE', 1000))
+app.config['CROP_THUMBNAIL_SIZE'] = int(os.environ.get('CROP_THUMBNAIL_SIZE', 64))
+
+# Recognition log retention (0 keeps logs in the database forever)
+app.config['LOG_RETENTION_DAYS'] = int(os.environ.get('LOG_RETENTION_DAYS', 0))
+app.config['LOG_ARCHIVE_FOLDER'] = os.environ.get('LOG_ARCHIVE_FOLDER', 'logs/archive')
+app.config['LOG_RETENTION_BATCH_SIZE'] = int(os.environ.get('LOG_RETENTION_BATCH_SIZE', 500))
+app.config['LOG_RETENTION_BATCH_PAUSE'] = float(os.environ.get('LOG_RETENTION_BATCH_PAUSE', 0.2))  # seconds between batches
+app.config['LOG_RETENTION_INTERVAL'] = float(os.environ.get('LOG_RETENTION_INTERVAL', 3600))  # seconds between runs
+
 # Initialize extensions
 db = SQLAlchemy(app)
 jwt = JWTManager(app)
@@ -75,7 +238,7 @@ class User(db.Model):
     course = db.Column(db.String(100), nullable=True)
     year_of_study = db.Column(db.String(20), nullable=True)
     face_data = db.Column(db.Text, nullable=True)  # Store face encoding as JSON
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     is_active = db.Column(db.Boolean, default=True)
 
     def to_dict(self):
@@ -104,6 +267,14 @@ class Admin(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
 class RecognitionLog(db.Model):
+    # Composite indexes match the (timestamp, id) keyset ordering used by /api/logs,
+    # with or without a user/status filter
+    __table_args__ = (
+        db.Index('ix_recognition_log_timestamp_id', 'timestamp', 'id'),
+        db.Index('ix_recognition_log_user_timestamp', 'user_id', 'timestamp', 'id'),
+        db.Index('ix_recognition_log_status_timestamp', 'status', 'timestamp', 'id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
     confidence = db.Column(db.Float, nullable=True)
@@ -111,6 +282,366 @@ class RecognitionLog(db.Model):
     image_path = db.Column(db.String(255), nullable=True)
     status = db.Column(db.String(20), default='detected')
 
+    def to_dict(self, user_name=None):
+        return {
+            'id': self.id,
+            'user_id': self.user_id,
+            'user_name': user_name or 'Unknown',
+            'confidence': self.confidence,
+            'timestamp': self.timestamp.isoformat() if self.timestamp else None,
+            'status': self.status
+        }
+
+class FaceSample(db.Model):
+    """An archived enrollment face crop, kept so models can be rebuilt without re-enrolling"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    image_path = db.Column(db.String(255), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class EnrollmentJob(db.Model):
+    """A background camera enrollment; progress is stored so any worker process can report it"""
+    ACTIVE_STATUSES = ('queued', 'running')
+
+    id = db.Column(db.String(32), primary_key=True, default=lambda: uuid.uuid4().hex)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    status = db.Column(db.String(20), nullable=False, default='queued', index=True)  # queued, running, succeeded, failed, cancelled
+    requested_images = db.Column(db.Integer, nullable=False)
+    images_captured = db.Column(db.Integer, nullable=False, default=0)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    cancel_requested = db.Column(db.Boolean, nullable=False, default=False)
+    message = db.Column(db.String(255), nullable=True)
+    owner = db.Column(db.String(100), nullable=True)  # host:pid of the process whose executor holds the job
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    @property
+    def finished(self):
+        return self.status not in self.ACTIVE_STATUSES
+
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'user_id': self.user_id,
+            'status': self.status,
+            'requested_images': self.requested_images,
+            'images_captured': self.images_captured,
+            'attempts': self.attempts,
+            'progress': round(min(1.0, self.images_captured / self.requested_images), 3) if self.requested_images else 0.0,
+            'cancel_requested': self.cancel_requested,
+            'message': self.message,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+
+class ImportJob(db.Model):
+    """A background bulk user import; the uploaded file is kept on disk until the job finishes"""
+    ACTIVE_STATUSES = ('queued', 'running')
+
+    id = db.Column(db.String(32), primary_key=True, default=lambda: uuid.uuid4().hex)
+    status = db.Column(db.String(20), nullable=False, default='queued', index=True)  # queued, running, succeeded, failed
+    record_format = db.Column(db.String(10), nullable=False)
+    upload_path = db.Column(db.String(500), nullable=False)
+    images_root = db.Column(db.String(500), nullable=True)
+    rows_processed = db.Column(db.Integer, nullable=False, default=0)
+    faces_processed = db.Column(db.Integer, nullable=False, default=0)
+    summary = db.Column(db.Text, nullable=True)  # JSON
+    report = db.Column(db.Text, nullable=True)  # JSON, one entry per row
+    message = db.Column(db.String(255), nullable=True)
+    owner = db.Column(db.String(100), nullable=True)  # host:pid of the process whose executor holds the job
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    @property
+    def finished(self):
+        return self.status not in self.ACTIVE_STATUSES
+
+    def to_dict(self, include_rows=False):
+        result = {
+            'job_id': self.id,
+            'status': self.status,
+            'format': self.record_format,
+            'rows_processed': self.rows_processed,
+            'faces_processed': self.faces_processed,
+            'summary': json.loads(self.summary) if self.summary else None,
+            'message': self.message,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+        if include_rows:
+            result['rows'] = json.loads(self.report) if self.report else []
+        return result
+
+class AppCounter(db.Model):
+    """Named integer counters shared by every worker process (table versions, sequences)"""
+    name = db.Column(db.String(50), primary_key=True)
+    value = db.Column(db.BigInteger, nullable=False, default=0)
+
+class RecognitionStat(db.Model):
+    """Recognition counters rolled up per hour, per day and overall, updated as logs are written"""
+    __table_args__ = (
+        db.UniqueConstraint('period', 'bucket_start', name='uq_recognition_stat_bucket'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    period = db.Column(db.String(10), nullable=False)  # hour, day or total
+    bucket_start = db.Column(db.DateTime, nullable=False)
+    total = db.Column(db.Integer, default=0, nullable=False)
+    recognized = db.Column(db.Integer, default=0, nullable=False)
+    unknown = db.Column(db.Integer, default=0, nullable=False)
+    unique_users = db.Column(db.Integer, default=0, nullable=False)
+
+    def to_dict(self):
+        return {
+            'period': self.period,
+            'bucket_start': self.bucket_start.isoformat(),
+            'total': self.total,
+            'recognized': self.recognized,
+            'unknown': self.unknown,
+            'unique_users': self.unique_users
+        }
+
+class RecognitionStatUser(db.Model):
+    """Users already counted towards a rollup bucket's unique_users"""
+    __table_args__ = (
+        db.UniqueConstraint('period', 'bucket_start', 'user_id', name='uq_recognition_stat_user'),
+        db.Index('ix_recognition_stat_user_user_id', 'user_id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    period = db.Column(db.String(10), nullable=False)
+    bucket_start = db.Column(db.DateTime, nullable=False)
+    user_id = db.Column(db.Integer, nullable=False)
+
+def get_counter(name):
+    """Current value of a shared counter (0 if it was never bumped)"""
+    value = db.session.query(AppCounter.value).filter(AppCounter.name == name).scalar()
+    return value or 0
+
+def bump_counter(name, amount=1):
+    """Atomically increment a shared counter in the current transaction"""
+    updated = db.session.execute(
+        AppCounter.__table__.update()
+        .where(AppCounter.__table__.c.name == name)
+        .values(value=AppCounter.__table__.c.value + amount)
+    ).rowcount
+    if not updated:
+        db.session.execute(AppCounter.__table__.insert(), {'name': name, 'value': amount})
+
+def ensure_counter(name, value=0):
+    """Create a counter row if it does not exist yet"""
+    if db.session.get(AppCounter, name) is not None:
+        return
+    try:
+        db.session.add(AppCounter(name=name, value=value))
+        db.session.commit()
+    except Exception:
+        # Another worker created it first
+        db.session.rollback()
+
+USERS_VERSION = 'users_version'
+# Face gallery version: bumped only when stored face models change, not on other user edits
+FACE_GALLERY_VERSION = 'face_gallery_version'
+# Random value set once per database, so published galleries of a recreated database never match
+FACE_GALLERY_EPOCH = 'face_gallery_epoch'
+
+def _face_model_flushed(obj, state):
+    """Does flushing this new, dirty or deleted User add, change or remove a stored face model?"""
+    face_data = sa_inspect(obj).attrs.face_data
+    if state == 'new':
+        return face_data.value is not None
+    if state == 'deleted':
+        # An unloaded value might be a face model, so count it
+        return face_data.loaded_value is not None
+    return face_data.history.has_changes()
+
+@event.listens_for(db.session, 'before_flush')
+def bump_users_version(session, flush_context, instances):
+    """Bump the users-table version whenever a flush adds, changes or deletes a User
+
+    The face gallery version moves only when a face model is added, replaced or removed.
+    """
+    new = [obj for obj in session.new if isinstance(obj, User)]
+    deleted = [obj for obj in session.deleted if isinstance(obj, User)]
+    dirty = [obj for obj in session.dirty if isinstance(obj, User) and session.is_modified(obj)]
+    if new or deleted or dirty:
+        bump_counter(USERS_VERSION)
+    if any(_face_model_flushed(obj, 'new') for obj in new) or any(_face_model_flushed(obj, 'dirty') for obj in dirty) \
+            or any(_face_model_flushed(obj, 'deleted') for obj in deleted):
+        bump_counter(FACE_GALLERY_VERSION)
+
+FACE_MODEL_VERSION = 3
+HISTOGRAM_WEIGHT = 0.6
+LBP_WEIGHT = 0.4
+TEMPLATE_SIZE = 512
+
+def _centered_unit(values):
+    values = np.asarray(values, dtype=np.float32)
+    if values.size == 0:
+        return np.zeros(TEMPLATE_SIZE // 2, dtype=np.float32)
+    values = values - values.mean()
+    norm = np.linalg.norm(values)
+    return values / norm if norm > 0 else values
+
+def face_template(histogram, lbp):
+    """512-d matching template: mean-centered, unit-length histogram and LBP halves
+
+    The dot product of two halves is their HISTCMP_CORREL correlation, so
+    dot(query_template * weights, template) equals compare_faces' combined score.
+    """
+    return np.concatenate([_centered_unit(histogram), _centered_unit(lbp)])
+
+TEMPLATE_WEIGHTS = np.concatenate([
+    np.full(TEMPLATE_SIZE // 2, HISTOGRAM_WEIGHT, dtype=np.float32),
+    np.full(TEMPLATE_SIZE // 2, LBP_WEIGHT, dtype=np.float32)
+])
+
+def cluster_face_templates(templates, k, iterations=10):
+    """Deterministic k-means (farthest-point seeding) over unit templates; returns a label per row"""
+    n = len(templates)
+    if n <= k:
+        return np.arange(n)
+    centers = [templates[0]]
+    for _ in range(1, k):
+        similarity = np.max(templates @ np.array(centers).T, axis=1)
+        centers.append(templates[int(np.argmin(similarity))])
+    centers = np.array(centers)
+    for _ in range(iterations):
+        labels = np.argmax(templates @ centers.T, axis=1)
+        updated = np.array([templates[labels == c].mean(axis=0) if np.any(labels == c) else centers[c]
+                            for c in range(k)])
+        if np.allclose(updated, centers):
+            break
+        centers = updated
+    # Renumber so empty clusters leave no gaps
+    _, labels = np.unique(labels, return_inverse=True)
+    return labels
+
+# Hot-path latency metrics
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_metrics_context = threading.local()
+
+class LatencyMetrics:
+    """Latency histograms per (stage, endpoint) and request counters per endpoint, in Prometheus form
+
+    An observation is two perf_counter() calls, a bisect and a short locked increment, so
+    instrumentation stays on in production. Values are per process, so every series carries
+    a worker label (the process id); a scrape that lands on one worker never passes off its
+    counts as the whole server's.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS, enabled=True):
+        self.buckets = buckets
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._stages = {}
+        self._request_latency = {}
+        self._requests = {}
+
+    def _observe(self, histograms, key, seconds):
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            histogram = histograms.get(key)
+            if histogram is None:
+                histogram = histograms[key] = {'counts': [0] * (len(self.buckets) + 1), 'sum': 0.0}
+            histogram['counts'][index] += 1
+            histogram['sum'] += seconds
+
+    def observe_stage(self, stage, seconds, endpoint=None):
+        if self.enabled:
+            self._observe(self._stages, (stage, endpoint or current_metrics_endpoint()), seconds)
+
+    def observe_request(self, endpoint, method, status, seconds):
+        if not self.enabled:
+            return
+        self._observe(self._request_latency, (endpoint,), seconds)
+        key = (endpoint, method, str(status))
+        with self._lock:
+            self._requests[key] = self._requests.get(key, 0) + 1
+
+    def _histogram_lines(self, name, label_names, histograms, worker):
+        bounds = [repr(float(bound)) for bound in self.buckets] + ['+Inf']
+        lines = []
+        for key, histogram in sorted(histograms.items()):
+            labels = ','.join([f'{label}="{prometheus_label(value)}"' for label, value in zip(label_names, key)]
+                              + [f'worker="{worker}"'])
+            cumulative = 0
+            for bound, count in zip(bounds, histogram['counts']):
+                cumulative += count
+                lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_sum{{{labels}}} {histogram["sum"]!r}')
+            lines.append(f'{name}_count{{{labels}}} {cumulative}')
+        return lines
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        with self._lock:
+            stages = {key: {'counts': list(h['counts']), 'sum': h['sum']} for key, h in self._stages.items()}
+            request_latency = {key: {'counts': list(h['counts']), 'sum': h['sum']} for key, h in self._request_latency.items()}
+            requests_total = dict(self._requests)
+        worker = os.getpid()
+
+        lines = [
+            '# HELP face_app_stage_duration_seconds Time spent in a hot-path stage, by calling endpoint.',
+            '# TYPE face_app_stage_duration_seconds histogram'
+        ]
+        lines += self._histogram_lines('face_app_stage_duration_seconds', ('stage', 'endpoint'), stages, worker)
+        lines += [
+            '# HELP face_app_request_duration_seconds Request handling time until the response starts.',
+            '# TYPE face_app_request_duration_seconds histogram'
+        ]
+        lines += self._histogram_lines('face_app_request_duration_seconds', ('endpoint',), request_latency, worker)
+        lines += [
+            '# HELP face_app_requests_total Requests handled, by endpoint, method and status code.',
+            '# TYPE face_app_requests_total counter'
+        ]
+        for (endpoint, method, status), count in sorted(requests_total.items()):
+            lines.append(f'face_app_requests_total{{endpoint="{prometheus_label(endpoint)}",method="{method}",'
+                         f'status="{status}",worker="{worker}"}} {count}')
+        return '\n'.join(lines) + '\n'
+
+def prometheus_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def current_metrics_endpoint():
+    """Endpoint label for an observation: the Flask endpoint, a name set with metrics_endpoint(), or 'background'"""
+    if has_request_context():
+        return request.endpoint or 'unmatched'
+    return getattr(_metrics_context, 'endpoint', None) or 'background'
+
+@contextmanager
+def metrics_endpoint(name):
+    """Label stage observations on this thread with an endpoint name (for work outside a request context)"""
+    previous = getattr(_metrics_context, 'endpoint', None)
+    _metrics_context.endpoint = name
+    try:
+        yield
+    finally:
+        _metrics_context.endpoint = previous
+
+@contextmanager
+def timed_stage(stage):
+    """Record the time spent in a block (or, used as a decorator, a function) under this stage"""
+    if not latency_metrics.enabled:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        latency_metrics.observe_stage(stage, time.perf_counter() - start)
+
+def disable_latency_metrics():
+    """Process pool initializer: observations made in pool workers could never be exported"""
+    latency_metrics.enabled = False
+
+latency_metrics = LatencyMetrics(enabled=app.config['METRICS_ENABLED'])
+
 # Face Detection Class using OpenCV
 class OpenCVFaceDetector:
     def __init__(self):
@@ -118,6 +649,7 @@ class OpenCVFaceDetector:
         self.face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
         self.eye_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_eye.xml')
         
+    @timed_stage('detect_faces')
     def detect_faces(self, image):
         """Detect faces in an image with improved parameters"""
         try:
@@ -144,6 +676,7 @@ class OpenCVFaceDetector:
             print(f"Face detection error: {e}")
             return []
     
+    @timed_stage('extract_face_features')
     def extract_face_features(self, image, face_rect):
         """Extract simple features from a face region"""
         x, y, w, h = face_rect
@@ -172,6 +705,34 @@ class OpenCVFaceDetector:
             'face_position': [int(x), int(y)]
         }
     
+    def face_quality(self, image, face_rect):
+        """Cheap quality score in [0, 1] for a detected face, computed on a small gray ROI
+
+        Combines sharpness (variance of the Laplacian), face size, brightness and how
+        close the face is to the frame centre, so frames can be ranked before the much
+        more expensive extract_face_features.
+        """
+        x, y, w, h = [int(v) for v in face_rect]
+        gray = cv2.cvtColor(cv2.resize(image[y:y+h, x:x+w], (64, 64), interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2GRAY)
+        
+        sharpness = min(1.0, cv2.Laplacian(gray, cv2.CV_64F).var() / 300.0)
+        size = min(1.0, min(w, h) / 150.0)
+        brightness = max(0.0, 1.0 - abs(float(gray.mean()) - 128.0) / 128.0)
+        
+        frame_h, frame_w = image.shape[:2]
+        offset = np.hypot((x + w / 2) - frame_w / 2, (y + h / 2) - frame_h / 2)
+        centredness = max(0.0, 1.0 - offset / (np.hypot(frame_w, frame_h) / 2))
+        
+        score = 0.4 * sharpness + 0.2 * size + 0.2 * brightness + 0.2 * centredness
+        return {
+            'score': round(score, 4),
+            'sharpness': round(sharpness, 4),
+            'size': round(size, 4),
+            'brightness': round(brightness, 4),
+            'centredness': round(float(centredness), 4)
+        }
+    
+    @timed_stage('calculate_lbp')
     def calculate_lbp(self, image):
         """Calculate Local Binary Pattern features"""
         # Simple LBP implementation
@@ -199,7 +760,7 @@ class OpenCVFaceDetector:
         
         return hist
     
-    def train_face_model(self, face_features_list):
+    def train_face_model(self, face_features_list, num_prototypes=3):
         """Train face model from multiple feature sets"""
         if not face_features_list or len(face_features_list) == 0:
             return None
@@ -211,18 +772,96 @@ class OpenCVFaceDetector:
         avg_histogram = np.mean(all_histograms, axis=0)
         avg_lbp = np.mean(all_lbps, axis=0)
         
-        # Calculate standard deviation for confidence scoring
-        std_histogram = np.std(all_histograms, axis=0)
-        std_lbp = np.std(all_lbps, axis=0)
+        # Sums of squared deviations (M2) let update_face_model fold in more samples later;
+        # the spread is derived from them (std = sqrt(M2 / num_samples)), not stored
+        m2_histogram = np.sum((np.array(all_histograms) - avg_histogram) ** 2, axis=0)
+        m2_lbp = np.sum((np.array(all_lbps) - avg_lbp) ** 2, axis=0)
+        
+        # Cluster the samples into a few prototypes (poses, lighting) matched individually
+        labels = cluster_face_templates(
+            np.array([face_template(h, l) for h, l in zip(all_histograms, all_lbps)]), num_prototypes
+        )
+        prototypes = []
+        for cluster in range(labels.max() + 1):
+            members = np.flatnonzero(labels == cluster)
+            prototypes.append({
+                'histogram': np.mean([all_histograms[i] for i in members], axis=0).tolist(),
+                'lbp': np.mean([all_lbps[i] for i in members], axis=0).tolist(),
+                'num_samples': int(len(members))
+            })
         
         return {
+            'version': FACE_MODEL_VERSION,
             'histogram': avg_histogram.tolist(),
             'lbp': avg_lbp.tolist(),
-            'histogram_std': std_histogram.tolist(),
-            'lbp_std': std_lbp.tolist(),
-            'num_samples': len(face_features_list)
+            'histogram_m2': m2_histogram.tolist(),
+            'lbp_m2': m2_lbp.tolist(),
+            'num_samples': len(face_features_list),
+            'prototypes': prototypes
         }
     
+    def update_face_model(self, face_data, face_features_list, num_prototypes=3):
+        """Fold new feature sets into a stored face model without the original samples
+
+        Count, mean and M2 are combined with the parallel form of Welford's algorithm.
+        Each new sample joins its closest prototype (running mean), or starts a new one
+        while the model has fewer than num_prototypes.
+        """
+        if not face_features_list:
+            return face_data
+        if not face_data:
+            return self.train_face_model(face_features_list, num_prototypes)
+        
+        count = int(face_data.get('num_samples') or 1)
+        batch = len(face_features_list)
+        total = count + batch
+        updated = dict(face_data)
+        
+        for field in ('histogram', 'lbp'):
+            mean = np.array(face_data[field], dtype=np.float64)
+            if f'{field}_m2' in face_data:
+                m2 = np.array(face_data[f'{field}_m2'], dtype=np.float64)
+            else:
+                # Older models only kept the (population) std, which gives M2 exactly
+                std = face_data.get(f'{field}_std')
+                m2 = np.array(std if std is not None else np.zeros_like(mean), dtype=np.float64) ** 2 * count
+            
+            values = np.array([f[field] for f in face_features_list], dtype=np.float64)
+            batch_mean = values.mean(axis=0)
+            batch_m2 = np.sum((values - batch_mean) ** 2, axis=0)
+            delta = batch_mean - mean
+            
+            mean = mean + delta * batch / total
+            m2 = m2 + batch_m2 + delta ** 2 * count * batch / total
+            updated[field] = mean.tolist()
+            updated[f'{field}_m2'] = m2.tolist()
+            updated.pop(f'{field}_std', None)
+        
+        prototypes = [dict(p) for p in (face_data.get('prototypes') or [
+            {'histogram': face_data['histogram'], 'lbp': face_data['lbp'], 'num_samples': count}
+        ])]
+        templates = [face_template(p['histogram'], p['lbp']) for p in prototypes]
+        for features in face_features_list:
+            template = face_template(features['histogram'], features['lbp'])
+            if len(prototypes) < num_prototypes:
+                prototypes.append({'histogram': list(features['histogram']), 'lbp': list(features['lbp']), 'num_samples': 1})
+                templates.append(template)
+                continue
+            closest = int(np.argmax(np.array(templates) @ template))
+            prototype = prototypes[closest]
+            n = int(prototype.get('num_samples') or 1) + 1
+            for field in ('histogram', 'lbp'):
+                prototype[field] = (np.array(prototype[field]) + (np.array(features[field]) - np.array(prototype[field])) / n).tolist()
+            prototype['num_samples'] = n
+            templates[closest] = face_template(prototype['histogram'], prototype['lbp'])
+        
+        updated.update({
+            'version': FACE_MODEL_VERSION,
+            'num_samples': total,
+            'prototypes': prototypes
+        })
+        return updated
+    
     def compare_faces(self, features1, features2, threshold=0.65):
         """Compare two face feature sets with improved accuracy"""
         if not features1 or not features2:
@@ -254,224 +893,1988 @@ face_detector = OpenCVFaceDetector()
 camera = None
 recognition_active = False
 
-def generate_person_id():
-    """Generate auto-incrementing person ID (P001, P002, etc.)"""
-    # Get the count of existing users
-    user_count = User.query.count()
-    # Generate new person ID
-    person_id = f"P{str(user_count + 1).zfill(3)}"
-    
-    # Check if this ID already exists (in case of deletions)
-    while User.query.filter_by(person_id=person_id).first():
-        user_count += 1
-        person_id = f"P{str(user_count + 1).zfill(3)}"
-    
-    return person_id
+_process_pool = None
+_process_pool_pid = None
+_process_pool_lock = threading.Lock()
 
-# Routes
-@app.route('/')
-def index():
-    """Home page"""
-    return render_template('index_opencv.html')
+def get_process_pool():
+    """Shared process pool for CPU-bound face work, created lazily once per worker process"""
+    global _process_pool, _process_pool_pid
+    with _process_pool_lock:
+        if _process_pool is None or _process_pool_pid != os.getpid():
+            _process_pool = ProcessPoolExecutor(
+                max_workers=app.config['PROCESS_POOL_WORKERS'], initializer=disable_latency_metrics
+            )
+            _process_pool_pid = os.getpid()
+        return _process_pool
 
-@app.route('/register')
-def register():
-    """User registration page"""
-    return render_template('register_fixed.html')
+def shutdown_process_pool():
+    if _process_pool is not None and _process_pool_pid == os.getpid():
+        _process_pool.shutdown(wait=False, cancel_futures=True)
 
-@app.route('/recognize')
-def recognize():
-    """Face recognition page"""
-    return render_template('recognize_fixed.html')
+atexit.register(shutdown_process_pool)
 
+def build_face_model(captured_features):
+    """Combine one or more captures into the stored face model (means, spread and prototypes)"""
+    return face_detector.train_face_model(captured_features, app.config['FACE_PROTOTYPES'])
 
+def update_face_model(face_data, captured_features):
+    """Fold newly captured samples into a stored face model"""
+    return face_detector.update_face_model(face_data, captured_features, app.config['FACE_PROTOTYPES'])
 
-@app.route('/api/login', methods=['POST'])
-def login():
-    """Admin login endpoint"""
-    try:
-        data = request.get_json()
-        if not data:
-            return jsonify({
-                'status': 'error',
-                'message': 'No data provided'
-            }), 400
-        
-        username = data.get('username')
-        password = data.get('password')
-        
-        if not username or not password:
-            return jsonify({
-                'status': 'error',
-                'message': 'Username and password are required'
-            }), 400
-        
-        # Simple hardcoded admin credentials (in production, use proper user management)
-        if username == 'admin' and password == 'admin123':
-            # Create access token
-            access_token = create_access_token(identity=username)
-            
-            return jsonify({
-                'status': 'success',
-                'message': 'Login successful',
-                'access_token': access_token,
-                'user': {
-                    'username': username,
-                    'role': 'admin'
-                }
-            }), 200
+FACE_MODEL_ARRAYS = ('histogram', 'lbp', 'histogram_m2', 'lbp_m2')
+
+def _pack_face_array(values):
+    return base64.b64encode(np.asarray(values, dtype='<f4').tobytes()).decode('ascii')
+
+def _unpack_face_array(value):
+    if isinstance(value, str):
+        return np.frombuffer(base64.b64decode(value), dtype='<f4')
+    return np.asarray(value, dtype=np.float32)
+
+def dump_face_model(face_data):
+    """Serialize a face model for User.face_data, its arrays packed as base64 float32 (a quarter of JSON lists)"""
+    stored = {key: value for key, value in face_data.items() if not key.endswith('_std')}
+    for field in FACE_MODEL_ARRAYS:
+        if field in stored:
+            stored[field] = _pack_face_array(stored[field])
+    if 'prototypes' in stored:
+        stored['prototypes'] = [
+            dict(p, histogram=_pack_face_array(p['histogram']), lbp=_pack_face_array(p['lbp'])) for p in stored['prototypes']
+        ]
+    return json.dumps(stored)
+
+def load_face_model(text):
+    """Parse User.face_data into a face model with float32 arrays (older rows hold plain JSON lists)"""
+    face_data = json.loads(text)
+    for field in FACE_MODEL_ARRAYS + ('histogram_std', 'lbp_std'):
+        if field in face_data:
+            face_data[field] = _unpack_face_array(face_data[field])
+    for prototype in face_data.get('prototypes') or []:
+        for field in ('histogram', 'lbp'):
+            prototype[field] = _unpack_face_array(prototype[field])
+    return face_data
+
+def face_model_templates(face_data):
+    """Matching templates for a stored face model (older models have a single prototype)"""
+    prototypes = face_data.get('prototypes') or [face_data]
+    return [face_template(p.get('histogram', []), p.get('lbp', [])) for p in prototypes]
+
+class FaceGallery:
+    """Every enrolled user's prototypes as one (users x prototypes) x 512 matrix
+
+    Users with fewer prototypes are padded by repeating their last one, which leaves the
+    per-user maximum unchanged, so matching is one matrix-vector product and a row-wise max.
+    """
+
+    def __init__(self, version, user_ids, matrix, source='database'):
+        self.version = version
+        self.user_ids = np.array(user_ids, dtype=np.int64)
+        self.prototypes = app.config['FACE_PROTOTYPES']
+        self.rows = {int(user_id): row for row, user_id in enumerate(self.user_ids)}
+        self.matrix = matrix
+        self.source = source
+
+    @classmethod
+    def from_templates(cls, version, user_ids, templates):
+        gallery = cls(version, user_ids, np.zeros((len(user_ids) * app.config['FACE_PROTOTYPES'], TEMPLATE_SIZE), dtype=np.float32))
+        for row, user_templates in enumerate(templates):
+            gallery.matrix[row * gallery.prototypes:(row + 1) * gallery.prototypes] = gallery._padded(user_templates)
+        return gallery
+
+    def __len__(self):
+        return len(self.user_ids)
+
+    def _padded(self, user_templates):
+        user_templates = user_templates[:self.prototypes]
+        return np.array(user_templates + [user_templates[-1]] * (self.prototypes - len(user_templates)), dtype=np.float32)
+
+    def upsert(self, user_id, user_templates, version):
+        """Replace (or add) one user's prototypes in place and move to the given version"""
+        block = self._padded(user_templates)
+        row = self.rows.get(user_id)
+        if row is None:
+            # Readers snapshot user_ids before matrix, so swap in the grown matrix first
+            self.matrix = np.vstack([self.matrix, block])
+            self.rows[user_id] = len(self.user_ids)
+            self.user_ids = np.append(self.user_ids, user_id)
+        elif not self.matrix.flags.writeable:
+            # Mapped from a published file: patch a private copy, the caller publishes it
+            matrix = np.array(self.matrix)
+            matrix[row * self.prototypes:(row + 1) * self.prototypes] = block
+            self.matrix = matrix
         else:
-            return jsonify({
-                'status': 'error',
-                'message': 'Invalid username or password'
-            }), 401
-            
-    except Exception as e:
-        return jsonify({
-            'status': 'error',
-            'message': f'Login failed: {str(e)}'
-        }), 500
+            self.matrix[row * self.prototypes:(row + 1) * self.prototypes] = block
+        self.version = version
+        self.source = 'database'
 
-@app.route('/login')
-def login_page():
-    """Admin login page"""
-    return render_template('login.html')
+    def scores(self, face_features, user_ids=None):
+        """Best combined score per user, in user_ids order"""
+        return self.batch_scores([face_features], user_ids)[0]
 
-@app.route('/admin')
-def admin():
-    """Admin dashboard - client-side authentication check"""
-    # Just render the page, authentication is checked client-side
-    return render_template('admin.html')
+    def batch_scores(self, face_features_list, user_ids=None):
+        """Best combined score per user for several faces at once, shape (faces, users)
 
-@app.route('/capture/<int:user_id>')
-def capture_user_face(user_id):
-    """Face capture page for specific user"""
-    user = User.query.get(user_id)
-    if not user:
-        return "User not found", 404
-    
-    return render_template('capture_face.html', user=user)
+        One matrix-matrix product, so the gallery is read from memory once for the whole batch.
+        """
+        if user_ids is None:
+            user_ids = self.user_ids
+        matrix = self.matrix[:len(user_ids) * self.prototypes]
+        queries = np.array([face_template(f.get('histogram', []), f.get('lbp', [])) * TEMPLATE_WEIGHTS
+                            for f in face_features_list], dtype=np.float32)
+        scores = (matrix @ queries.T).reshape(len(user_ids), self.prototypes, len(queries))
+        return scores.max(axis=1).T
 
-@app.route('/video_feed')
-def video_feed():
-    """Video streaming route with face detection"""
-    camera_index = request.args.get('camera', 0, type=int)
-    
-    def generate():
-        cap = None
-        error_count = 0
-        max_errors = 10
-        consecutive_errors = 0
-        last_frame_time = time.time()
-        
-        while True:  # Outer loop to keep trying
+    def user_score(self, user_id, face_features):
+        """Best combined score against one user's prototypes, or None if the user is not in the gallery"""
+        row = self.rows.get(user_id)
+        if row is None:
+            return None
+        query = (face_template(face_features.get('histogram', []), face_features.get('lbp', [])) * TEMPLATE_WEIGHTS).astype(np.float32)
+        return float((self.matrix[row * self.prototypes:(row + 1) * self.prototypes] @ query).max())
+
+    def match(self, face_features, threshold=None):
+        """(user_id, score) of the best match above the threshold, or (None, 0.0)"""
+        return self.match_many([face_features], threshold)[0]
+
+    def match_many(self, face_features_list, threshold=None):
+        """match() for several faces with a single gallery product"""
+        if threshold is None:
+            threshold = app.config['FACE_MATCH_THRESHOLD']
+        user_ids = self.user_ids
+        if len(user_ids) == 0:
+            return [(None, 0.0)] * len(face_features_list)
+        scores = self.batch_scores(face_features_list, user_ids)
+        best = np.argmax(scores, axis=1)
+        results = []
+        for row, column in enumerate(best):
+            score = float(scores[row, column])
+            results.append((int(user_ids[column]), score) if score > threshold else (None, 0.0))
+        return results
+
+    @classmethod
+    def load(cls, version):
+        user_ids = []
+        templates = []
+        for user_id, face_data in db.session.query(User.id, User.face_data).filter(User.face_data.isnot(None)):
             try:
-                # Try multiple camera backends for better compatibility
-                if cap is None or not cap.isOpened():
-                    print(f"Initializing camera {camera_index} for video feed...")
-                    cap = initialize_camera(camera_index)
-                    error_count = 0
-                    consecutive_errors = 0
-                
-                if not cap or not cap.isOpened():
-                    # Create a placeholder frame if camera fails
-                    placeholder = create_placeholder_frame("Camera not available - Retrying...")
-                    ret, buffer = cv2.imencode('.jpg', placeholder)
-                    if ret:
-                        frame = buffer.tobytes()
-                        yield (b'--frame\r\n'
-                               b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
-                    time.sleep(1)
-                    continue
-                
-                frame_count = 0
-                while cap and cap.isOpened():
-                    try:
-                        ret, frame = cap.read()
-                        current_time = time.time()
-                        
-                        if not ret or frame is None:
-                            consecutive_errors += 1
-                            error_count += 1
-                            
-                            if consecutive_errors > 3:
-                                print(f"Camera read failed {consecutive_errors} times, reinitializing...")
-                                if cap:
-                                    cap.release()
-                                    cap = None
-                                break  # Break inner loop to reinitialize
-                            
-                            # Send placeholder while recovering
-                            placeholder = create_placeholder_frame("Camera reconnecting...")
-                            ret, buffer = cv2.imencode('.jpg', placeholder)
-                            if ret:
-                                frame = buffer.tobytes()
-                                yield (b'--frame\r\n'
-                                       b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
-                            time.sleep(0.5)
-                            continue
-                        
-                        consecutive_errors = 0  # Reset on successful read
-                        error_count = 0
-                        last_frame_time = current_time
-                        
-                        # Detect faces (with error handling)
-                        try:
-                            faces = face_detector.detect_faces(frame)
-                            
-                            # Draw rectangles around faces
-                            for (x, y, w, h) in faces:
-                                cv2.rectangle(frame, (x, y), (x+w, y+h), (0, 255, 0), 2)
-                                cv2.putText(frame, 'Face Detected', (x, y-10), 
-                                           cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
-                            
-                            # Add info overlay
-                            cv2.putText(frame, f'OpenCV Face Detection - {len(faces)} faces', 
-                                       (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 0), 2)
-                            cv2.putText(frame, f'Time: {datetime.now().strftime("%H:%M:%S")}', 
-                                       (10, 60), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
-                        except Exception as e:
-                            print(f"Face detection error: {e}")
-                            # Continue with frame even if face detection fails
-                        
-                        ret, buffer = cv2.imencode('.jpg', frame)
-                        if ret:
-                            frame = buffer.tobytes()
-                            yield (b'--frame\r\n'
-                                   b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
-                        
-                        frame_count += 1
-                        # Limit frame rate
-                        time.sleep(0.05)  # ~20 FPS
-                        
-                    except Exception as e:
-                        print(f"Frame processing error: {e}")
-                        consecutive_errors += 1
-                        if consecutive_errors > 5:
-                            if cap:
-                                cap.release()
-                                cap = None
-                            break
-                        time.sleep(0.5)
-                        continue
-                        
+                user_templates = face_model_templates(load_face_model(face_data))
             except Exception as e:
-                print(f"Video feed error: {e}")
-                if cap:
-                    try:
-                        cap.release()
-                    except:
-                        pass
-                    cap = None
-                time.sleep(1)
+                print(f"Skipping face model of user {user_id}: {e}")
                 continue
-    
-    return Response(generate(), mimetype='multipart/x-mixed-replace; boundary=frame')
+            if user_templates:
+                user_ids.append(user_id)
+                templates.append(user_templates)
+        return cls.from_templates(version, user_ids, templates)
 
-def initialize_camera(camera_index=0):
-    """Initialize camera with multiple backend options for better compatibility"""
-    backends = [
-        cv2.CAP_DSHOW,      # DirectShow (Windows)
+def face_gallery_fingerprint():
+    """Database epoch and highest user id (two key lookups), so a published file never outlives a recreated database"""
+    max_id = db.session.query(db.func.max(User.id)).scalar()
+    return [get_counter(FACE_GALLERY_EPOCH), max_id or 0]
+
+class FaceGalleryStore:
+    """Published gallery versions as .npy files that every worker process maps read-only
+
+    Each version is an immutable matrix file plus a JSON sidecar holding every user's id and
+    row offset. Both are written to temporary files and renamed into place, sidecar first, so
+    a matrix file that exists is complete. The mapped pages live once in the OS page cache
+    however many workers use them, and a starting worker maps the current version instead of
+    rebuilding it from the database.
+    """
+
+    def __init__(self, folder, keep=3):
+        self.folder = folder
+        self.keep = keep
+        # Galleries of different databases can share a folder
+        self.prefix = 'gallery-' + hashlib.sha256(app.config['SQLALCHEMY_DATABASE_URI'].encode()).hexdigest()[:12]
+
+    def _paths(self, version):
+        base = os.path.join(self.folder, f"{self.prefix}-v{version}")
+        return f"{base}.npy", f"{base}.json"
+
+    def load(self, version, fingerprint):
+        """The published gallery for this version, memory-mapped, or None"""
+        matrix_path, sidecar_path = self._paths(version)
+        if not os.path.exists(matrix_path):
+            return None
+        try:
+            with open(sidecar_path, 'r', encoding='utf-8') as f:
+                sidecar = json.load(f)
+            prototypes = app.config['FACE_PROTOTYPES']
+            if (sidecar['model_version'] != FACE_MODEL_VERSION or sidecar['prototypes'] != prototypes
+                    or sidecar['fingerprint'] != fingerprint):
+                return None
+            matrix = np.load(matrix_path, mmap_mode='r')
+            if matrix.dtype != np.float32 or matrix.shape != (len(sidecar['user_ids']) * prototypes, TEMPLATE_SIZE):
+                return None
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Ignoring published face gallery {matrix_path}: {e}")
+            return None
+        return FaceGallery(version, sidecar['user_ids'], matrix, source='file')
+
+    def publish(self, gallery, fingerprint):
+        """Write the gallery as its version's file; returns the gallery mapped from that file"""
+        matrix_path, sidecar_path = self._paths(gallery.version)
+        temporary = f".{os.getpid()}.{threading.get_ident()}.tmp"
+        user_ids = [int(user_id) for user_id in gallery.user_ids]
+        try:
+            os.makedirs(self.folder, exist_ok=True)
+            with open(sidecar_path + temporary, 'w', encoding='utf-8') as f:
+                json.dump({
+                    'version': gallery.version,
+                    'model_version': FACE_MODEL_VERSION,
+                    'prototypes': gallery.prototypes,
+                    'fingerprint': fingerprint,
+                    'user_ids': user_ids,
+                    'offsets': [row * gallery.prototypes for row in range(len(user_ids))]
+                }, f)
+            os.replace(sidecar_path + temporary, sidecar_path)
+            with open(matrix_path + temporary, 'wb') as f:
+                np.save(f, np.ascontiguousarray(gallery.matrix[:len(user_ids) * gallery.prototypes], dtype=np.float32))
+            os.replace(matrix_path + temporary, matrix_path)
+        except OSError as e:
+            print(f"Failed to publish face gallery version {gallery.version}: {e}")
+            for path in (sidecar_path + temporary, matrix_path + temporary):
+                if os.path.exists(path):
+                    os.remove(path)
+            return gallery
+        self.prune()
+        return self.load(gallery.version, fingerprint) or gallery
+
+    def versions(self):
+        versions = []
+        if os.path.isdir(self.folder):
+            for name in os.listdir(self.folder):
+                if name.startswith(self.prefix + '-v') and name.endswith('.npy'):
+                    try:
+                        versions.append(int(name[len(self.prefix) + 2:-4]))
+                    except ValueError:
+                        continue
+        return sorted(versions)
+
+    def prune(self):
+        """Delete all but the newest keep versions (workers still mapping one keep their pages)"""
+        if self.keep <= 0:
+            return
+        for version in self.versions()[:-self.keep]:
+            for path in self._paths(version):
+                try:
+                    os.remove(path)
+                except OSError:
+                    # Windows refuses to delete a file another process has mapped; retry next time
+                    pass
+
+face_gallery_store = FaceGalleryStore(
+    app.config['FACE_GALLERY_FOLDER'], app.config['FACE_GALLERY_KEEP']
+) if app.config['FACE_GALLERY_FOLDER'] else None
+
+_face_gallery = None
+_face_gallery_lock = threading.Lock()
+
+def get_face_gallery():
+    """The current gallery: mapped from its published file, else rebuilt from the database (and published)"""
+    global _face_gallery
+    version = get_counter(FACE_GALLERY_VERSION)
+    gallery = _face_gallery
+    if gallery is not None and gallery.version == version:
+        return gallery
+    with _face_gallery_lock:
+        if _face_gallery is None or _face_gallery.version != version:
+            fingerprint = face_gallery_fingerprint() if face_gallery_store else None
+            gallery = face_gallery_store.load(version, fingerprint) if face_gallery_store else None
+            if gallery is not None:
+                print(f"Face gallery mapped: {len(gallery)} users (version {version})")
+            else:
+                gallery = FaceGallery.load(version)
+                print(f"Face gallery rebuilt: {len(gallery)} users (version {version})")
+                if face_gallery_store:
+                    gallery = face_gallery_store.publish(gallery, fingerprint)
+            _face_gallery = gallery
+        return _face_gallery
+
+class MatchBatcher:
+    """Collects concurrent gallery matches and answers them with one matrix product
+
+    The first waiting query opens a batch; the batch closes after window_ms or once it
+    holds max_batch queries, and a single (B x 512)(512 x N) product serves all of them.
+    """
+
+    def __init__(self, window_ms=2.0, max_batch=32, timeout=1.0):
+        self.window = window_ms / 1000.0
+        self.max_batch = max_batch
+        self.timeout = timeout
+        self.queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._stats = {
+            'queries': 0,
+            'batches': 0,
+            'max_batch_size': 0,
+            'total_queue_ms': 0.0,
+            'max_queue_ms': 0.0,
+            'total_match_ms': 0.0,
+            'failed': 0,
+            'timeouts': 0
+        }
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='match-batcher', daemon=True)
+            self._thread.start()
+
+    def match(self, gallery, face_features):
+        """Same result as gallery.match(face_features), computed in a shared batch"""
+        if self.window <= 0 or self.max_batch <= 1:
+            return gallery.match(face_features)
+        self.start()
+        item = {'gallery': gallery, 'features': face_features, 'queued': time.perf_counter(),
+                'done': threading.Event(), 'result': None, 'error': None}
+        self.queue.put(item)
+        if not item['done'].wait(self.timeout):
+            # The batch thread is stuck or gone; answer this query directly rather than hang the request
+            with self._lock:
+                self._stats['timeouts'] += 1
+            return gallery.match(face_features)
+        if item['error'] is not None:
+            raise item['error']
+        return item['result']
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            closes = time.perf_counter() + self.window
+            while len(batch) < self.max_batch:
+                remaining = closes - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._match(batch)
+
+    def _match(self, batch):
+        started = time.perf_counter()
+        # A gallery rebuild can land mid-window; each query is matched against the gallery it was read with
+        groups = {}
+        for item in batch:
+            groups.setdefault(id(item['gallery']), []).append(item)
+        for items in groups.values():
+            try:
+                results = items[0]['gallery'].match_many([item['features'] for item in items])
+                for item, result in zip(items, results):
+                    item['result'] = result
+            except Exception as e:
+                for item in items:
+                    item['error'] = e
+                with self._lock:
+                    self._stats['failed'] += len(items)
+        finished = time.perf_counter()
+
+        queue_ms = [(started - item['queued']) * 1000 for item in batch]
+        for item in batch:
+            item['done'].set()
+        with self._lock:
+            self._stats['queries'] += len(batch)
+            self._stats['batches'] += 1
+            self._stats['max_batch_size'] = max(self._stats['max_batch_size'], len(batch))
+            self._stats['total_queue_ms'] += sum(queue_ms)
+            self._stats['max_queue_ms'] = max(self._stats['max_queue_ms'], max(queue_ms))
+            self._stats['total_match_ms'] += (finished - started) * 1000
+
+    def metrics(self):
+        with self._lock:
+            stats = dict(self._stats)
+        batches = stats.pop('batches')
+        queries = stats['queries']
+        return {
+            'window_ms': self.window * 1000,
+            'max_batch': self.max_batch,
+            'queries': queries,
+            'batches': batches,
+            'avg_batch_size': round(queries / batches, 2) if batches else 0.0,
+            'max_batch_size': stats['max_batch_size'],
+            'avg_queue_ms': round(stats['total_queue_ms'] / queries, 3) if queries else 0.0,
+            'max_queue_ms': round(stats['max_queue_ms'], 3),
+            'avg_match_ms': round(stats['total_match_ms'] / batches, 3) if batches else 0.0,
+            'queue_depth': self.queue.qsize(),
+            'failed': stats['failed'],
+            'timeouts': stats['timeouts']
+        }
+
+match_batcher = MatchBatcher(
+    app.config['MATCH_BATCH_WINDOW_MS'], app.config['MATCH_BATCH_MAX'], app.config['MATCH_BATCH_TIMEOUT']
+)
+
+def face_iou(a, b):
+    """Intersection over union of two (x, y, w, h) face rectangles"""
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    overlap_w = min(ax + aw, bx + bw) - max(ax, bx)
+    overlap_h = min(ay + ah, by + bh) - max(ay, by)
+    if overlap_w <= 0 or overlap_h <= 0:
+        return 0.0
+    overlap = overlap_w * overlap_h
+    return overlap / float(aw * ah + bw * bh - overlap)
+
+class IdentityCache:
+    """Last confident match per client session, so a person standing at the camera is not searched for on every frame
+
+    A frame whose face overlaps the cached face rectangle (IoU) within the TTL is scored
+    against the cached user's prototypes only. It must reach min_confidence again, otherwise
+    the entry is dropped and the caller does a full gallery search.
+    """
+
+    def __init__(self, ttl, iou_threshold=0.5, min_confidence=0.7, max_sessions=1000):
+        self.ttl = ttl
+        self.iou_threshold = iou_threshold
+        self.min_confidence = min_confidence
+        self.max_sessions = max_sessions
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'reverify_failed': 0
+        }
+
+    def match(self, session_key, rect, gallery, face_features):
+        """(user_id, score) if the session's cached user is reverified for this face, else None"""
+        if self.ttl <= 0 or not session_key:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(session_key)
+            if entry is None or entry['expires'] < now or face_iou(entry['rect'], rect) < self.iou_threshold:
+                self._stats['misses'] += 1
+                return None
+            user_id = entry['user_id']
+        score = gallery.user_score(user_id, face_features)
+        with self._lock:
+            # Another request may have replaced or dropped the entry while this one was scoring
+            if score is None or score < self.min_confidence:
+                if self._entries.get(session_key) is entry:
+                    self._entries.pop(session_key)
+                self._stats['reverify_failed'] += 1
+                return None
+            self._stats['hits'] += 1
+            if self._entries.get(session_key) is entry:
+                entry.update(rect=rect, expires=now + self.ttl)
+        return user_id, score
+
+    def remember(self, session_key, rect, user_id, confidence):
+        """Cache a full-search result for the session (only confident matches are kept)"""
+        if self.ttl <= 0 or not session_key:
+            return
+        with self._lock:
+            if user_id is None or confidence < self.min_confidence:
+                self._entries.pop(session_key, None)
+                return
+            if session_key not in self._entries and len(self._entries) >= self.max_sessions:
+                now = time.monotonic()
+                self._entries = {key: entry for key, entry in self._entries.items() if entry['expires'] >= now}
+                if len(self._entries) >= self.max_sessions:
+                    self._entries.pop(min(self._entries, key=lambda key: self._entries[key]['expires']))
+            self._entries[session_key] = {'user_id': user_id, 'rect': rect, 'expires': time.monotonic() + self.ttl}
+
+    def metrics(self):
+        with self._lock:
+            stats = dict(self._stats)
+            sessions = len(self._entries)
+        lookups = stats['hits'] + stats['misses'] + stats['reverify_failed']
+        return {
+            'ttl': self.ttl,
+            'iou_threshold': self.iou_threshold,
+            'min_confidence': self.min_confidence,
+            'sessions': sessions,
+            'lookups': lookups,
+            'hit_rate': round(stats['hits'] / lookups, 4) if lookups else 0.0,
+            **stats
+        }
+
+identity_cache = IdentityCache(
+    app.config['IDENTITY_CACHE_TTL'],
+    iou_threshold=app.config['IDENTITY_CACHE_IOU'],
+    min_confidence=app.config['IDENTITY_CACHE_MIN_CONFIDENCE'],
+    max_sessions=app.config['IDENTITY_CACHE_MAX_SESSIONS']
+)
+
+def find_duplicate_face(face_data, exclude_user_id=None):
+    """Closest enrolled person to a new face model, if it scores above DUPLICATE_FACE_THRESHOLD
+
+    Every prototype of the new model is scored against the whole gallery at once.
+    Returns None when DUPLICATE_FACE_POLICY is 'allow' or nothing is close enough.
+    """
+    if app.config['DUPLICATE_FACE_POLICY'] == 'allow':
+        return None
+    gallery = get_face_gallery()
+    user_ids = gallery.user_ids
+    if len(user_ids) == 0:
+        return None
+    
+    scores = gallery.batch_scores(face_data.get('prototypes') or [face_data], user_ids).max(axis=0)
+    if exclude_user_id is not None:
+        scores[user_ids == exclude_user_id] = -1.0
+    best = int(np.argmax(scores))
+    if scores[best] < app.config['DUPLICATE_FACE_THRESHOLD']:
+        return None
+    
+    user = db.session.get(User, int(user_ids[best]))
+    if user is None:
+        return None
+    print(f"Possible duplicate enrollment: matches {user.person_id} ({user.name}) with score {scores[best]:.3f}")
+    return {
+        'user_id': user.id,
+        'person_id': user.person_id,
+        'name': user.name,
+        'score': round(float(scores[best]), 4)
+    }
+
+def duplicate_face_rejection(duplicate):
+    """409 response for DUPLICATE_FACE_POLICY=reject, or None if the enrollment may proceed"""
+    if duplicate is None or app.config['DUPLICATE_FACE_POLICY'] != 'reject':
+        return None
+    return jsonify({
+        'status': 'error',
+        'message': f"This face is already enrolled as {duplicate['person_id']}",
+        'duplicate_of': duplicate
+    }), 409
+
+def match_recognized_face(face_features, image_path=None, session_key=None, rect=None):
+    """Match extracted features against the gallery, queue the log entry and build the API response
+
+    With a client session key and the face rectangle, a face that stays in place is
+    reverified against the session's last confident match before searching the gallery.
+    """
+    # Compare with stored faces (all users' prototypes in one vectorized pass)
+    gallery = get_face_gallery()
+    
+    if len(gallery) == 0:
+        return {
+            'status': 'error',
+            'message': 'No registered users with face data found in the system.'
+        }
+    
+    rect = [int(v) for v in rect] if rect is not None else None
+    with timed_stage('gallery_match'):
+        cached = identity_cache.match(session_key, rect, gallery, face_features) if rect is not None else None
+        if cached is not None:
+            best_match_id, best_confidence = cached
+        else:
+            best_match_id, best_confidence = match_batcher.match(gallery, face_features)
+            if rect is not None:
+                identity_cache.remember(session_key, rect, best_match_id, best_confidence)
+    best_match = db.session.get(User, best_match_id) if best_match_id is not None else None
+    
+    # Log the recognition attempt (written in the background, off the response path)
+    recognition_log_writer.submit(
+        user_id=best_match.id if best_match else None,
+        confidence=best_confidence,
+        status='recognized' if best_match else 'unknown',
+        image_path=image_path
+    )
+    
+    if best_match:
+        print(f"✅ Face recognized: {best_match.name} (confidence: {best_confidence})")
+        return {
+            'status': 'success',
+            'message': f'Face recognized: {best_match.name}',
+            'user': best_match.to_dict(),
+            'confidence': float(best_confidence)
+        }
+    print(f"❌ Face not recognized (best confidence: {best_confidence})")
+    return {
+        'status': 'error',
+        'message': 'Unknown user - Face detected but not recognized in the system.',
+        'confidence': float(best_confidence)
+    }
+
+def recognition_session_key(session_id, client_address):
+    """Identity cache key for a client-supplied recognition session id (None disables the cache)"""
+    if not session_id:
+        return None
+    return f"{client_address}:{str(session_id)[:64]}"
+
+def extract_recognition_face(image_data):
+    """Decode an uploaded image and extract features for its first face (runs inside the process pool)
+
+    Returns (features, face crop, face rectangle), or None when no face is found.
+    """
+    frame = decode_image_data(image_data)
+    faces = face_detector.detect_faces(frame)
+    if len(faces) == 0:
+        return None
+    x, y, w, h = [int(v) for v in faces[0]]
+    return face_detector.extract_face_features(frame, faces[0]), frame[y:y+h, x:x+w].copy(), [x, y, w, h]
+
+def detect_faces_in_image(image_data):
+    """Decode an uploaded image and detect faces (runs inside the process pool); returns (faces, (height, width))"""
+    frame = decode_image_data(image_data)
+    faces = face_detector.detect_faces(frame)
+    return [[int(v) for v in face] for face in faces], frame.shape[:2]
+
+_face_gallery_publisher = None
+_face_gallery_publisher_pid = None
+_face_gallery_publisher_lock = threading.Lock()
+
+def get_face_gallery_publisher():
+    """Single background thread that publishes patched galleries, created lazily once per worker process"""
+    global _face_gallery_publisher, _face_gallery_publisher_pid
+    with _face_gallery_publisher_lock:
+        if _face_gallery_publisher is None or _face_gallery_publisher_pid != os.getpid():
+            _face_gallery_publisher = ThreadPoolExecutor(max_workers=1, thread_name_prefix='gallery-publish')
+            _face_gallery_publisher_pid = os.getpid()
+        return _face_gallery_publisher
+
+def publish_face_gallery():
+    """Publish this process's current gallery unless its version is already on disk (runs on the publisher)"""
+    global _face_gallery
+    with app.app_context():
+        try:
+            fingerprint = face_gallery_fingerprint()
+            version = get_counter(FACE_GALLERY_VERSION)
+            if version in face_gallery_store.versions():
+                return
+            with _face_gallery_lock:
+                gallery = _face_gallery
+                if gallery is None or gallery.version != version:
+                    return
+                # upsert() writes rows in place, so publish a private copy
+                snapshot = FaceGallery(gallery.version, gallery.user_ids, np.array(gallery.matrix))
+            published = face_gallery_store.publish(snapshot, fingerprint)
+            with _face_gallery_lock:
+                if _face_gallery is gallery and gallery.version == published.version:
+                    _face_gallery = published
+        except Exception as e:
+            print(f"Failed to publish face gallery: {e}")
+        finally:
+            db.session.remove()
+
+def refresh_face_gallery_entries(face_models):
+    """After committing new face models ({user_id: model}), patch those users into the gallery instead of rebuilding
+
+    Only possible when the gallery was current just before this change (one version bump
+    behind); otherwise another change happened in between and the next get_face_gallery()
+    call rebuilds as usual. The patched version is published in the background, and other
+    workers map it from there once it is written.
+    """
+    if not face_models:
+        return
+    version = get_counter(FACE_GALLERY_VERSION)
+    with _face_gallery_lock:
+        if _face_gallery is None or _face_gallery.version != version - 1:
+            return
+        for user_id, face_data in face_models.items():
+            _face_gallery.upsert(user_id, face_model_templates(face_data), version)
+    if face_gallery_store:
+        get_face_gallery_publisher().submit(publish_face_gallery)
+
+def refresh_face_gallery_entry(user_id, face_data):
+    """refresh_face_gallery_entries() for one user's new face model"""
+    refresh_face_gallery_entries({user_id: face_data})
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+def enroll_from_image_files(image_paths, min_images=3):
+    """Build a face model from image files (runs inside the process pool)"""
+    captured_features = []
+    for path in image_paths:
+        frame = cv2.imread(path)
+        if frame is None:
+            continue
+        faces = face_detector.detect_faces(frame)
+        if len(faces) > 0:
+            captured_features.append(face_detector.extract_face_features(frame, faces[0]))
+
+    if len(captured_features) < min_images:
+        return {
+            'face_data': None,
+            'images': len(image_paths),
+            'faces': len(captured_features),
+            'error': f'Only {len(captured_features)} of {len(image_paths)} images had a detectable face, need at least {min_images}'
+        }
+    return {
+        'face_data': build_face_model(captured_features),
+        'images': len(image_paths),
+        'faces': len(captured_features),
+        'error': None
+    }
+
+@timed_stage('decode')
+def decode_image_data(image_data):
+    """Decode a base64 (optionally data URL) image into an OpenCV BGR frame"""
+    # Remove data URL prefix if present
+    if ',' in image_data:
+        image_data = image_data.split(',')[1]
+    image = Image.open(io.BytesIO(base64.b64decode(image_data)))
+    return cv2.cvtColor(np.array(image.convert('RGB')), cv2.COLOR_RGB2BGR)
+
+def process_training_image(image_data):
+    """Decode one uploaded image and extract features for its first face (runs inside the process pool)
+
+    Returns (features, face crop), or None when no face is found.
+    """
+    frame = decode_image_data(image_data)
+    faces = face_detector.detect_faces(frame)
+    if len(faces) == 0:
+        return None
+    x, y, w, h = [int(v) for v in faces[0]]
+    return face_detector.extract_face_features(frame, faces[0]), frame[y:y+h, x:x+w].copy()
+
+@timed_stage('process_pool')
+def process_training_images(images, target_samples=0):
+    """Extract features from uploaded images in the process pool, collecting results as they finish
+
+    Stops early once target_samples faces are found (0 processes every image). Returns the
+    features and archived crop paths in upload order, so the model does not depend on
+    completion order.
+    """
+    futures = {get_process_pool().submit(process_training_image, image_data): idx
+               for idx, image_data in enumerate(images)}
+    results = {}
+    try:
+        for future in as_completed(futures):
+            idx = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"Error processing image {idx + 1}: {e}")
+                continue
+            if result is None:
+                continue
+            results[idx] = result
+            print(f"✓ Processed image {idx + 1}/{len(images)}")
+            if target_samples and len(results) >= target_samples:
+                print(f"Collected {len(results)} face images, skipping the rest")
+                break
+    finally:
+        for future in futures:
+            future.cancel()
+    
+    captured_features = [results[idx][0] for idx in sorted(results)]
+    sample_paths = [enrollment_crop_archive.store_crop(results[idx][1]) for idx in sorted(results)]
+    return captured_features, sample_paths
+
+PERSON_ID_SEQUENCE = 'person_id_seq'
+
+def format_person_id(number):
+    return f"P{str(number).zfill(3)}"
+
+def allocate_person_ids(count=1):
+    """Reserve a block of consecutive person numbers with one atomic counter update
+
+    The counter row stays locked until the caller's transaction ends, so concurrent
+    registrations can never receive the same number, and a rolled-back registration
+    hands its numbers back. Returns the first number of the block.
+    """
+    table = AppCounter.__table__
+    stmt = table.update().where(table.c.name == PERSON_ID_SEQUENCE).values(value=table.c.value + count)
+    if getattr(db.engine.dialect, 'update_returning', False):
+        last = db.session.execute(stmt.returning(table.c.value)).scalar()
+    else:
+        db.session.execute(stmt)
+        last = db.session.query(AppCounter.value).filter(AppCounter.name == PERSON_ID_SEQUENCE).scalar()
+    if last is None:
+        raise RuntimeError('Person ID sequence is not initialized')
+    return last - count + 1
+
+def generate_person_id():
+    """Generate the next person ID (P001, P002, etc.) from the shared sequence"""
+    return format_person_id(allocate_person_ids(1))
+
+def ensure_person_id_sequence():
+    """Seed the person ID sequence from the highest existing ID (one-time scan)"""
+    if db.session.get(AppCounter, PERSON_ID_SEQUENCE) is not None:
+        return
+    highest = 0
+    for (person_id,) in db.session.query(User.person_id).filter(User.person_id.like('P%')):
+        if person_id[1:].isdigit():
+            highest = max(highest, int(person_id[1:]))
+    ensure_counter(PERSON_ID_SEQUENCE, highest)
+
+USER_IMPORT_FIELDS = (
+    'name', 'email', 'phone', 'address', 'city', 'college_name', 'department', 'course', 'year_of_study'
+)
+
+def parse_user_records(stream, record_format):
+    """Yield (row_number, record) pairs from a CSV or NDJSON text stream"""
+    if record_format == 'csv':
+        for row_number, record in enumerate(csv.DictReader(stream), 1):
+            yield row_number, record
+        return
+
+    for row_number, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield row_number, json.loads(line)
+        except ValueError as e:
+            yield row_number, {'_error': f'Invalid JSON: {e}'}
+
+def find_person_images(images_root, record):
+    """Image files for a record: <images_root>/<image_dir>, defaulting to the email as directory name"""
+    if not images_root:
+        return []
+    root = os.path.abspath(images_root)
+    person_dir = os.path.abspath(os.path.join(root, record.get('image_dir') or record['email']))
+    if os.path.commonpath([root, person_dir]) != root or not os.path.isdir(person_dir):
+        return []
+    return sorted(
+        os.path.join(person_dir, name) for name in os.listdir(person_dir)
+        if name.lower().endswith(IMAGE_EXTENSIONS)
+    )
+
+def import_users(records, images_root=None, batch_size=200, min_images=3, progress=None):
+    """Create users from (row_number, record) pairs and enroll faces from their image directories
+
+    Users are inserted in batched transactions with person IDs reserved one block per batch.
+    Face detection and feature extraction run across the process pool. Failures are reported
+    per row and never abort the rest of the import. progress(rows, faces), if given, is
+    called between transactions.
+    """
+    report = []
+    seen_emails = set()
+    pending = []
+
+    def insert_batch(batch):
+        emails = [record['email'] for _, record in batch]
+        existing = {row[0] for row in db.session.query(User.email).filter(User.email.in_(emails))}
+        new_records = []
+        for row_number, record in batch:
+            if record['email'] in existing:
+                report.append({'row': row_number, 'email': record['email'], 'status': 'error',
+                               'error': 'User with this email already exists'})
+            else:
+                new_records.append((row_number, record))
+        batch = new_records
+        if not batch:
+            return []
+
+        try:
+            first_number = allocate_person_ids(len(batch))
+            users = [
+                User(person_id=format_person_id(first_number + offset),
+                     **{field: record.get(field) or None for field in USER_IMPORT_FIELDS})
+                for offset, (_, record) in enumerate(batch)
+            ]
+            db.session.add_all(users)
+            db.session.flush()
+            # Read ids before the commit expires the objects (one refresh SELECT per user otherwise)
+            created_users = [(row_number, record, user.id, user.person_id)
+                             for (row_number, record), user in zip(batch, users)]
+            db.session.commit()
+            return created_users
+        except Exception as e:
+            db.session.rollback()
+            if len(batch) == 1:
+                row_number, record = batch[0]
+                report.append({'row': row_number, 'email': record['email'], 'status': 'error', 'error': str(e)})
+                return []
+            # Isolate the failing row(s) by retrying one at a time
+            created = []
+            for item in batch:
+                created.extend(insert_batch([item]))
+            return created
+
+    created = []
+    for row_number, record in records:
+        record = {key: (value.strip() if isinstance(value, str) else value) for key, value in record.items()}
+        if record.get('_error'):
+            report.append({'row': row_number, 'status': 'error', 'error': record['_error']})
+            continue
+        if not record.get('name') or not record.get('email'):
+            report.append({'row': row_number, 'email': record.get('email'), 'status': 'error',
+                           'error': 'Name and email are required'})
+            continue
+        if record['email'] in seen_emails:
+            report.append({'row': row_number, 'email': record['email'], 'status': 'error',
+                           'error': 'Duplicate email in import file'})
+            continue
+        seen_emails.add(record['email'])
+        pending.append((row_number, record))
+        if len(pending) >= batch_size:
+            created.extend(insert_batch(pending))
+            pending = []
+            if progress:
+                progress(len(report) + len(created), 0)
+    if pending:
+        created.extend(insert_batch(pending))
+    if progress:
+        progress(len(report) + len(created), 0)
+
+    # Enroll faces in parallel; write face models back in batches as results complete
+    results = {}
+    futures = {}
+    for row_number, record, user_id, person_id in created:
+        results[row_number] = {
+            'row': row_number, 'email': record['email'], 'status': 'created',
+            'user_id': user_id, 'person_id': person_id, 'face_enrolled': False
+        }
+        image_paths = find_person_images(images_root, record)
+        if image_paths:
+            futures[get_process_pool().submit(enroll_from_image_files, image_paths, min_images)] = (row_number, user_id)
+        elif images_root:
+            results[row_number]['face_error'] = 'No images found'
+
+    face_updates = []
+    face_models = {}
+
+    def write_face_updates():
+        if face_updates:
+            # Bulk updates skip the flush hook, so both versions are bumped here
+            db.session.bulk_update_mappings(User, face_updates)
+            bump_counter(USERS_VERSION)
+            bump_counter(FACE_GALLERY_VERSION)
+            db.session.commit()
+            refresh_face_gallery_entries(face_models)
+            face_updates.clear()
+            face_models.clear()
+
+    faces_done = 0
+    for future in as_completed(futures):
+        row_number, user_id = futures[future]
+        faces_done += 1
+        try:
+            enrollment = future.result()
+        except Exception as e:
+            enrollment = {'face_data': None, 'error': str(e)}
+        if enrollment['face_data'] is None:
+            results[row_number]['face_error'] = enrollment['error']
+            continue
+        face_updates.append({'id': user_id, 'face_data': dump_face_model(enrollment['face_data'])})
+        face_models[user_id] = enrollment['face_data']
+        results[row_number]['face_enrolled'] = True
+        results[row_number]['face_images'] = enrollment['faces']
+        if len(face_updates) >= batch_size:
+            write_face_updates()
+            if progress:
+                progress(len(report) + len(created), faces_done)
+    write_face_updates()
+    if progress and futures:
+        progress(len(report) + len(created), faces_done)
+
+    report.extend(results.values())
+    report.sort(key=lambda item: item['row'])
+    return report
+
+def summarize_import(report):
+    return {
+        'rows': len(report),
+        'created': sum(1 for item in report if item['status'] == 'created'),
+        'failed': sum(1 for item in report if item['status'] == 'error'),
+        'faces_enrolled': sum(1 for item in report if item.get('face_enrolled'))
+    }
+
+STAT_PERIODS = ('hour', 'day', 'total')
+STAT_TOTAL_BUCKET = datetime(1970, 1, 1)
+STATS_BACKFILL_UPTO = 'stats_backfill_upto'
+
+def stat_bucket_start(period, timestamp):
+    """Start of the rollup bucket containing the timestamp"""
+    if period == 'hour':
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+    if period == 'day':
+        return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+    return STAT_TOTAL_BUCKET
+
+def update_recognition_stats(entries, sign=1):
+    """Add (or with sign=-1 subtract) log entries to the rollup counters in the current transaction
+
+    Entries are dicts with timestamp, status and user_id. Cost is proportional to the
+    number of entries and buckets touched, never to the size of the log table.
+    """
+    counters = {}
+    bucket_users = {}
+    for entry in entries:
+        for period in STAT_PERIODS:
+            key = (period, stat_bucket_start(period, entry['timestamp']))
+            counts = counters.setdefault(key, [0, 0, 0])
+            counts[0] += 1
+            if entry['status'] == 'recognized':
+                counts[1] += 1
+            elif entry['status'] == 'unknown':
+                counts[2] += 1
+            if entry.get('user_id') and sign > 0:
+                bucket_users.setdefault(key, set()).add(entry['user_id'])
+
+    for (period, bucket_start), (total, recognized, unknown) in counters.items():
+        new_users = 0
+        user_ids = bucket_users.get((period, bucket_start))
+        if user_ids:
+            counted = {row[0] for row in db.session.query(RecognitionStatUser.user_id).filter(
+                RecognitionStatUser.period == period,
+                RecognitionStatUser.bucket_start == bucket_start,
+                RecognitionStatUser.user_id.in_(user_ids)
+            )}
+            new_user_ids = user_ids - counted
+            if new_user_ids:
+                db.session.execute(RecognitionStatUser.__table__.insert(), [
+                    {'period': period, 'bucket_start': bucket_start, 'user_id': user_id}
+                    for user_id in new_user_ids
+                ])
+                new_users = len(new_user_ids)
+
+        updated = RecognitionStat.query.filter_by(period=period, bucket_start=bucket_start).update({
+            RecognitionStat.total: RecognitionStat.total + sign * total,
+            RecognitionStat.recognized: RecognitionStat.recognized + sign * recognized,
+            RecognitionStat.unknown: RecognitionStat.unknown + sign * unknown,
+            RecognitionStat.unique_users: RecognitionStat.unique_users + new_users
+        }, synchronize_session=False)
+
+        if not updated and sign > 0:
+            db.session.add(RecognitionStat(
+                period=period,
+                bucket_start=bucket_start,
+                total=total,
+                recognized=recognized,
+                unknown=unknown,
+                unique_users=new_users
+            ))
+            db.session.flush()
+
+def stats_backfilled_through():
+    """Highest pre-rollup log id that migrate_database.py has already folded into the rollups (0 if none)"""
+    if not db.inspect(db.engine).has_table('schema_migration'):
+        return 0
+    checkpoint = db.session.execute(
+        db.text("SELECT checkpoint FROM schema_migration WHERE name = 'backfill_recognition_stats'")
+    ).scalar()
+    return json.loads(checkpoint).get('last_id', 0) if checkpoint else 0
+
+def counted_in_recognition_stats():
+    """Filter for the logs the rollups actually include
+
+    Logs up to stats_backfill_upto predate the rollups and only count once the backfill
+    has reached them; everything newer was counted by the log writer.
+    """
+    upto = get_counter(STATS_BACKFILL_UPTO)
+    if not upto:
+        return db.true()
+    return db.or_(RecognitionLog.id > upto, RecognitionLog.id <= stats_backfilled_through())
+
+def remove_user_from_recognition_stats(user_id):
+    """Subtract a user's counted logs and unique-user contributions from the rollups"""
+    entries = [
+        {'timestamp': timestamp, 'status': status}
+        for timestamp, status in db.session.query(RecognitionLog.timestamp, RecognitionLog.status).filter(
+            RecognitionLog.user_id == user_id, counted_in_recognition_stats()
+        )
+    ]
+    if entries:
+        update_recognition_stats(entries, sign=-1)
+
+    counted = db.session.query(RecognitionStatUser.period, RecognitionStatUser.bucket_start).filter(
+        RecognitionStatUser.user_id == user_id
+    ).all()
+    for period, bucket_start in counted:
+        RecognitionStat.query.filter_by(period=period, bucket_start=bucket_start).update({
+            RecognitionStat.unique_users: RecognitionStat.unique_users - 1
+        }, synchronize_session=False)
+    RecognitionStatUser.query.filter_by(user_id=user_id).delete(synchronize_session=False)
+
+def get_recognition_stat(period, bucket_start):
+    """Read a single rollup row, or None if nothing was logged in that bucket"""
+    return RecognitionStat.query.filter_by(period=period, bucket_start=bucket_start).first()
+
+class RecognitionLogWriter:
+    """Buffer recognition log entries and write them to the database in batches"""
+
+    POLICIES = ('block', 'drop_newest', 'drop_oldest')
+
+    def __init__(self, flask_app, max_queue_size=10000, batch_size=200, flush_interval=1.0,
+                 policy='drop_oldest', block_timeout=0.05):
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unknown log writer policy: {policy}")
+        self.app = flask_app
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.max_queue_size = max_queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._stats = {
+            'enqueued': 0,
+            'written': 0,
+            'dropped': 0,
+            'failed': 0,
+            'flushes': 0,
+            'last_flush_ms': 0.0,
+            'max_flush_ms': 0.0,
+            'total_flush_ms': 0.0
+        }
+
+    def start(self):
+        """Start the writer thread (again after a fork, since threads do not survive it)"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run, name='recognition-log-writer', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=5.0):
+        """Stop the writer thread and flush everything still queued"""
+        self._stop_event.set()
+        thread = self._thread
+        if thread is not None and thread.is_alive() and self._pid == os.getpid():
+            thread.join(timeout)
+        else:
+            self._drain()
+
+    def submit(self, user_id=None, confidence=None, status='detected', image_path=None):
+        """Queue a log entry; returns False if it was dropped by the backpressure policy"""
+        entry = {
+            'user_id': user_id,
+            'confidence': float(confidence) if confidence is not None else None,
+            'status': status,
+            'image_path': image_path,
+            'timestamp': datetime.utcnow()
+        }
+        self.start()
+
+        try:
+            self.queue.put_nowait(entry)
+        except queue.Full:
+            if not self._apply_backpressure(entry):
+                with self._lock:
+                    self._stats['dropped'] += 1
+                return False
+
+        with self._lock:
+            self._stats['enqueued'] += 1
+        return True
+
+    def _apply_backpressure(self, entry):
+        """Handle a full queue according to the configured policy"""
+        if self.policy == 'block':
+            try:
+                self.queue.put(entry, timeout=self.block_timeout)
+                return True
+            except queue.Full:
+                return False
+
+        if self.policy == 'drop_oldest':
+            try:
+                self.queue.get_nowait()
+                with self._lock:
+                    self._stats['dropped'] += 1
+            except queue.Empty:
+                pass
+            try:
+                self.queue.put_nowait(entry)
+                return True
+            except queue.Full:
+                return False
+
+        # drop_newest
+        return False
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            batch = self._collect_batch()
+            if batch:
+                self._flush(batch)
+        self._drain()
+
+    def _collect_batch(self):
+        """Wait for entries until the batch is full or the flush interval has passed"""
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _drain(self):
+        while True:
+            batch = []
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if not batch:
+                return
+            self._flush(batch)
+
+    def _flush(self, batch, attempts=2):
+        """Write a batch of entries with a single bulk insert and update the rollups in the same transaction"""
+        start = time.perf_counter()
+        for attempt in range(attempts):
+            try:
+                with self.app.app_context():
+                    try:
+                        db.session.execute(RecognitionLog.__table__.insert(), batch)
+                        update_recognition_stats(batch)
+                        db.session.commit()
+                    except Exception:
+                        db.session.rollback()
+                        raise
+                break
+            except Exception as e:
+                # A concurrent writer may have created the same rollup bucket; retry once
+                if attempt + 1 < attempts:
+                    continue
+                print(f"Recognition log flush failed ({len(batch)} entries): {e}")
+                with self._lock:
+                    self._stats['failed'] += len(batch)
+                return
+
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        latency_metrics.observe_stage('log_commit', elapsed_ms / 1000)
+        with self._lock:
+            self._stats['written'] += len(batch)
+            self._stats['flushes'] += 1
+            self._stats['last_flush_ms'] = elapsed_ms
+            self._stats['max_flush_ms'] = max(self._stats['max_flush_ms'], elapsed_ms)
+            self._stats['total_flush_ms'] += elapsed_ms
+
+    def metrics(self):
+        """Return queue depth, flush latency and drop counters"""
+        with self._lock:
+            stats = dict(self._stats)
+        flushes = stats.pop('flushes')
+        total_flush_ms = stats.pop('total_flush_ms')
+        stats.update({
+            'queue_depth': self.queue.qsize(),
+            'max_queue_size': self.max_queue_size,
+            'policy': self.policy,
+            'batch_size': self.batch_size,
+            'flush_interval': self.flush_interval,
+            'flushes': flushes,
+            'avg_flush_ms': round(total_flush_ms / flushes, 3) if flushes else 0.0,
+            'last_flush_ms': round(stats['last_flush_ms'], 3),
+            'max_flush_ms': round(stats['max_flush_ms'], 3),
+            'running': self._thread is not None and self._thread.is_alive() and self._pid == os.getpid()
+        })
+        return stats
+
+recognition_log_writer = RecognitionLogWriter(
+    app,
+    max_queue_size=app.config['LOG_WRITER_QUEUE_SIZE'],
+    batch_size=app.config['LOG_WRITER_BATCH_SIZE'],
+    flush_interval=app.config['LOG_WRITER_FLUSH_INTERVAL'],
+    policy=app.config['LOG_WRITER_POLICY'],
+    block_timeout=app.config['LOG_WRITER_BLOCK_TIMEOUT']
+)
+
+# Flush pending log entries when the process exits
+atexit.register(recognition_log_writer.stop)
+
+class FaceCropArchive:
+    """Content-addressed on-disk store of face crops, written off the request thread
+
+    A crop is keyed by the SHA-256 of its pixels and stored as
+    <root>/<namespace>/<h[0:2]>/<h[2:4]>/<h>.jpg next to a <h>_thumb.jpg thumbnail, so
+    identical crops are stored once. store() only hashes the crop and returns its path;
+    encoding and writing happen on a background thread. When max_bytes is set, the least
+    recently stored or re-seen crops are evicted once the namespace grows past it.
+    """
+
+    def __init__(self, root, namespace, max_bytes=0, thumbnail_size=64, queue_size=1000):
+        self.root = root
+        self.namespace = namespace
+        self.max_bytes = max_bytes
+        self.thumbnail_size = thumbnail_size
+        self.queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._current_bytes = None
+        self._stats = {
+            'stored': 0,
+            'deduplicated': 0,
+            'dropped': 0,
+            'evicted': 0,
+            'failed': 0
+        }
+
+    @property
+    def directory(self):
+        return os.path.join(self.root, self.namespace)
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name=f'crop-archive-{self.namespace}', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=5.0):
+        """Write out queued crops before the process exits"""
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            self.queue.put(None)
+            self._thread.join(timeout)
+
+    def store(self, image, face_rect):
+        """Queue a face crop for archiving; returns its path relative to the archive root, or None if dropped"""
+        x, y, w, h = [int(v) for v in face_rect]
+        return self.store_crop(image[y:y+h, x:x+w])
+
+    def store_crop(self, crop):
+        """Queue an already cropped face for archiving"""
+        crop = np.ascontiguousarray(crop)
+        if crop.size == 0:
+            return None
+
+        digest = hashlib.sha256(crop).hexdigest()
+        relative_path = f"{self.namespace}/{digest[:2]}/{digest[2:4]}/{digest}.jpg"
+
+        self.start()
+        try:
+            self.queue.put_nowait((relative_path, crop))
+        except queue.Full:
+            with self._lock:
+                self._stats['dropped'] += 1
+            return None
+        return relative_path
+
+    def thumbnail_path(self, relative_path):
+        return relative_path[:-len('.jpg')] + '_thumb.jpg'
+
+    def _run(self):
+        if self._current_bytes is None:
+            self._current_bytes = sum(size for _, _, size in self._scan())
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            try:
+                self._write(*item)
+            except Exception as e:
+                print(f"Face crop archive write failed: {e}")
+                with self._lock:
+                    self._stats['failed'] += 1
+
+    def _write(self, relative_path, crop):
+        path = os.path.join(self.root, relative_path)
+        if os.path.exists(path):
+            # Dedupe: refresh the timestamp so eviction treats it as recently used
+            os.utime(path, None)
+            with self._lock:
+                self._stats['deduplicated'] += 1
+            return
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        thumbnail = cv2.resize(crop, (self.thumbnail_size, self.thumbnail_size), interpolation=cv2.INTER_AREA)
+        written = 0
+        for target, pixels in ((os.path.join(self.root, self.thumbnail_path(relative_path)), thumbnail), (path, crop)):
+            ok, buffer = cv2.imencode('.jpg', pixels, [cv2.IMWRITE_JPEG_QUALITY, 90])
+            if not ok:
+                raise ValueError('JPEG encoding failed')
+            # Write to a temporary name and rename, so readers never see a partial file
+            temporary = f"{target}.{os.getpid()}.tmp"
+            with open(temporary, 'wb') as out:
+                out.write(buffer.tobytes())
+            os.replace(temporary, target)
+            written += len(buffer)
+
+        with self._lock:
+            self._stats['stored'] += 1
+        self._current_bytes += written
+        if self.max_bytes and self._current_bytes > self.max_bytes:
+            self._evict()
+
+    def _scan(self):
+        """(mtime, path, size) for every crop in the namespace, size including its thumbnail"""
+        files = []
+        for directory, _, names in os.walk(self.directory):
+            for name in names:
+                if name.endswith('.jpg') and not name.endswith('_thumb.jpg'):
+                    path = os.path.join(directory, name)
+                    try:
+                        stat = os.stat(path)
+                        size = stat.st_size + os.path.getsize(self.thumbnail_path(path))
+                    except OSError:
+                        continue
+                    files.append((stat.st_mtime, path, size))
+        return files
+
+    def _evict(self):
+        """Delete the oldest crops until the namespace is back under 90% of its cap"""
+        files = self._scan()
+        self._current_bytes = sum(size for _, _, size in files)
+        target = self.max_bytes * 0.9
+        evicted = 0
+        for _, path, size in sorted(files):
+            if self._current_bytes <= target:
+                break
+            for victim in (path, self.thumbnail_path(path)):
+                try:
+                    os.remove(victim)
+                except OSError:
+                    pass
+            self._current_bytes -= size
+            evicted += 1
+        with self._lock:
+            self._stats['evicted'] += evicted
+
+    def metrics(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats.update({
+            'namespace': self.namespace,
+            'queue_depth': self.queue.qsize(),
+            'bytes': self._current_bytes,
+            'max_bytes': self.max_bytes
+        })
+        return stats
+
+recognition_crop_archive = FaceCropArchive(
+    app.config['CROP_ARCHIVE_FOLDER'], 'recognition',
+    max_bytes=app.config['CROP_ARCHIVE_MAX_BYTES'],
+    thumbnail_size=app.config['CROP_THUMBNAIL_SIZE'],
+    queue_size=app.config['CROP_ARCHIVE_QUEUE_SIZE']
+)
+# Enrollment crops are what models get rebuilt from, so they are never evicted
+enrollment_crop_archive = FaceCropArchive(
+    app.config['CROP_ARCHIVE_FOLDER'], 'enrollment',
+    thumbnail_size=app.config['CROP_THUMBNAIL_SIZE'],
+    queue_size=app.config['CROP_ARCHIVE_QUEUE_SIZE']
+)
+atexit.register(recognition_crop_archive.stop)
+atexit.register(enrollment_crop_archive.stop)
+
+def record_face_samples(user_id, image_paths, replace=True):
+    """Attach archived enrollment crops to a user (in the caller's transaction)"""
+    if replace:
+        FaceSample.query.filter_by(user_id=user_id).delete(synchronize_session=False)
+    # Identical crops share one archive file, so only record each once
+    for image_path in dict.fromkeys(image_paths):
+        if image_path:
+            db.session.add(FaceSample(user_id=user_id, image_path=image_path))
+
+class LogRetentionWorker:
+    """Archive old recognition logs to per-day gzip files and delete them in small batches
+
+    Archived rows are appended as NDJSON to LOG_ARCHIVE_FOLDER/recognition_logs_YYYY-MM-DD.ndjson.gz
+    and fsynced before they are deleted, so a crash can at worst archive a batch twice. Day and
+    all-time rollups are kept, so the stats endpoints still cover archived days; hourly rollups
+    past the retention window are compacted away. A lease row in AppCounter makes sure only one
+    worker process runs retention at a time.
+    """
+
+    LEASE = 'log_retention_lease'
+
+    def __init__(self, flask_app, retention_days=0, archive_folder='logs/archive', batch_size=500,
+                 batch_pause=0.2, interval=3600):
+        self.app = flask_app
+        self.retention_days = retention_days
+        self.archive_folder = archive_folder
+        self.batch_size = batch_size
+        self.batch_pause = batch_pause
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._wake_event = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._lease_expiry = -1
+        self._stats = {
+            'runs': 0,
+            'archived': 0,
+            'last_run': None,
+            'last_archived': 0,
+            'last_error': None
+        }
+
+    @property
+    def enabled(self):
+        return self.retention_days > 0
+
+    def start(self):
+        """Start the retention thread for this process if retention is enabled"""
+        if not self.enabled:
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run, name='log-retention', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        self._wake_event.set()
+
+    def trigger(self):
+        """Ask the background thread to run now instead of waiting for the interval"""
+        self.start()
+        self._wake_event.set()
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"Log retention run failed: {e}")
+                with self._lock:
+                    self._stats['last_error'] = str(e)
+            self._wake_event.wait(self.interval)
+            self._wake_event.clear()
+
+    def _acquire_lease(self, duration=300):
+        """Take or renew the cross-process lease; returns False if another process holds it"""
+        now = int(time.time())
+        table = AppCounter.__table__
+        acquired = db.session.execute(
+            table.update()
+            .where(table.c.name == self.LEASE)
+            .where(db.or_(table.c.value < now, table.c.value == self._lease_expiry))
+            .values(value=now + duration)
+        ).rowcount
+        db.session.commit()
+        if acquired:
+            self._lease_expiry = now + duration
+        return bool(acquired)
+
+    def _release_lease(self):
+        table = AppCounter.__table__
+        db.session.execute(
+            table.update()
+            .where(table.c.name == self.LEASE)
+            .where(table.c.value == self._lease_expiry)
+            .values(value=0)
+        )
+        db.session.commit()
+        self._lease_expiry = -1
+
+    def archive_path(self, day):
+        return os.path.join(self.archive_folder, f"recognition_logs_{day.strftime('%Y-%m-%d')}.ndjson.gz")
+
+    def run_once(self):
+        """Archive and delete every log older than the retention window; returns rows archived"""
+        if not self.enabled:
+            return 0
+
+        archived = 0
+        with self.app.app_context():
+            ensure_counter(self.LEASE)
+            if not self._acquire_lease():
+                return 0
+
+            try:
+                cutoff = stat_bucket_start('day', datetime.utcnow()) - timedelta(days=self.retention_days)
+                os.makedirs(self.archive_folder, exist_ok=True)
+
+                while not self._stop_event.is_set():
+                    rows = db.session.query(
+                        RecognitionLog.id, RecognitionLog.timestamp, RecognitionLog.user_id, User.person_id,
+                        User.name, RecognitionLog.status, RecognitionLog.confidence, RecognitionLog.image_path
+                    ).outerjoin(User, User.id == RecognitionLog.user_id).filter(
+                        RecognitionLog.timestamp < cutoff
+                    ).order_by(RecognitionLog.timestamp, RecognitionLog.id).limit(self.batch_size).all()
+                    if not rows:
+                        break
+
+                    self._archive_rows(rows)
+                    RecognitionLog.query.filter(
+                        RecognitionLog.id.in_([row.id for row in rows])
+                    ).delete(synchronize_session=False)
+                    db.session.commit()
+                    archived += len(rows)
+
+                    # Keep the lease alive and give request traffic room between batches
+                    self._acquire_lease()
+                    time.sleep(self.batch_pause)
+
+                self._compact_rollups(cutoff)
+            finally:
+                db.session.rollback()
+                self._release_lease()
+
+        with self._lock:
+            self._stats['runs'] += 1
+            self._stats['archived'] += archived
+            self._stats['last_run'] = datetime.utcnow().isoformat()
+            self._stats['last_archived'] = archived
+            self._stats['last_error'] = None
+        if archived:
+            print(f"Log retention archived {archived} recognition logs older than {cutoff.date()}")
+        return archived
+
+    def _archive_rows(self, rows):
+        by_day = {}
+        for row in rows:
+            record = dict(zip(LOG_EXPORT_COLUMNS, row))
+            record['timestamp'] = record['timestamp'].isoformat() if record['timestamp'] else None
+            by_day.setdefault(stat_bucket_start('day', row.timestamp or STAT_TOTAL_BUCKET), []).append(record)
+
+        for day, records in by_day.items():
+            # Each append adds a gzip member; readers treat concatenated members as one stream
+            with open(self.archive_path(day), 'ab') as raw:
+                with gzip.GzipFile(fileobj=raw, mode='ab') as archive:
+                    for record in records:
+                        archive.write((json.dumps(record) + '\n').encode('utf-8'))
+                raw.flush()
+                os.fsync(raw.fileno())
+
+    def _compact_rollups(self, cutoff):
+        """Drop hourly rollups and per-bucket user sets for days that can no longer change"""
+        RecognitionStat.query.filter(
+            RecognitionStat.period == 'hour',
+            RecognitionStat.bucket_start < cutoff
+        ).delete(synchronize_session=False)
+        RecognitionStatUser.query.filter(
+            RecognitionStatUser.period.in_(('hour', 'day')),
+            RecognitionStatUser.bucket_start < cutoff
+        ).delete(synchronize_session=False)
+        db.session.commit()
+
+    def list_archives(self):
+        if not os.path.isdir(self.archive_folder):
+            return []
+        archives = []
+        for name in sorted(os.listdir(self.archive_folder)):
+            if name.startswith('recognition_logs_') and name.endswith('.ndjson.gz'):
+                path = os.path.join(self.archive_folder, name)
+                archives.append({
+                    'filename': name,
+                    'date': name[len('recognition_logs_'):-len('.ndjson.gz')],
+                    'size': os.path.getsize(path)
+                })
+        return archives
+
+    def metrics(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats.update({
+            'enabled': self.enabled,
+            'retention_days': self.retention_days,
+            'running': self._thread is not None and self._thread.is_alive() and self._pid == os.getpid()
+        })
+        return stats
+
+log_retention_worker = LogRetentionWorker(
+    app,
+    retention_days=app.config['LOG_RETENTION_DAYS'],
+    archive_folder=app.config['LOG_ARCHIVE_FOLDER'],
+    batch_size=app.config['LOG_RETENTION_BATCH_SIZE'],
+    batch_pause=app.config['LOG_RETENTION_BATCH_PAUSE'],
+    interval=app.config['LOG_RETENTION_INTERVAL']
+)
+atexit.register(log_retention_worker.stop)
+
+@app.before_request
+def start_background_workers():
+    """Make sure per-process background threads run in this (possibly forked) worker"""
+    log_retention_worker.start()
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_latency(response):
+    """Count the request and record its latency per endpoint (streams are timed to their first byte)"""
+    started = g.get('request_started')
+    if started is not None:
+        latency_metrics.observe_request(
+            request.endpoint or 'unmatched', request.method, response.status_code, time.perf_counter() - started
+        )
+    return response
+
+def query_logs_with_user_names():
+    """Recognition logs joined to their user's name in a single query"""
+    return db.session.query(RecognitionLog, User.name).outerjoin(User, User.id == RecognitionLog.user_id)
+
+def parse_date_param(value, end=False):
+    """Parse an ISO date or datetime query parameter; a bare end date covers the whole day"""
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value)
+    if end and len(value) == 10:
+        parsed += timedelta(days=1)
+    return parsed
+
+def build_log_filters(args):
+    """Build RecognitionLog filter conditions from status, user_id, date_from and date_to parameters"""
+    filters = []
+
+    status = args.get('status')
+    if status:
+        filters.append(RecognitionLog.status == status)
+
+    user_id = args.get('user_id')
+    if user_id:
+        filters.append(RecognitionLog.user_id == int(user_id))
+
+    date_from = parse_date_param(args.get('date_from'))
+    if date_from:
+        filters.append(RecognitionLog.timestamp >= date_from)
+
+    date_to = parse_date_param(args.get('date_to'), end=True)
+    if date_to:
+        filters.append(RecognitionLog.timestamp < date_to)
+
+    return filters
+
+def encode_log_cursor(log):
+    """Opaque keyset cursor for the (timestamp, id) position of a log row"""
+    raw = f"{log.timestamp.isoformat()}|{log.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_log_cursor(cursor):
+    raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+    timestamp, log_id = raw.rsplit('|', 1)
+    return datetime.fromisoformat(timestamp), int(log_id)
+
+def log_keyset_filter(timestamp, log_id):
+    """Condition selecting rows after (timestamp, id) in (timestamp desc, id desc) order"""
+    return db.or_(
+        RecognitionLog.timestamp < timestamp,
+        db.and_(RecognitionLog.timestamp == timestamp, RecognitionLog.id < log_id)
+    )
+
+def log_cursor_filter(cursor):
+    timestamp, log_id = decode_log_cursor(cursor)
+    return log_keyset_filter(timestamp, log_id)
+
+LOG_EXPORT_COLUMNS = ('id', 'timestamp', 'user_id', 'person_id', 'user_name', 'status', 'confidence', 'image_path')
+
+def iter_log_export_rows(filters, chunk_size=1000):
+    """Yield log rows joined to users, newest first, one bounded keyset query per chunk
+
+    Plain column tuples are selected so nothing accumulates in the session's identity map.
+    """
+    last = None
+    while True:
+        query = db.session.query(
+            RecognitionLog.id, RecognitionLog.timestamp, RecognitionLog.user_id, User.person_id,
+            User.name, RecognitionLog.status, RecognitionLog.confidence, RecognitionLog.image_path
+        ).outerjoin(User, User.id == RecognitionLog.user_id).filter(*filters)
+        if last is not None:
+            query = query.filter(log_keyset_filter(last.timestamp, last.id))
+        rows = query.order_by(RecognitionLog.timestamp.desc(), RecognitionLog.id.desc()).limit(chunk_size).all()
+        if not rows:
+            return
+        yield rows
+        last = rows[-1]
+
+# Routes
+@app.route('/')
+def index():
+    """Home page"""
+    return render_template('index_opencv.html')
+
+@app.route('/register')
+def register():
+    """User registration page"""
+    return render_template('register_fixed.html')
+
+@app.route('/recognize')
+def recognize():
+    """Face recognition page"""
+    return render_template('recognize_fixed.html')
+
+
+
+@app.route('/api/login', methods=['POST'])
+def login():
+    """Admin login endpoint"""
+    try:
+        data = request.get_json()
+        if not data:
+            return jsonify({
+                'status': 'error',
+                'message': 'No data provided'
+            }), 400
+        
+        username = data.get('username')
+        password = data.get('password')
+        
+        if not username or not password:
+            return jsonify({
+                'status': 'error',
+                'message': 'Username and password are required'
+            }), 400
+        
+        # Simple hardcoded admin credentials (in production, use proper user management)
+        if username == 'admin' and password == 'admin123':
+            # Create access token
+            access_token = create_access_token(identity=username)
+            
+            return jsonify({
+                'status': 'success',
+                'message': 'Login successful',
+                'access_token': access_token,
+                'user': {
+                    'username': username,
+                    'role': 'admin'
+                }
+            }), 200
+        else:
+            return jsonify({
+                'status': 'error',
+                'message': 'Invalid username or password'
+            }), 401
+            
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': f'Login failed: {str(e)}'
+        }), 500
+
+@app.route('/login')
+def login_page():
+    """Admin login page"""
+    return render_template('login.html')
+
+@app.route('/admin')
+def admin():
+    """Admin dashboard - client-side authentication check"""
+    # Just render the page, authentication is checked client-side
+    return render_template('admin.html')
+
+@app.route('/capture/<int:user_id>')
+def capture_user_face(user_id):
+    """Face capture page for specific user"""
+    user = User.query.get(user_id)
+    if not user:
+        return "User not found", 404
+    
+    return render_template('capture_face.html', user=user)
+
+@app.route('/video_feed')
+def video_feed():
+    """Video streaming route with face detection"""
+    camera_index = request.args.get('camera', 0, type=int)
+    
+    def generate():
+        cap = None
+        error_count = 0
+        max_errors = 10
+        consecutive_errors = 0
+        last_frame_time = time.time()
+        
+        try:
+            while True:  # Outer loop to keep trying
+                try:
+                    # Try multiple camera backends for better compatibility
+                    if cap is None or not cap.isOpened():
+                        print(f"Initializing camera {camera_index} for video feed...")
+                        cap = initialize_camera(camera_index)
+                        error_count = 0
+                        consecutive_errors = 0
+                
+                    if not cap or not cap.isOpened():
+                        # Create a placeholder frame if camera fails
+                        placeholder = create_placeholder_frame("Camera not available - Retrying...")
+                        ret, buffer = cv2.imencode('.jpg', placeholder)
+                        if ret:
+                            frame = buffer.tobytes()
+                            yield (b'--frame\r\n'
+                                   b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
+                        time.sleep(1)
+                        continue
+                
+                    frame_count = 0
+                    while cap and cap.isOpened():
+                        try:
+                            ret, frame = cap.read()
+                            current_time = time.time()
+                        
+                            if not ret or frame is None:
+                                consecutive_errors += 1
+                                error_count += 1
+                            
+                                if consecutive_errors > 3:
+                                    print(f"Camera read failed {consecutive_errors} times, reinitializing...")
+                                    if cap:
+                                        cap.release()
+                                        cap = None
+                                    break  # Break inner loop to reinitialize
+                            
+                                # Send placeholder while recovering
+                                placeholder = create_placeholder_frame("Camera reconnecting...")
+                                ret, buffer = cv2.imencode('.jpg', placeholder)
+                                if ret:
+                                    frame = buffer.tobytes()
+                                    yield (b'--frame\r\n'
+                                           b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
+                                time.sleep(0.5)
+                                continue
+                        
+                            consecutive_errors = 0  # Reset on successful read
+                            error_count = 0
+                            last_frame_time = current_time
+                        
+                            # Detect faces (with error handling)
+                            try:
+                                faces = face_detector.detect_faces(frame)
+                            
+                                # Draw rectangles around faces
+                                for (x, y, w, h) in faces:
+                                    cv2.rectangle(frame, (x, y), (x+w, y+h), (0, 255, 0), 2)
+                                    cv2.putText(frame, 'Face Detected', (x, y-10), 
+                                               cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
+                            
+                                # Add info overlay
+                                cv2.putText(frame, f'OpenCV Face Detection - {len(faces)} faces', 
+                                           (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 0), 2)
+                                cv2.putText(frame, f'Time: {datetime.now().strftime("%H:%M:%S")}', 
+                                           (10, 60), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
+                            except Exception as e:
+                                print(f"Face detection error: {e}")
+                                # Continue with frame even if face detection fails
+                        
+                            yield mjpeg_frame(frame)
+                        
+                            frame_count += 1
+                            # Limit frame rate
+                            time.sleep(0.05)  # ~20 FPS
+                        
+                        except Exception as e:
+                            print(f"Frame processing error: {e}")
+                            consecutive_errors += 1
+                            if consecutive_errors > 5:
+                                if cap:
+                                    cap.release()
+                                    cap = None
+                                break
+                            time.sleep(0.5)
+                            continue
+                        
+                except Exception as e:
+                    print(f"Video feed error: {e}")
+                    if cap:
+                        try:
+                            cap.release()
+                        except:
+                            pass
+                        cap = None
+                    time.sleep(1)
+                    continue
+    
+        finally:
+            # Also runs when the client disconnects (generator closed)
+            if cap:
+                cap.release()
+    
+    # Keep the request context so the stream's stages are labelled with this endpoint
+    return stream_response(stream_with_context(generate()))
+
+def initialize_camera(camera_index=0):
+    """Initialize camera with multiple backend options for better compatibility"""
+    backends = [
+        cv2.CAP_DSHOW,      # DirectShow (Windows)
         cv2.CAP_MSMF,       # Microsoft Media Foundation
         cv2.CAP_V4L2,       # Video4Linux2 (Linux)
         cv2.CAP_ANY         # Any available backend
@@ -523,6 +2926,428 @@ def create_placeholder_frame(message):
     
     return frame
 
+class AdmissionRejected(Exception):
+    def __init__(self, admission_class, reason):
+        super().__init__(f"{admission_class} request {reason}")
+        self.admission_class = admission_class
+        self.reason = reason
+
+class AdmissionController:
+    """Per-process concurrency limits with bounded, prioritized queues for CPU-heavy endpoints
+
+    Requests share max_concurrent slots. Each class also has its own concurrency cap and
+    queue bound. Freed slots go to the highest-priority class with waiters, so queued
+    recognition and enrollment requests always run before previews. Previews have no
+    queue by default and are shed as soon as they cannot run. A disabled controller admits
+    every request at once and only counts them.
+    """
+
+    def __init__(self, max_concurrent, classes, queue_timeout=10.0, retry_after=2, enabled=True):
+        self.enabled = enabled
+        self.max_concurrent = max_concurrent
+        self.classes = classes
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self._order = sorted(classes, key=lambda name: -classes[name]['priority'])
+        self._lock = threading.Lock()
+        self._active_total = 0
+        self._active = {name: 0 for name in classes}
+        self._waiters = {name: deque() for name in classes}
+        self._stats = {name: {
+            'admitted': 0,
+            'rejected': 0,
+            'timed_out': 0,
+            'total_wait_ms': 0.0,
+            'max_wait_ms': 0.0
+        } for name in classes}
+
+    def _can_run(self, name):
+        return self._active_total < self.max_concurrent and self._active[name] < self.classes[name]['max_concurrent']
+
+    def _waiting_ahead(self, name):
+        priority = self.classes[name]['priority']
+        return any(self._waiters[other] for other in self.classes if self.classes[other]['priority'] >= priority)
+
+    def _take(self, name, waited_ms=0.0):
+        self._active_total += 1
+        self._active[name] += 1
+        stats = self._stats[name]
+        stats['admitted'] += 1
+        stats['total_wait_ms'] += waited_ms
+        stats['max_wait_ms'] = max(stats['max_wait_ms'], waited_ms)
+
+    def request(self, name, on_grant):
+        """Admit now (returns None) or queue (returns a waiter; on_grant is called once it is admitted)
+
+        Raises AdmissionRejected when the class queue is full.
+        """
+        with self._lock:
+            if not self.enabled or (self._can_run(name) and not self._waiting_ahead(name)):
+                self._take(name)
+                return None
+            if len(self._waiters[name]) >= self.classes[name]['max_queue']:
+                self._stats[name]['rejected'] += 1
+                raise AdmissionRejected(name, 'shed: too busy')
+            waiter = {'name': name, 'on_grant': on_grant, 'queued': time.perf_counter(), 'granted': False}
+            self._waiters[name].append(waiter)
+            return waiter
+
+    def cancel(self, waiter):
+        """Give up waiting; returns False if the waiter was admitted meanwhile (and must release)"""
+        with self._lock:
+            if waiter['granted']:
+                return False
+            self._waiters[waiter['name']].remove(waiter)
+            self._stats[waiter['name']]['timed_out'] += 1
+            return True
+
+    def release(self, name):
+        granted = []
+        with self._lock:
+            self._active_total -= 1
+            self._active[name] -= 1
+            for candidate in self._order:
+                waiters = self._waiters[candidate]
+                while waiters and self._can_run(candidate):
+                    waiter = waiters.popleft()
+                    waiter['granted'] = True
+                    self._take(candidate, (time.perf_counter() - waiter['queued']) * 1000)
+                    granted.append(waiter)
+        for waiter in granted:
+            waiter['on_grant']()
+
+    @contextmanager
+    def admit(self, name):
+        """Hold a slot for the duration of a request, waiting up to queue_timeout in the class queue"""
+        granted = threading.Event()
+        waiter = self.request(name, granted.set)
+        if waiter is not None and not granted.wait(self.queue_timeout) and self.cancel(waiter):
+            raise AdmissionRejected(name, 'timed out in queue')
+        try:
+            yield
+        finally:
+            self.release(name)
+
+    def metrics(self):
+        with self._lock:
+            classes = {}
+            for name, config in self.classes.items():
+                stats = dict(self._stats[name])
+                admitted = stats['admitted']
+                classes[name] = {
+                    'priority': config['priority'],
+                    'max_concurrent': config['max_concurrent'],
+                    'max_queue': config['max_queue'],
+                    'active': self._active[name],
+                    'queued': len(self._waiters[name]),
+                    'admitted': admitted,
+                    'rejected': stats['rejected'],
+                    'timed_out': stats['timed_out'],
+                    'avg_wait_ms': round(stats['total_wait_ms'] / admitted, 3) if admitted else 0.0,
+                    'max_wait_ms': round(stats['max_wait_ms'], 3)
+                }
+            return {
+                'enabled': self.enabled,
+                'max_concurrent': self.max_concurrent,
+                'active': self._active_total,
+                'queue_timeout': self.queue_timeout,
+                'classes': classes
+            }
+
+admission_controller = AdmissionController(
+    app.config['ADMISSION_MAX_CONCURRENT'],
+    {
+        'enrollment': {'priority': 3, 'max_concurrent': app.config['ADMISSION_MAX_CONCURRENT'],
+                       'max_queue': app.config['ADMISSION_ENROLLMENT_QUEUE']},
+        'recognition': {'priority': 2, 'max_concurrent': app.config['ADMISSION_MAX_CONCURRENT'],
+                        'max_queue': app.config['ADMISSION_RECOGNITION_QUEUE']},
+        'preview': {'priority': 1, 'max_concurrent': app.config['ADMISSION_PREVIEW_MAX_CONCURRENT'],
+                    'max_queue': app.config['ADMISSION_PREVIEW_QUEUE']}
+    },
+    queue_timeout=app.config['ADMISSION_QUEUE_TIMEOUT'],
+    retry_after=app.config['ADMISSION_RETRY_AFTER'],
+    enabled=app.config['ADMISSION_ENABLED']
+)
+
+def admission_rejected_response(rejection):
+    response = jsonify({
+        'status': 'error',
+        'message': f'Server busy ({rejection.reason}), please retry shortly'
+    })
+    response.headers['Retry-After'] = str(admission_controller.retry_after)
+    return response, 503
+
+def admission(admission_class):
+    """Route decorator: run the view only once the admission controller grants a slot"""
+    def decorator(view):
+        @wraps(view)
+        def wrapped(*args, **kwargs):
+            try:
+                with admission_controller.admit(admission_class):
+                    return view(*args, **kwargs)
+            except AdmissionRejected as rejection:
+                return admission_rejected_response(rejection)
+        return wrapped
+    return decorator
+
+class ProfileStore:
+    """cProfile captures of single requests as .prof files (pstats format) in a size-capped folder
+
+    File names carry the capture time, endpoint, wall time and a random suffix,
+    e.g. 20240101T120000-recognize_from_image-184ms-1a2b3c4d.prof.
+    """
+
+    def __init__(self, folder, max_bytes):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._stats = {
+            'captured': 0,
+            'evicted': 0,
+            'failed': 0
+        }
+
+    def save(self, profiler, endpoint, elapsed):
+        """Write a finished profile; returns its file name, or None if it could not be written"""
+        filename = (f"{datetime.utcnow().strftime('%Y%m%dT%H%M%S')}-{endpoint}-"
+                    f"{int(elapsed * 1000)}ms-{uuid.uuid4().hex[:8]}.prof")
+        path = os.path.join(self.folder, filename)
+        temporary = f"{path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(self.folder, exist_ok=True)
+            profiler.dump_stats(temporary)
+            os.replace(temporary, path)
+        except OSError as e:
+            print(f"Failed to save profile {filename}: {e}")
+            with self._lock:
+                self._stats['failed'] += 1
+            return None
+        with self._lock:
+            self._stats['captured'] += 1
+        self._evict()
+        print(f"Profile captured: {filename}")
+        return filename
+
+    def _scan(self):
+        files = []
+        if os.path.isdir(self.folder):
+            for name in os.listdir(self.folder):
+                if name.endswith('.prof'):
+                    try:
+                        stat = os.stat(os.path.join(self.folder, name))
+                    except OSError:
+                        continue
+                    files.append((stat.st_mtime, name, stat.st_size))
+        return sorted(files)
+
+    def _evict(self):
+        """Delete the oldest profiles (never the newest) until the folder is under its cap"""
+        if self.max_bytes <= 0:
+            return
+        files = self._scan()
+        total = sum(size for _, _, size in files)
+        evicted = 0
+        for _, name, size in files[:-1]:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.folder, name))
+            except OSError:
+                continue
+            total -= size
+            evicted += 1
+        with self._lock:
+            self._stats['evicted'] += evicted
+
+    def list_profiles(self):
+        """Saved profiles, newest first"""
+        profiles = []
+        for mtime, name, size in reversed(self._scan()):
+            parts = name[:-len('.prof')].split('-')
+            profiles.append({
+                'filename': name,
+                'endpoint': '-'.join(parts[1:-2]) if len(parts) >= 4 else None,
+                'duration_ms': int(parts[-2][:-2]) if len(parts) >= 4 and parts[-2][:-2].isdigit() else None,
+                'created_at': datetime.utcfromtimestamp(mtime).isoformat(),
+                'size': size
+            })
+        return profiles
+
+    def summary(self, filename, limit=50):
+        """Top functions of a saved profile by cumulative time, as pstats text"""
+        stream = io.StringIO()
+        stats = pstats.Stats(os.path.join(self.folder, os.path.basename(filename)), stream=stream)
+        stats.sort_stats('cumulative').print_stats(limit)
+        return stream.getvalue()
+
+    def metrics(self):
+        with self._lock:
+            stats = dict(self._stats)
+        files = self._scan()
+        stats.update({
+            'sample_rate': app.config['PROFILE_SAMPLE_RATE'],
+            'profiles': len(files),
+            'bytes': sum(size for _, _, size in files),
+            'max_bytes': self.max_bytes
+        })
+        return stats
+
+profile_store = ProfileStore(app.config['PROFILE_FOLDER'], app.config['PROFILE_MAX_BYTES'])
+
+def profiling_requested():
+    """Profile this request? Either an X-Profile header with a valid admin token, or the PROFILE_SAMPLE_RATE draw"""
+    if request.headers.get('X-Profile'):
+        try:
+            verify_jwt_in_request()
+            return True
+        except Exception:
+            return False
+    rate = app.config['PROFILE_SAMPLE_RATE']
+    return rate > 0 and random.random() < rate
+
+def enable_profiler(profiler):
+    """Start profiling on this thread; False if another profiler is already active (Python 3.12+ allows one)"""
+    try:
+        profiler.enable()
+        return True
+    except ValueError:
+        return False
+
+def profiled(view):
+    """Route decorator: capture a cProfile of the view when profiling_requested(); the file name is returned in X-Profile-Id"""
+    @wraps(view)
+    def wrapped(*args, **kwargs):
+        if not profiling_requested():
+            return view(*args, **kwargs)
+        profiler = cProfile.Profile()
+        if not enable_profiler(profiler):
+            return view(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            response = view(*args, **kwargs)
+        finally:
+            profiler.disable()
+        filename = profile_store.save(profiler, request.endpoint, time.perf_counter() - start)
+        response = make_response(response)
+        if filename:
+            response.headers['X-Profile-Id'] = filename
+        return response
+    return wrapped
+
+def profiled_frames(frames, endpoint, max_frames):
+    """Profile producing the first max_frames frames of a stream, then pass the rest through untouched"""
+    profiler = cProfile.Profile()
+    start = time.perf_counter()
+    produced = 0
+    try:
+        while produced < max_frames:
+            if not enable_profiler(profiler):
+                break
+            try:
+                frame = next(frames)
+            except StopIteration:
+                return
+            finally:
+                profiler.disable()
+            produced += 1
+            yield frame
+    finally:
+        if produced:
+            profile_store.save(profiler, endpoint, time.perf_counter() - start)
+    yield from frames
+
+@timed_stage('jpeg_encode')
+def mjpeg_frame(image):
+    """Encode a frame as one multipart MJPEG part (empty if encoding fails)"""
+    ret, buffer = cv2.imencode('.jpg', image)
+    if not ret:
+        return b''
+    return b'--frame\r\nContent-Type: image/jpeg\r\n\r\n' + buffer.tobytes() + b'\r\n'
+
+class StreamLimiter:
+    """Caps concurrent MJPEG streams in this process and bounds each stream's duration and frame rate"""
+
+    def __init__(self, max_streams, max_seconds, max_fps):
+        self.max_streams = max_streams
+        self.max_seconds = max_seconds
+        self.max_fps = max_fps
+        self._slots = threading.BoundedSemaphore(max_streams)
+        self._lock = threading.Lock()
+        self._stats = {
+            'active': 0,
+            'opened': 0,
+            'rejected': 0,
+            'expired': 0,
+            'frames': 0
+        }
+
+    def open(self, frames):
+        """Wrap a frame generator in the stream limits, or return None when every slot is taken"""
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._stats['rejected'] += 1
+            frames.close()
+            return None
+        with self._lock:
+            self._stats['active'] += 1
+            self._stats['opened'] += 1
+        return self._limited(frames)
+
+    def _limited(self, frames):
+        interval = 1.0 / self.max_fps if self.max_fps > 0 else 0.0
+        deadline = time.monotonic() + self.max_seconds if self.max_seconds else None
+        next_frame = time.monotonic()
+        try:
+            for frame in frames:
+                now = time.monotonic()
+                if deadline is not None and now >= deadline:
+                    with self._lock:
+                        self._stats['expired'] += 1
+                    yield mjpeg_frame(create_placeholder_frame("Stream time limit reached"))
+                    return
+                if next_frame > now:
+                    time.sleep(next_frame - now)
+                next_frame = max(next_frame, now) + interval
+                with self._lock:
+                    self._stats['frames'] += 1
+                yield frame
+        finally:
+            # Runs when the client disconnects too, so the camera and the slot are freed
+            frames.close()
+            self._slots.release()
+            with self._lock:
+                self._stats['active'] -= 1
+
+    def metrics(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats.update({
+            'max_streams': self.max_streams,
+            'max_seconds': self.max_seconds,
+            'max_fps': self.max_fps
+        })
+        return stats
+
+stream_limiter = StreamLimiter(
+    app.config['STREAM_MAX_CONCURRENT'], app.config['STREAM_MAX_SECONDS'], app.config['STREAM_MAX_FPS']
+)
+
+def stream_response(frames):
+    """MJPEG response for a frame generator, applying the stream limits"""
+    if app.config['STREAMING_MODE'] == 'separate' and app.config['STREAM_SERVER_PORT']:
+        # Streams are served by the dedicated streaming workers; keep this worker free for the API
+        frames.close()
+        return redirect(f"{request.scheme}://{request.host.split(':')[0]}:{app.config['STREAM_SERVER_PORT']}"
+                        f"{request.full_path.rstrip('?')}")
+    
+    if profiling_requested():
+        frames = profiled_frames(frames, request.endpoint, app.config['PROFILE_STREAM_FRAMES'])
+    limited = stream_limiter.open(frames)
+    if limited is None:
+        ret, buffer = cv2.imencode('.jpg', create_placeholder_frame("Too many open video streams"))
+        return Response(buffer.tobytes(), status=503, mimetype='image/jpeg', headers={'Retry-After': '10'})
+    return Response(limited, mimetype='multipart/x-mixed-replace; boundary=frame')
+
 @app.route('/api/register', methods=['POST'])
 def api_register():
     """Register a new user with face data"""
@@ -588,29 +3413,182 @@ def api_register():
         db.session.add(new_user)
         db.session.commit()
         
-        print(f"User created successfully with ID: {new_user.id}")
+        print(f"User created successfully with ID: {new_user.id}")
+        
+        response_data = {
+            'status': 'success',
+            'message': 'User registered successfully',
+            'user_id': new_user.id,
+            'person_id': new_user.person_id
+        }
+        
+        print(f"Sending response: {response_data}")
+        return jsonify(response_data), 200
+        
+    except Exception as e:
+        print(f"Registration error: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        
+        return jsonify({
+            'status': 'error',
+            'message': f'Registration failed: {str(e)}'
+        }), 500
+
+_import_executor = None
+_import_executor_pid = None
+_import_executor_lock = threading.Lock()
+
+def get_import_executor():
+    """Single background thread for bulk imports, created lazily once per worker process"""
+    global _import_executor, _import_executor_pid
+    with _import_executor_lock:
+        if _import_executor is None or _import_executor_pid != os.getpid():
+            _import_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='bulk-import')
+            _import_executor_pid = os.getpid()
+        return _import_executor
+
+def update_import_job(job_id, **values):
+    values['updated_at'] = datetime.utcnow()
+    ImportJob.query.filter_by(id=job_id).update(values, synchronize_session=False)
+    db.session.commit()
+
+def run_import_job(job_id):
+    """Import users from a saved upload and enroll their faces (runs on the import executor)"""
+    with app.app_context():
+        upload_path = None
+        try:
+            claimed = ImportJob.query.filter_by(id=job_id, status='queued').update({
+                'status': 'running', 'owner': current_job_owner(), 'updated_at': datetime.utcnow()
+            }, synchronize_session=False)
+            db.session.commit()
+            if not claimed:
+                return
+            job = db.session.get(ImportJob, job_id)
+            upload_path = job.upload_path
+            
+            def progress(rows, faces):
+                update_import_job(job_id, rows_processed=rows, faces_processed=faces)
+            
+            with open(upload_path, 'r', encoding='utf-8-sig', newline='') as stream:
+                report = import_users(
+                    parse_user_records(stream, job.record_format),
+                    images_root=job.images_root,
+                    batch_size=app.config['BULK_IMPORT_BATCH_SIZE'],
+                    progress=progress
+                )
+            summary = summarize_import(report)
+            update_import_job(job_id, status='succeeded', message='Import finished', summary=json.dumps(summary),
+                              report=json.dumps(report), rows_processed=summary['rows'], finished_at=datetime.utcnow())
+            print(f"Bulk import {job_id} finished: {summary}")
+        except Exception as e:
+            print(f"Bulk import error: {str(e)}")
+            import traceback
+            traceback.print_exc()
+            db.session.rollback()
+            update_import_job(job_id, status='failed', message=f'Import failed: {str(e)}'[:255], finished_at=datetime.utcnow())
+        finally:
+            if upload_path and os.path.exists(upload_path):
+                os.remove(upload_path)
+            db.session.remove()
+
+def expire_orphaned_import_jobs():
+    """Fail imports whose process is gone; re-running could half-repeat an import, so they are not re-queued"""
+    orphaned = [job_id for job_id, owner in db.session.query(ImportJob.id, ImportJob.owner)
+                .filter(ImportJob.status.in_(ImportJob.ACTIVE_STATUSES)) if not job_owner_alive(owner)]
+    if orphaned:
+        ImportJob.query.filter(ImportJob.id.in_(orphaned), ImportJob.status.in_(ImportJob.ACTIVE_STATUSES)).update({
+            'status': 'failed',
+            'message': 'Import worker stopped before finishing; users created so far are kept',
+            'finished_at': datetime.utcnow()
+        }, synchronize_session=False)
+        db.session.commit()
+
+@app.route('/api/users/import', methods=['POST'])
+@jwt_required()
+def bulk_import_users():
+    """Start a background bulk import from an uploaded CSV/NDJSON file, enrolling faces from image directories"""
+    try:
+        upload = request.files.get('file')
+        if not upload:
+            return jsonify({
+                'status': 'error',
+                'message': 'A CSV or NDJSON file is required'
+            }), 400
+        
+        record_format = request.form.get('format') or ('ndjson' if upload.filename.lower().endswith(('.ndjson', '.jsonl')) else 'csv')
+        if record_format not in ('csv', 'ndjson'):
+            return jsonify({
+                'status': 'error',
+                'message': 'Format must be csv or ndjson'
+            }), 400
+        
+        # Image directories are only resolved inside the configured import folder
+        images_root = None
+        images_dir = request.form.get('images_dir')
+        if images_dir:
+            import_root = os.path.abspath(app.config['BULK_IMPORT_FOLDER'])
+            images_root = os.path.abspath(os.path.join(import_root, images_dir))
+            if os.path.commonpath([import_root, images_root]) != import_root or not os.path.isdir(images_root):
+                return jsonify({
+                    'status': 'error',
+                    'message': 'Image directory not found in the import folder'
+                }), 400
+        
+        # The request stream is gone once we return, so keep the upload until the job has read it
+        job_id = uuid.uuid4().hex
+        upload_folder = os.path.join(app.config['BULK_IMPORT_FOLDER'], '.uploads')
+        os.makedirs(upload_folder, exist_ok=True)
+        upload_path = os.path.abspath(os.path.join(upload_folder, f"{job_id}.{record_format}"))
+        upload.save(upload_path)
+        job = ImportJob(id=job_id, record_format=record_format, upload_path=upload_path,
+                        images_root=images_root, owner=current_job_owner())
+        db.session.add(job)
+        db.session.commit()
+        
+        get_import_executor().submit(run_import_job, job.id)
         
-        response_data = {
+        return jsonify({
             'status': 'success',
-            'message': 'User registered successfully',
-            'user_id': new_user.id,
-            'person_id': new_user.person_id
-        }
-        
-        print(f"Sending response: {response_data}")
-        return jsonify(response_data), 200
+            'message': 'Import started',
+            'job_id': job.id,
+            'job': job.to_dict()
+        }), 202
         
     except Exception as e:
-        print(f"Registration error: {str(e)}")
+        print(f"Bulk import error: {str(e)}")
         import traceback
         traceback.print_exc()
+        return jsonify({
+            'status': 'error',
+            'message': f'Import failed: {str(e)}'
+        }), 500
+
+@app.route('/api/users/import/<job_id>', methods=['GET'])
+@jwt_required()
+def get_import_job(job_id):
+    """Get bulk import progress; the per-row report is included once the job has finished"""
+    try:
+        expire_orphaned_import_jobs()
+        job = db.session.get(ImportJob, job_id)
+        if not job:
+            return jsonify({
+                'status': 'error',
+                'message': 'Import job not found'
+            }), 404
         
+        return jsonify({
+            'status': 'success',
+            'job': job.to_dict(include_rows=job.finished)
+        })
+    except Exception as e:
         return jsonify({
             'status': 'error',
-            'message': f'Registration failed: {str(e)}'
+            'message': f'Failed to get import job: {str(e)}'
         }), 500
 
 @app.route('/api/capture_face', methods=['POST'])
+@admission('enrollment')
 def capture_face():
     """Capture and store face data for a user"""
     try:
@@ -679,14 +3657,23 @@ def capture_face():
         
         # Extract features from the detected face
         face_features = face_detector.extract_face_features(frame, faces[0])
+        face_data = build_face_model([face_features])
+        
+        duplicate = find_duplicate_face(face_data, exclude_user_id=user.id)
+        rejection = duplicate_face_rejection(duplicate)
+        if rejection:
+            return rejection
         
-        # Store face data
-        user.face_data = json.dumps(face_features)
+        # Store face data and keep the crop for future re-training
+        user.face_data = dump_face_model(face_data)
+        record_face_samples(user.id, [enrollment_crop_archive.store(frame, faces[0])])
         db.session.commit()
+        refresh_face_gallery_entry(user.id, face_data)
         
         return jsonify({
             'status': 'success',
-            'message': 'Face data captured and stored successfully'
+            'message': 'Face data captured and stored successfully',
+            'duplicate_of': duplicate
         })
         
     except Exception as e:
@@ -696,6 +3683,8 @@ def capture_face():
         })
 
 @app.route('/api/recognize_from_image', methods=['POST'])
+@admission('recognition')
+@profiled
 def recognize_from_image():
     """Recognize face from provided image"""
     try:
@@ -713,17 +3702,18 @@ def recognize_from_image():
         import io
         from PIL import Image
         
-        # Remove data URL prefix if present
-        if ',' in image_data:
-            image_data = image_data.split(',')[1]
-        
-        # Decode base64
-        image_bytes = base64.b64decode(image_data)
-        image = Image.open(io.BytesIO(image_bytes))
-        
-        # Convert to OpenCV format
-        frame = np.array(image)
-        frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
+        with timed_stage('decode'):
+            # Remove data URL prefix if present
+            if ',' in image_data:
+                image_data = image_data.split(',')[1]
+            
+            # Decode base64
+            image_bytes = base64.b64decode(image_data)
+            image = Image.open(io.BytesIO(image_bytes))
+            
+            # Convert to OpenCV format
+            frame = np.array(image)
+            frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
         
         print(f"Recognizing face in image of size: {frame.shape}")
         
@@ -740,55 +3730,13 @@ def recognize_from_image():
         
         # Use the first detected face
         face_features = face_detector.extract_face_features(frame, faces[0])
+        image_path = recognition_crop_archive.store(frame, faces[0])
         
-        # Compare with stored faces
-        users = User.query.filter(User.face_data.isnot(None)).all()
-        
-        if len(users) == 0:
-            return jsonify({
-                'status': 'error',
-                'message': 'No registered users with face data found in the system.'
-            })
-        
-        best_match = None
-        best_confidence = 0.0
-        
-        for user in users:
-            try:
-                stored_features = json.loads(user.face_data)
-                is_match, confidence = face_detector.compare_faces(face_features, stored_features)
-                
-                if is_match and confidence > best_confidence:
-                    best_match = user
-                    best_confidence = confidence
-            except Exception as e:
-                print(f"Error comparing with user {user.id}: {e}")
-                continue
-        
-        # Log the recognition attempt
-        log_entry = RecognitionLog(
-            user_id=best_match.id if best_match else None,
-            confidence=best_confidence,
-            status='recognized' if best_match else 'unknown'
+        # Compare with stored faces and log the attempt
+        session_key = recognition_session_key(
+            data.get('session_id') or request.headers.get('X-Recognition-Session'), request.remote_addr
         )
-        db.session.add(log_entry)
-        db.session.commit()
-        
-        if best_match:
-            print(f"✅ Face recognized: {best_match.name} (confidence: {best_confidence})")
-            return jsonify({
-                'status': 'success',
-                'message': f'Face recognized: {best_match.name}',
-                'user': best_match.to_dict(),
-                'confidence': float(best_confidence)
-            })
-        else:
-            print(f"❌ Face not recognized (best confidence: {best_confidence})")
-            return jsonify({
-                'status': 'error',
-                'message': 'Unknown user - Face detected but not recognized in the system.',
-                'confidence': float(best_confidence)
-            })
+        return jsonify(match_recognized_face(face_features, image_path, session_key, faces[0]))
         
     except Exception as e:
         print(f"Recognition error: {e}")
@@ -800,6 +3748,7 @@ def recognize_from_image():
         })
 
 @app.route('/api/recognize_face', methods=['POST'])
+@admission('recognition')
 def recognize_face():
     """Recognize a face from camera"""
     try:
@@ -846,55 +3795,15 @@ def recognize_face():
         
         # Use the first detected face
         face_features = face_detector.extract_face_features(frame, faces[0])
+        image_path = recognition_crop_archive.store(frame, faces[0])
         
-        # Compare with stored faces
-        users = User.query.filter(User.face_data.isnot(None)).all()
-        
-        if len(users) == 0:
-            return jsonify({
-                'status': 'error',
-                'message': 'No registered users with face data found in the system.'
-            })
-        
-        best_match = None
-        best_confidence = 0.0
-        
-        for user in users:
-            try:
-                stored_features = json.loads(user.face_data)
-                is_match, confidence = face_detector.compare_faces(face_features, stored_features)
-                
-                if is_match and confidence > best_confidence:
-                    best_match = user
-                    best_confidence = confidence
-            except Exception as e:
-                print(f"Error comparing with user {user.id}: {e}")
-                continue
-        
-        # Log the recognition attempt
-        log_entry = RecognitionLog(
-            user_id=best_match.id if best_match else None,
-            confidence=best_confidence,
-            status='recognized' if best_match else 'unknown'
+        # Compare with stored faces and log the attempt. Every call reads the same server camera,
+        # so without a client session id the camera itself is the caller's session.
+        data = request.get_json(silent=True) or {}
+        session_key = recognition_session_key(
+            data.get('session_id') or request.headers.get('X-Recognition-Session') or 'camera', request.remote_addr
         )
-        db.session.add(log_entry)
-        db.session.commit()
-        
-        if best_match:
-            print(f"✅ Face recognized: {best_match.name} (confidence: {best_confidence})")
-            return jsonify({
-                'status': 'success',
-                'message': f'Face recognized: {best_match.name}',
-                'user': best_match.to_dict(),
-                'confidence': float(best_confidence)
-            })
-        else:
-            print(f"❌ Face not recognized (best confidence: {best_confidence})")
-            return jsonify({
-                'status': 'error',
-                'message': 'Unknown user - Face detected but not recognized in the system.',
-                'confidence': float(best_confidence)
-            })
+        return jsonify(match_recognized_face(face_features, image_path, session_key, faces[0]))
         
     except Exception as e:
         print(f"Recognition error: {e}")
@@ -949,7 +3858,180 @@ def system_status():
             'message': f'Status check failed: {str(e)}'
         })
 
+@app.route('/api/system/log_writer')
+def log_writer_status():
+    """Get recognition log writer metrics"""
+    try:
+        return jsonify({
+            'status': 'success',
+            'log_writer': recognition_log_writer.metrics()
+        })
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': f'Failed to get log writer metrics: {str(e)}'
+        })
+
+@app.route('/api/system/match_batcher')
+def match_batcher_status():
+    """Get recognition match batching metrics"""
+    try:
+        return jsonify({
+            'status': 'success',
+            'match_batcher': match_batcher.metrics()
+        })
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': f'Failed to get match batcher metrics: {str(e)}'
+        })
+
+@app.route('/api/system/face_gallery')
+def face_gallery_status():
+    """Get the face gallery version, size and whether this worker maps it from a published file"""
+    try:
+        gallery = get_face_gallery()
+        return jsonify({
+            'status': 'success',
+            'face_gallery': {
+                'version': gallery.version,
+                'users': len(gallery),
+                'bytes': int(gallery.matrix.nbytes),
+                'source': gallery.source,
+                'folder': face_gallery_store.folder if face_gallery_store else None,
+                'published_versions': face_gallery_store.versions() if face_gallery_store else []
+            }
+        })
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': f'Failed to get face gallery status: {str(e)}'
+        })
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Stage latency histograms and per-endpoint request counters in Prometheus text format"""
+    return Response(latency_metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/profiles')
+@jwt_required()
+def list_profiles():
+    """List captured request profiles, newest first"""
+    try:
+        return jsonify({
+            'status': 'success',
+            'profiling': profile_store.metrics(),
+            'profiles': profile_store.list_profiles()
+        })
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': f'Failed to list profiles: {str(e)}'
+        })
+
+@app.route('/api/profiles/<path:filename>')
+@jwt_required()
+def download_profile(filename):
+    """Download a captured profile (pstats format), or ?format=text for the top functions by cumulative time"""
+    if os.path.basename(filename) != filename or not filename.endswith('.prof'):
+        return jsonify({
+            'status': 'error',
+            'message': 'Profile not found'
+        }), 404
+    if request.args.get('format') == 'text':
+        try:
+            limit = int(request.args.get('limit', 50))
+        except ValueError:
+            return jsonify({
+                'status': 'error',
+                'message': 'limit must be an integer'
+            }), 400
+        try:
+            return Response(profile_store.summary(filename, limit), mimetype='text/plain')
+        except OSError as e:
+            return jsonify({
+                'status': 'error',
+                'message': f'Failed to read profile: {str(e)}'
+            }), 404
+        except Exception as e:
+            # pstats raises EOFError, TypeError, ValueError and others on truncated or foreign files
+            return jsonify({
+                'status': 'error',
+                'message': f'Not a readable profile: {str(e)}'
+            }), 400
+    return send_from_directory(os.path.abspath(profile_store.folder), filename, as_attachment=True)
+
+@app.route('/api/system/identity_cache')
+def identity_cache_status():
+    """Get per-session identity cache hit rate and reverification failures for this worker process"""
+    try:
+        return jsonify({
+            'status': 'success',
+            'identity_cache': identity_cache.metrics()
+        })
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': f'Failed to get identity cache metrics: {str(e)}'
+        })
+
+@app.route('/api/system/admission')
+def admission_status():
+    """Get admission control queue depths and rejection counts for this worker process"""
+    try:
+        return jsonify({
+            'status': 'success',
+            'admission': admission_controller.metrics()
+        })
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': f'Failed to get admission metrics: {str(e)}'
+        })
+
+@app.route('/api/system/streams')
+def stream_status():
+    """Get video stream limits and usage for this worker process"""
+    try:
+        return jsonify({
+            'status': 'success',
+            'streams': stream_limiter.metrics(),
+            'streaming_mode': app.config['STREAMING_MODE'],
+            'server_threads': app.config['SERVER_THREADS'],
+            'stream_server_port': app.config['STREAM_SERVER_PORT']
+        })
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': f'Failed to get stream status: {str(e)}'
+        })
+
+@app.route('/api/system/crop_archive')
+def crop_archive_status():
+    """Get face crop archive metrics"""
+    try:
+        return jsonify({
+            'status': 'success',
+            'recognition': recognition_crop_archive.metrics(),
+            'enrollment': enrollment_crop_archive.metrics()
+        })
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': f'Failed to get crop archive metrics: {str(e)}'
+        })
+
+@app.route('/api/crops/<path:image_path>')
+@jwt_required()
+def get_face_crop(image_path):
+    """Serve an archived face crop (or its thumbnail with ?thumbnail=1)"""
+    if request.args.get('thumbnail') and image_path.endswith('.jpg'):
+        image_path = recognition_crop_archive.thumbnail_path(image_path)
+    return send_from_directory(os.path.abspath(app.config['CROP_ARCHIVE_FOLDER']), image_path)
+
 @app.route('/api/detect_faces', methods=['POST'])
+@admission('preview')
+@profiled
 def detect_faces():
     """Detect faces in an image and return coordinates"""
     try:
@@ -967,17 +4049,18 @@ def detect_faces():
         import io
         from PIL import Image
         
-        # Remove data URL prefix if present
-        if ',' in image_data:
-            image_data = image_data.split(',')[1]
-        
-        # Decode base64
-        image_bytes = base64.b64decode(image_data)
-        image = Image.open(io.BytesIO(image_bytes))
-        
-        # Convert to OpenCV format
-        frame = np.array(image)
-        frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
+        with timed_stage('decode'):
+            # Remove data URL prefix if present
+            if ',' in image_data:
+                image_data = image_data.split(',')[1]
+            
+            # Decode base64
+            image_bytes = base64.b64decode(image_data)
+            image = Image.open(io.BytesIO(image_bytes))
+            
+            # Convert to OpenCV format
+            frame = np.array(image)
+            frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
         
         print(f"Detecting faces in image of size: {frame.shape}")
         
@@ -1047,18 +4130,51 @@ def list_cameras():
 
 
 
+# Columns returned by /api/users; face_data is never loaded, only tested for NULL in SQL
+USER_LIST_COLUMNS = (
+    User.id, User.person_id, User.name, User.email, User.phone, User.address, User.city,
+    User.college_name, User.department, User.course, User.year_of_study, User.created_at, User.is_active
+)
+
 @app.route('/api/users')
 def api_users():
-    """Get all users"""
+    """Get users in id order with cursor pagination and ETag revalidation"""
     try:
-        users = User.query.all()
-        users_data = [user.to_dict() for user in users]
-        
-        return jsonify({
+        limit = min(max(request.args.get('limit', request.args.get('per_page', 100, type=int), type=int), 1), 1000)
+        cursor = request.args.get('cursor', 0, type=int)
+        
+        # The users-table version changes on every user write, so an unchanged page costs one lookup
+        etag = f"users-{get_counter(USERS_VERSION)}-{cursor}-{limit}"
+        if etag in request.if_none_match:
+            response = Response(status=304)
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = 'no-cache'
+            return response
+        
+        rows = db.session.query(
+            *USER_LIST_COLUMNS,
+            User.face_data.isnot(None).label('has_face_data')
+        ).filter(User.id > cursor).order_by(User.id).limit(limit + 1).all()
+        
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        users_data = []
+        for row in rows:
+            user_data = row._asdict()
+            user_data['created_at'] = row.created_at.isoformat() if row.created_at else None
+            user_data['has_face_data'] = bool(row.has_face_data)
+            users_data.append(user_data)
+        
+        response = jsonify({
             'status': 'success',
             'users': users_data,
-            'count': len(users_data)
+            'count': len(users_data),
+            'has_more': has_more,
+            'next_cursor': rows[-1].id if has_more else None
         })
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
     except Exception as e:
         return jsonify({
             'status': 'error',
@@ -1120,6 +4236,62 @@ def update_user(user_id):
             'message': f'Failed to update user: {str(e)}'
         }), 500
 
+@app.route('/api/users/<int:user_id>/enroll_more', methods=['POST'])
+@jwt_required()
+@admission('enrollment')
+def enroll_more(user_id):
+    """Add face samples to a user's existing model without re-enrolling"""
+    try:
+        data = request.get_json() or {}
+        images = data.get('images', [])
+        
+        if not images:
+            return jsonify({
+                'status': 'error',
+                'message': 'No images provided'
+            }), 400
+        
+        user = db.session.get(User, user_id)
+        if not user:
+            return jsonify({
+                'status': 'error',
+                'message': 'User not found'
+            }), 404
+        
+        captured_features, sample_paths = process_training_images(images)
+        if not captured_features:
+            return jsonify({
+                'status': 'error',
+                'message': 'No face detected in the provided images'
+            }), 400
+        
+        face_data = update_face_model(load_face_model(user.face_data) if user.face_data else None, captured_features)
+        duplicate = find_duplicate_face(build_face_model(captured_features), exclude_user_id=user.id)
+        rejection = duplicate_face_rejection(duplicate)
+        if rejection:
+            return rejection
+        
+        user.face_data = dump_face_model(face_data)
+        record_face_samples(user.id, sample_paths, replace=False)
+        db.session.commit()
+        refresh_face_gallery_entry(user.id, face_data)
+        
+        return jsonify({
+            'status': 'success',
+            'message': f'Added {len(captured_features)} face samples',
+            'images_captured': len(captured_features),
+            'num_samples': face_data['num_samples'],
+            'prototypes': len(face_data['prototypes']),
+            'duplicate_of': duplicate
+        })
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({
+            'status': 'error',
+            'message': f'Failed to add face samples: {str(e)}'
+        }), 500
+
 @app.route('/api/users/<int:user_id>', methods=['DELETE'])
 @jwt_required()
 def delete_user(user_id):
@@ -1132,8 +4304,11 @@ def delete_user(user_id):
                 'message': 'User not found'
             }), 404
         
-        # Delete associated recognition logs first
+        # Remove the user's contributions from the rollups, then their recognition logs and samples
+        remove_user_from_recognition_stats(user_id)
         RecognitionLog.query.filter_by(user_id=user_id).delete()
+        FaceSample.query.filter_by(user_id=user_id).delete()
+        EnrollmentJob.query.filter_by(user_id=user_id).delete()
         
         # Delete the user
         db.session.delete(user)
@@ -1154,18 +4329,24 @@ def delete_user(user_id):
 def api_dashboard_stats():
     """Get dashboard statistics"""
     try:
-        # Get user statistics
-        total_users = User.query.count()
-        active_users = User.query.filter_by(is_active=True).count()
-        users_with_faces = User.query.filter(User.face_data.isnot(None)).count()
-        
-        # Get recognition statistics
-        total_recognitions = RecognitionLog.query.count()
-        successful_recognitions = RecognitionLog.query.filter_by(status='recognized').count()
+        # Get user statistics in a single aggregate query
+        total_users, active_users, users_with_faces, departments = db.session.query(
+            db.func.count(User.id),
+            db.func.coalesce(db.func.sum(db.case((User.is_active == True, 1), else_=0)), 0),
+            db.func.count(User.face_data),
+            db.func.count(db.distinct(User.department))
+        ).one()
+        
+        # Get recognition statistics from the precomputed rollup
+        totals = get_recognition_stat('total', STAT_TOTAL_BUCKET)
+        total_recognitions = totals.total if totals else 0
+        successful_recognitions = totals.recognized if totals else 0
         
         # Get recent activity
         recent_registrations = User.query.order_by(User.created_at.desc()).limit(5).all()
-        recent_recognitions = RecognitionLog.query.order_by(RecognitionLog.timestamp.desc()).limit(5).all()
+        recent_recognitions = query_logs_with_user_names().order_by(
+            RecognitionLog.timestamp.desc(), RecognitionLog.id.desc()
+        ).limit(5).all()
         
         return jsonify({
             'status': 'success',
@@ -1174,7 +4355,8 @@ def api_dashboard_stats():
                     'total': total_users,
                     'active': active_users,
                     'with_faces': users_with_faces,
-                    'inactive': total_users - active_users
+                    'inactive': total_users - active_users,
+                    'departments': departments
                 },
                 'recognitions': {
                     'total': total_recognitions,
@@ -1182,103 +4364,233 @@ def api_dashboard_stats():
                     'failed': total_recognitions - successful_recognitions
                 },
                 'recent_registrations': [user.to_dict() for user in recent_registrations],
-                'recent_recognitions': [{
-                    'id': log.id,
-                    'user_name': User.query.get(log.user_id).name if log.user_id else 'Unknown',
-                    'status': log.status,
-                    'confidence': log.confidence,
-                    'timestamp': log.timestamp.isoformat()
-                } for log in recent_recognitions]
+                'recent_recognitions': [log.to_dict(user_name) for log, user_name in recent_recognitions]
             }
         })
     except Exception as e:
         return jsonify({
             'status': 'error',
-            'message': f'Failed to get dashboard stats: {str(e)}'
+            'message': f'Failed to get dashboard stats: {str(e)}'
+        })
+
+@app.route('/api/logs')
+def api_logs():
+    """Get recognition logs, newest first, with keyset pagination"""
+    try:
+        limit = min(max(request.args.get('limit', 50, type=int), 1), 500)
+        cursor = request.args.get('cursor')
+
+        try:
+            filters = build_log_filters(request.args)
+            if cursor:
+                filters.append(log_cursor_filter(cursor))
+        except (ValueError, TypeError) as e:
+            return jsonify({
+                'status': 'error',
+                'message': f'Invalid filter or cursor: {str(e)}'
+            }), 400
+
+        rows = query_logs_with_user_names().filter(*filters).order_by(
+            RecognitionLog.timestamp.desc(), RecognitionLog.id.desc()
+        ).limit(limit + 1).all()
+
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        logs_data = [log.to_dict(user_name) for log, user_name in rows]
+
+        return jsonify({
+            'status': 'success',
+            'logs': logs_data,
+            'count': len(logs_data),
+            'has_more': has_more,
+            'next_cursor': encode_log_cursor(rows[-1][0]) if has_more else None
+        })
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': f'Failed to get logs: {str(e)}'
+        })
+
+@app.route('/api/logs/export')
+@jwt_required()
+def export_logs():
+    """Stream recognition logs as CSV or NDJSON, optionally gzip-compressed"""
+    export_format = request.args.get('format', 'csv')
+    if export_format not in ('csv', 'ndjson'):
+        return jsonify({
+            'status': 'error',
+            'message': 'Format must be csv or ndjson'
+        }), 400
+    
+    try:
+        filters = build_log_filters(request.args)
+    except (ValueError, TypeError) as e:
+        return jsonify({
+            'status': 'error',
+            'message': f'Invalid filter: {str(e)}'
+        }), 400
+    
+    use_gzip = request.args.get('gzip', '').lower() in ('1', 'true', 'yes')
+    chunk_size = min(max(request.args.get('chunk_size', 1000, type=int), 100), 10000)
+    
+    def encode_chunk(rows):
+        if export_format == 'ndjson':
+            lines = []
+            for row in rows:
+                record = dict(zip(LOG_EXPORT_COLUMNS, row))
+                record['timestamp'] = record['timestamp'].isoformat() if record['timestamp'] else None
+                record['user_name'] = record['user_name'] or 'Unknown'
+                lines.append(json.dumps(record))
+            return ('\n'.join(lines) + '\n').encode('utf-8')
+        
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in rows:
+            row = list(row)
+            row[1] = row[1].isoformat() if row[1] else ''
+            row[4] = row[4] or 'Unknown'
+            writer.writerow(row)
+        return buffer.getvalue().encode('utf-8')
+    
+    def generate():
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if use_gzip else None
+        
+        def emit(data):
+            return compressor.compress(data) if compressor else data
+        
+        if export_format == 'csv':
+            header = io.StringIO()
+            csv.writer(header).writerow(LOG_EXPORT_COLUMNS)
+            yield emit(header.getvalue().encode('utf-8'))
+        
+        for rows in iter_log_export_rows(filters, chunk_size):
+            data = emit(encode_chunk(rows))
+            if data:
+                yield data
+        
+        if compressor:
+            yield compressor.flush()
+    
+    extension = 'csv' if export_format == 'csv' else 'ndjson'
+    headers = {
+        'Content-Disposition': f"attachment; filename=recognition_logs_{datetime.utcnow().strftime('%Y-%m-%d')}.{extension}"
+    }
+    if use_gzip:
+        headers['Content-Encoding'] = 'gzip'
+    
+    mimetype = 'text/csv' if export_format == 'csv' else 'application/x-ndjson'
+    return Response(stream_with_context(generate()), mimetype=mimetype, headers=headers)
+
+@app.route('/api/logs/clear', methods=['DELETE'])
+def clear_logs():
+    """Clear all recognition logs"""
+    try:
+        RecognitionLog.query.delete()
+        RecognitionStatUser.query.delete()
+        RecognitionStat.query.delete()
+        db.session.commit()
+        
+        return jsonify({
+            'status': 'success',
+            'message': 'All recognition logs cleared'
+        })
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': f'Failed to clear logs: {str(e)}'
         })
 
-@app.route('/api/logs')
-def api_logs():
-    """Get recognition logs"""
+@app.route('/api/logs/retention', methods=['GET'])
+@jwt_required()
+def log_retention_status():
+    """Get log retention settings, counters and archive files"""
     try:
-        logs = RecognitionLog.query.order_by(RecognitionLog.timestamp.desc()).limit(50).all()
-        logs_data = []
-        
-        for log in logs:
-            user_name = 'Unknown'
-            if log.user_id:
-                user = User.query.get(log.user_id)
-                if user:
-                    user_name = user.name
-            
-            logs_data.append({
-                'id': log.id,
-                'user_name': user_name,
-                'confidence': log.confidence,
-                'timestamp': log.timestamp.isoformat(),
-                'status': log.status
-            })
-        
         return jsonify({
             'status': 'success',
-            'logs': logs_data,
-            'count': len(logs_data)
+            'retention': log_retention_worker.metrics(),
+            'archives': log_retention_worker.list_archives()
         })
     except Exception as e:
         return jsonify({
             'status': 'error',
-            'message': f'Failed to get logs: {str(e)}'
+            'message': f'Failed to get retention status: {str(e)}'
         })
 
-@app.route('/api/logs/clear', methods=['DELETE'])
-def clear_logs():
-    """Clear all recognition logs"""
+@app.route('/api/logs/retention/run', methods=['POST'])
+@jwt_required()
+def run_log_retention():
+    """Wake the background retention thread"""
+    if not log_retention_worker.enabled:
+        return jsonify({
+            'status': 'error',
+            'message': 'Log retention is disabled (set LOG_RETENTION_DAYS)'
+        }), 400
+    
+    log_retention_worker.trigger()
+    return jsonify({
+        'status': 'success',
+        'message': 'Log retention run scheduled'
+    }), 202
+
+@app.route('/api/logs/archives/<path:filename>')
+@jwt_required()
+def download_log_archive(filename):
+    """Download an archived day of recognition logs"""
+    return send_from_directory(os.path.abspath(log_retention_worker.archive_folder), filename, as_attachment=True)
+
+@app.route('/api/stats/daily')
+def daily_stats():
+    """Get per-day recognition rollups, including days whose logs were archived"""
     try:
-        RecognitionLog.query.delete()
-        db.session.commit()
+        try:
+            date_to = parse_date_param(request.args.get('date_to'), end=True) or datetime.utcnow()
+            date_from = parse_date_param(request.args.get('date_from')) or (date_to - timedelta(days=30))
+        except ValueError as e:
+            return jsonify({
+                'status': 'error',
+                'message': f'Invalid date: {str(e)}'
+            }), 400
+        
+        days = RecognitionStat.query.filter(
+            RecognitionStat.period == 'day',
+            RecognitionStat.bucket_start >= stat_bucket_start('day', date_from),
+            RecognitionStat.bucket_start < date_to
+        ).order_by(RecognitionStat.bucket_start).all()
         
         return jsonify({
             'status': 'success',
-            'message': 'All recognition logs cleared'
+            'days': [day.to_dict() for day in days],
+            'count': len(days)
         })
     except Exception as e:
         return jsonify({
             'status': 'error',
-            'message': f'Failed to clear logs: {str(e)}'
+            'message': f'Failed to get daily stats: {str(e)}'
         })
 
 @app.route('/api/stats/today')
 def today_stats():
     """Get today's recognition statistics"""
     try:
-        from datetime import date
-        today = date.today()
-        
-        # Get today's logs
-        today_logs = RecognitionLog.query.filter(
-            db.func.date(RecognitionLog.timestamp) == today
-        ).all()
-        
-        # Calculate stats
-        total_recognitions = len(today_logs)
-        unique_users = len(set(log.user_id for log in today_logs if log.user_id))
+        # Log timestamps are UTC, so "today" is the current UTC day bucket
+        today = get_recognition_stat('day', stat_bucket_start('day', datetime.utcnow()))
         
         # Get last recognition
-        last_log = RecognitionLog.query.order_by(RecognitionLog.timestamp.desc()).first()
+        last_row = query_logs_with_user_names().order_by(
+            RecognitionLog.timestamp.desc(), RecognitionLog.id.desc()
+        ).first()
         last_recognition = 'None'
-        if last_log:
-            if last_log.user_id:
-                user = User.query.get(last_log.user_id)
-                user_name = user.name if user else 'Unknown'
-            else:
-                user_name = 'Unknown'
-            last_recognition = f"{user_name} at {last_log.timestamp.strftime('%H:%M:%S')}"
+        if last_row:
+            last_log, user_name = last_row
+            last_recognition = f"{user_name or 'Unknown'} at {last_log.timestamp.strftime('%H:%M:%S')}"
         
         return jsonify({
             'status': 'success',
             'stats': {
-                'total_recognitions': total_recognitions,
-                'unique_users': unique_users,
+                'total_recognitions': today.total if today else 0,
+                'recognized': today.recognized if today else 0,
+                'unknown': today.unknown if today else 0,
+                'unique_users': today.unique_users if today else 0,
                 'last_recognition': last_recognition
             }
         })
@@ -1362,8 +4674,9 @@ def video_feed_with_recognition():
                     time.sleep(0.5)
                 return
             
-            # Load all users with face data
-            users = User.query.filter(User.face_data.isnot(None)).all()
+            # Enrolled users' names, reloaded whenever the gallery is rebuilt
+            gallery = None
+            user_names = {}
             
             frame_count = 0
             while True:
@@ -1391,27 +4704,19 @@ def video_feed_with_recognition():
                                 face_features = face_detector.extract_face_features(frame, (x, y, w, h))
                                 
                                 # Compare with stored faces
-                                best_match = None
-                                best_confidence = 0.0
-                                
-                                for user in users:
-                                    try:
-                                        stored_features = json.loads(user.face_data)
-                                        is_match, confidence = face_detector.compare_faces(face_features, stored_features)
-                                        
-                                        if is_match and confidence > best_confidence:
-                                            best_match = user
-                                            best_confidence = confidence
-                                    except:
-                                        continue
+                                current_gallery = get_face_gallery()
+                                if current_gallery is not gallery:
+                                    gallery = current_gallery
+                                    user_names = dict(db.session.query(User.id, User.name).filter(User.id.in_(gallery.user_ids.tolist())))
+                                best_match_id, best_confidence = gallery.match(face_features)
                                 
                                 # Draw rectangle and name
-                                if best_match and best_confidence > 0.6:
+                                if best_match_id is not None:
                                     # Green rectangle for recognized user
                                     cv2.rectangle(frame, (x, y), (x+w, y+h), (0, 255, 0), 3)
                                     
                                     # Draw name background
-                                    name_text = f"{best_match.name}"
+                                    name_text = f"{user_names.get(best_match_id, 'Unknown')}"
                                     conf_text = f"{int(best_confidence * 100)}%"
                                     
                                     # Name label
@@ -1439,11 +4744,7 @@ def video_feed_with_recognition():
                     cv2.putText(frame, f'Time: {datetime.now().strftime("%H:%M:%S")}', 
                                (10, 60), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
                     
-                    ret, buffer = cv2.imencode('.jpg', frame)
-                    if ret:
-                        frame = buffer.tobytes()
-                        yield (b'--frame\r\n'
-                               b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
+                    yield mjpeg_frame(frame)
                     
                     frame_count += 1
                     time.sleep(0.033)  # ~30 FPS
@@ -1464,9 +4765,12 @@ def video_feed_with_recognition():
                 except:
                     pass
     
-    return Response(generate(), mimetype='multipart/x-mixed-replace; boundary=frame')
+    # The generator queries the database, so it keeps the request context while streaming
+    return stream_response(stream_with_context(generate()))
 
 @app.route('/api/train_from_images', methods=['POST'])
+@admission('enrollment')
+@profiled
 def train_from_images():
     """Train face model from provided images"""
     try:
@@ -1486,6 +4790,16 @@ def train_from_images():
                 'message': 'No images provided'
             }), 400
         
+        try:
+            target_samples = int(data.get('target_samples') or app.config['TRAINING_TARGET_SAMPLES'])
+        except (TypeError, ValueError):
+            target_samples = -1
+        if target_samples < 0:
+            return jsonify({
+                'status': 'error',
+                'message': 'target_samples must be a non-negative integer'
+            }), 400
+        
         user = User.query.get(user_id)
         if not user:
             return jsonify({
@@ -1493,39 +4807,7 @@ def train_from_images():
                 'message': 'User not found'
             }), 404
         
-        # Process images
-        import base64
-        import io
-        from PIL import Image
-        
-        captured_features = []
-        
-        for idx, image_data in enumerate(images):
-            try:
-                # Remove data URL prefix if present
-                if ',' in image_data:
-                    image_data = image_data.split(',')[1]
-                
-                # Decode base64
-                image_bytes = base64.b64decode(image_data)
-                image = Image.open(io.BytesIO(image_bytes))
-                
-                # Convert to OpenCV format
-                frame = np.array(image)
-                frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
-                
-                # Detect faces
-                faces = face_detector.detect_faces(frame)
-                
-                if len(faces) > 0:
-                    # Use the first detected face
-                    face_features = face_detector.extract_face_features(frame, faces[0])
-                    captured_features.append(face_features)
-                    print(f"✓ Processed image {idx + 1}/{len(images)}")
-                
-            except Exception as e:
-                print(f"Error processing image {idx + 1}: {e}")
-                continue
+        captured_features, sample_paths = process_training_images(images, target_samples)
         
         if len(captured_features) < 3:
             return jsonify({
@@ -1534,22 +4816,27 @@ def train_from_images():
             }), 400
         
         # Average the features
-        averaged_features = captured_features[0].copy()
-        if len(captured_features) > 1:
-            histograms = [f['histogram'] for f in captured_features]
-            avg_histogram = np.mean(histograms, axis=0).tolist()
-            averaged_features['histogram'] = avg_histogram
+        averaged_features = build_face_model(captured_features)
+        
+        duplicate = find_duplicate_face(averaged_features, exclude_user_id=user.id)
+        rejection = duplicate_face_rejection(duplicate)
+        if rejection:
+            return rejection
         
         # Store the averaged features
-        user.face_data = json.dumps(averaged_features)
+        user.face_data = dump_face_model(averaged_features)
+        record_face_samples(user.id, sample_paths)
         db.session.commit()
+        refresh_face_gallery_entry(user.id, averaged_features)
         
         print(f"Training complete! Processed {len(captured_features)} images")
         
         return jsonify({
             'status': 'success',
             'message': f'Face training complete with {len(captured_features)} images',
-            'images_captured': len(captured_features)
+            'images_captured': len(captured_features),
+            'images_received': len(images),
+            'duplicate_of': duplicate
         })
         
     except Exception as e:
@@ -1561,40 +4848,82 @@ def train_from_images():
             'message': str(e)
         }), 500
 
-@app.route('/api/capture_training_images', methods=['POST'])
-def capture_training_images():
-    """Capture multiple images for face training"""
+_enrollment_executor = None
+_enrollment_executor_pid = None
+_enrollment_executor_lock = threading.Lock()
+
+def current_job_owner():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+def job_owner_alive(owner):
+    """False only when the owning process is known to be gone (same host, pid no longer exists)"""
+    if not owner or ':' not in owner:
+        return False
+    host, _, pid = owner.rpartition(':')
+    if host != socket.gethostname() or os.name == 'nt':
+        # Processes on other hosts cannot be checked, and os.kill(pid, 0) is not a probe on Windows
+        return True
     try:
-        data = request.get_json()
-        user_id = data.get('user_id')
-        num_images = data.get('num_images', 20)
-        
-        if not user_id:
-            return jsonify({
-                'status': 'error',
-                'message': 'User ID is required'
-            }), 400
-        
-        user = User.query.get(user_id)
-        if not user:
-            return jsonify({
-                'status': 'error',
-                'message': 'User not found'
-            }), 404
-        
-        # Capture multiple images
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, ValueError):
+        return True
+    return True
+
+def get_enrollment_executor():
+    """Dedicated thread pool for camera enrollment jobs, created lazily once per worker process"""
+    global _enrollment_executor, _enrollment_executor_pid
+    with _enrollment_executor_lock:
+        if _enrollment_executor is None or _enrollment_executor_pid != os.getpid():
+            _enrollment_executor = ThreadPoolExecutor(
+                max_workers=app.config['ENROLLMENT_JOB_WORKERS'], thread_name_prefix='enrollment'
+            )
+            _enrollment_executor_pid = os.getpid()
+        return _enrollment_executor
+
+class EnrollmentCancelled(Exception):
+    pass
+
+def update_enrollment_job(job_id, **values):
+    """Record job progress in its own short transaction; returns True if cancellation was requested"""
+    values['updated_at'] = datetime.utcnow()
+    EnrollmentJob.query.filter_by(id=job_id).update(values)
+    db.session.commit()
+    return bool(db.session.query(EnrollmentJob.cancel_requested).filter_by(id=job_id).scalar())
+
+def finish_enrollment_job(job_id, status, message):
+    update_enrollment_job(job_id, status=status, message=message, finished_at=datetime.utcnow())
+    print(f"Enrollment job {job_id} {status}: {message}")
+
+def run_enrollment_job(job_id):
+    """Capture face images from the camera and train the user's model (runs on the enrollment executor)"""
+    with app.app_context():
         cap = None
-        captured_features = []
-        
         try:
+            # Claim the job atomically, so a re-queued job never runs twice
+            claimed = EnrollmentJob.query.filter_by(id=job_id, status='queued').update({
+                'status': 'running', 'owner': current_job_owner(), 'updated_at': datetime.utcnow()
+            }, synchronize_session=False)
+            db.session.commit()
+            if not claimed:
+                return
+            job = db.session.get(EnrollmentJob, job_id)
+            num_images = job.requested_images
+            user_id = job.user_id
+            if job.cancel_requested:
+                raise EnrollmentCancelled()
+            
+            # (quality, crop) for every face that passed the quality gate
+            candidates = []
+            candidate_target = max(num_images, int(num_images * app.config['CAPTURE_CANDIDATE_FACTOR']))
+            
             cap = initialize_camera()
             if not cap or not cap.isOpened():
-                return jsonify({
-                    'status': 'error',
-                    'message': 'Could not initialize camera. Please check camera permissions and ensure no other application is using the camera.'
-                }), 500
+                finish_enrollment_job(job_id, 'failed', 'Could not initialize camera. Please check camera permissions and ensure no other application is using the camera.')
+                return
             
-            print(f"Capturing {num_images} images for user {user_id}...")
+            print(f"Capturing {num_images} images for user {user_id} (job {job_id})...")
             
             # Warm up camera - skip first 3 frames only
             for _ in range(3):
@@ -1604,10 +4933,17 @@ def capture_training_images():
             attempts = 0
             max_attempts = num_images * 5  # Allow more attempts to find face
             consecutive_failures = 0
+            last_update = time.monotonic()
             
-            while len(captured_features) < num_images and attempts < max_attempts:
+            while len(candidates) < candidate_target and attempts < max_attempts:
                 attempts += 1
                 
+                # Publish progress (and pick up cancellation) at most twice a second
+                if time.monotonic() - last_update >= 0.5:
+                    last_update = time.monotonic()
+                    if update_enrollment_job(job_id, images_captured=min(len(candidates), num_images), attempts=attempts):
+                        raise EnrollmentCancelled()
+                
                 # Read frame
                 ret, frame = cap.read()
                 if not ret or frame is None:
@@ -1625,10 +4961,12 @@ def capture_training_images():
                     faces = face_detector.detect_faces(frame)
                     
                     if len(faces) > 0:
-                        # Use the first detected face
-                        face_features = face_detector.extract_face_features(frame, faces[0])
-                        captured_features.append(face_features)
-                        print(f"✓ Captured image {len(captured_features)}/{num_images}")
+                        # Use the first detected face; only score it here, features come later
+                        quality = face_detector.face_quality(frame, faces[0])
+                        if quality['score'] >= app.config['FACE_QUALITY_MIN']:
+                            x, y, w, h = [int(v) for v in faces[0]]
+                            candidates.append((quality['score'], frame[y:y+h, x:x+w].copy()))
+                            print(f"✓ Captured image {len(candidates)}/{candidate_target} (quality {quality['score']:.2f})")
                         
                         # Very short delay between successful captures for speed
                         time.sleep(0.05)
@@ -1641,59 +4979,246 @@ def capture_training_images():
                     time.sleep(0.05)
                     continue
             
-            print(f"Capture complete: {len(captured_features)} images captured in {attempts} attempts")
+            cap.release()
+            cap = None
+            
+            # Extract features only for the best frames
+            candidates.sort(key=lambda candidate: candidate[0], reverse=True)
+            best = candidates[:num_images]
+            captured_features = [face_detector.extract_face_features(crop, (0, 0, crop.shape[1], crop.shape[0])) for _, crop in best]
+            sample_paths = [enrollment_crop_archive.store_crop(crop) for _, crop in best]
+            
+            print(f"Capture complete: {len(captured_features)} best of {len(candidates)} faces in {attempts} attempts"
+                  + (f", quality {best[-1][0]:.2f}-{best[0][0]:.2f}" if best else ""))
+            if update_enrollment_job(job_id, images_captured=len(captured_features), attempts=attempts):
+                raise EnrollmentCancelled()
             
+            if len(captured_features) < 3:
+                finish_enrollment_job(job_id, 'failed', f'Not enough face images captured. Got {len(captured_features)}, need at least 3. Please ensure your face is clearly visible in the camera with good lighting.')
+                return
+            
+            user = db.session.get(User, user_id)
+            if user is None:
+                finish_enrollment_job(job_id, 'failed', 'User not found')
+                return
+            
+            # Average the features from multiple captures for better accuracy
+            face_data = build_face_model(captured_features)
+            duplicate = find_duplicate_face(face_data, exclude_user_id=user.id)
+            if duplicate and app.config['DUPLICATE_FACE_POLICY'] == 'reject':
+                finish_enrollment_job(job_id, 'failed', f"This face is already enrolled as {duplicate['person_id']}")
+                return
+            
+            user.face_data = dump_face_model(face_data)
+            record_face_samples(user.id, sample_paths)
+            db.session.commit()
+            refresh_face_gallery_entry(user.id, face_data)
+            
+            message = f'Face training complete with {len(captured_features)} images'
+            if duplicate:
+                message += f" (face resembles {duplicate['person_id']}, score {duplicate['score']:.2f})"
+            finish_enrollment_job(job_id, 'succeeded', message)
+            
+        except EnrollmentCancelled:
+            db.session.rollback()
+            finish_enrollment_job(job_id, 'cancelled', 'Enrollment cancelled')
         except Exception as e:
-            print(f"Camera capture error: {e}")
-            return jsonify({
-                'status': 'error',
-                'message': f'Camera error: {str(e)}'
-            }), 500
+            print(f"Training error: {str(e)}")
+            import traceback
+            traceback.print_exc()
+            db.session.rollback()
+            finish_enrollment_job(job_id, 'failed', f'Training failed: {str(e)}')
         finally:
             if cap:
                 try:
                     cap.release()
                 except:
                     pass
+            db.session.remove()
+
+def expire_stale_enrollment_jobs():
+    """Fail running jobs that stopped reporting progress and re-queue queued jobs whose process is gone
+
+    Queued jobs do not report progress while they wait behind another capture, so they
+    are judged by whether their owning process still exists, never by age.
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=app.config['ENROLLMENT_JOB_STALE_AFTER'])
+    expired = EnrollmentJob.query.filter(
+        EnrollmentJob.status == 'running',
+        EnrollmentJob.updated_at < cutoff
+    ).update({
+        'status': 'failed',
+        'message': 'Enrollment worker stopped responding',
+        'finished_at': datetime.utcnow()
+    }, synchronize_session=False)
+    if expired:
+        db.session.commit()
+    
+    orphaned = [(job_id, owner) for job_id, owner in db.session.query(EnrollmentJob.id, EnrollmentJob.owner)
+                .filter(EnrollmentJob.status == 'queued') if not job_owner_alive(owner)]
+    for job_id, owner in orphaned:
+        # Take ownership only if no other process re-queued it first
+        claimed = EnrollmentJob.query.filter(
+            EnrollmentJob.id == job_id, EnrollmentJob.status == 'queued',
+            EnrollmentJob.owner == owner if owner is not None else EnrollmentJob.owner.is_(None)
+        ).update({'owner': current_job_owner(), 'updated_at': datetime.utcnow()}, synchronize_session=False)
+        db.session.commit()
+        if claimed:
+            print(f"Re-queued enrollment job {job_id} (owner {owner} is gone)")
+            get_enrollment_executor().submit(run_enrollment_job, job_id)
+
+@app.route('/api/capture_training_images', methods=['POST'])
+def capture_training_images():
+    """Start a background job that captures multiple images for face training"""
+    try:
+        data = request.get_json()
+        user_id = data.get('user_id')
+        num_images = int(data.get('num_images', 20))
         
-        if len(captured_features) < 3:
+        if not user_id:
+            return jsonify({
+                'status': 'error',
+                'message': 'User ID is required'
+            }), 400
+        
+        if num_images < 3:
             return jsonify({
                 'status': 'error',
-                'message': f'Not enough face images captured. Got {len(captured_features)}, need at least 3. Please ensure your face is clearly visible in the camera with good lighting.'
+                'message': 'num_images must be at least 3'
             }), 400
         
-        # Average the features from multiple captures for better accuracy
-        # Take the first capture as the base model (they should all be similar)
-        averaged_features = captured_features[0].copy()
+        user = User.query.get(user_id)
+        if not user:
+            return jsonify({
+                'status': 'error',
+                'message': 'User not found'
+            }), 404
+        
+        expire_stale_enrollment_jobs()
+        active = EnrollmentJob.query.filter(EnrollmentJob.status.in_(EnrollmentJob.ACTIVE_STATUSES))
+        existing = active.filter(EnrollmentJob.user_id == user.id).first()
+        if existing:
+            return jsonify({
+                'status': 'error',
+                'message': 'An enrollment is already in progress for this user',
+                'job': existing.to_dict()
+            }), 409
         
-        # Average the histograms
-        if len(captured_features) > 1:
-            histograms = [f['histogram'] for f in captured_features]
-            avg_histogram = np.mean(histograms, axis=0).tolist()
-            averaged_features['histogram'] = avg_histogram
+        if active.count() >= app.config['ENROLLMENT_JOB_MAX_PENDING']:
+            response = jsonify({
+                'status': 'error',
+                'message': 'Too many enrollments in progress, please try again shortly'
+            })
+            response.headers['Retry-After'] = '10'
+            return response, 429
         
-        # Store the averaged features
-        user.face_data = json.dumps(averaged_features)
+        job = EnrollmentJob(user_id=user.id, requested_images=num_images, owner=current_job_owner())
+        db.session.add(job)
         db.session.commit()
         
-        print(f"Training complete! Captured {len(captured_features)} images")
+        get_enrollment_executor().submit(run_enrollment_job, job.id)
         
         return jsonify({
             'status': 'success',
-            'message': f'Face training complete with {len(captured_features)} images',
-            'images_captured': len(captured_features)
-        })
+            'message': 'Face training started',
+            'job_id': job.id,
+            'job': job.to_dict()
+        }), 202
         
     except Exception as e:
         print(f"Training error: {str(e)}")
-        import traceback
-        traceback.print_exc()
         return jsonify({
             'status': 'error',
             'message': f'Training failed: {str(e)}'
         }), 500
 
+@app.route('/api/enrollment_jobs/<job_id>', methods=['GET'])
+def get_enrollment_job(job_id):
+    """Get enrollment job progress"""
+    try:
+        expire_stale_enrollment_jobs()
+        job = db.session.get(EnrollmentJob, job_id)
+        if not job:
+            return jsonify({
+                'status': 'error',
+                'message': 'Enrollment job not found'
+            }), 404
+        
+        return jsonify({
+            'status': 'success',
+            'job': job.to_dict()
+        })
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': f'Failed to get enrollment job: {str(e)}'
+        }), 500
+
+@app.route('/api/enrollment_jobs/<job_id>/cancel', methods=['POST'])
+def cancel_enrollment_job(job_id):
+    """Cancel a queued or running enrollment job"""
+    try:
+        job = db.session.get(EnrollmentJob, job_id)
+        if not job:
+            return jsonify({
+                'status': 'error',
+                'message': 'Enrollment job not found'
+            }), 404
+        
+        if job.finished:
+            return jsonify({
+                'status': 'error',
+                'message': f'Enrollment job already {job.status}',
+                'job': job.to_dict()
+            }), 409
+        
+        # The job thread sees the flag at its next progress update and stops
+        job.cancel_requested = True
+        db.session.commit()
+        
+        return jsonify({
+            'status': 'success',
+            'message': 'Cancellation requested',
+            'job': job.to_dict()
+        }), 202
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': f'Failed to cancel enrollment job: {str(e)}'
+        }), 500
+
+@app.route('/api/enrollment_jobs/<job_id>/result', methods=['GET'])
+def get_enrollment_job_result(job_id):
+    """Get the outcome of a finished enrollment job"""
+    try:
+        job = db.session.get(EnrollmentJob, job_id)
+        if not job:
+            return jsonify({
+                'status': 'error',
+                'message': 'Enrollment job not found'
+            }), 404
+        
+        if not job.finished:
+            return jsonify({
+                'status': 'error',
+                'message': 'Enrollment job is still in progress',
+                'job': job.to_dict()
+            }), 409
+        
+        return jsonify({
+            'status': 'success' if job.status == 'succeeded' else 'error',
+            'message': job.message,
+            'images_captured': job.images_captured,
+            'job': job.to_dict()
+        })
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': f'Failed to get enrollment result: {str(e)}'
+        }), 500
+
 @app.route('/api/register_with_face', methods=['POST'])
+@admission('enrollment')
 def register_with_face():
     """Register a new user and capture face data in one step"""
     try:
@@ -1733,12 +5258,60 @@ def register_with_face():
                 'message': 'User with this email already exists'
             }), 409
         
-        # Generate person ID
-        person_id = generate_person_id()
-        
-        # Step 1: Create user
+        # Step 1: Capture the face before creating the account, so a duplicate face is rejected
+        # against the current gallery without inserting (and then deleting) the user
+        face_data = None
+        face_sample = None
+        face_error = None
+        try:
+            # Capture frame from camera with improved error handling
+            cap = None
+            frame = None
+            try:
+                cap = initialize_camera()
+                if not cap or not cap.isOpened():
+                    face_error = 'could not initialize camera'
+                else:
+                    # Try multiple frame captures for better reliability
+                    ret = None
+                    for attempt in range(3):
+                        ret, frame = cap.read()
+                        if ret and frame is not None:
+                            break
+                        time.sleep(0.1)
+                    if not ret or frame is None:
+                        frame = None
+                        face_error = 'could not capture face image from camera'
+            except Exception as cam_error:
+                face_error = f'camera error: {str(cam_error)}'
+            finally:
+                if cap:
+                    cap.release()
+            
+            if frame is not None:
+                # Detect faces in the captured frame
+                faces = face_detector.detect_faces(frame)
+                if len(faces) == 0:
+                    face_error = 'no face detected in the image'
+                elif len(faces) > 1:
+                    face_error = 'multiple faces detected. Please ensure only one person is in the frame'
+                else:
+                    # Extract features from the detected face
+                    face_data = build_face_model([face_detector.extract_face_features(frame, faces[0])])
+                    face_sample = (frame, faces[0])
+        except Exception as capture_error:
+            print(f"Face capture error: {str(capture_error)}")
+            face_data = None
+            face_error = f'face capture failed: {str(capture_error)}'
+        
+        duplicate = find_duplicate_face(face_data) if face_data is not None else None
+        rejection = duplicate_face_rejection(duplicate)
+        if rejection:
+            return rejection
+        
+        # Step 2: Create the user, with the face model when one was captured
         new_user = User(
-            person_id=person_id,
+            person_id=generate_person_id(),
             name=name,
             email=email,
             phone=phone,
@@ -1747,94 +5320,39 @@ def register_with_face():
             college_name=college_name,
             department=department,
             course=course,
-            year_of_study=year_of_study
+            year_of_study=year_of_study,
+            face_data=dump_face_model(face_data) if face_data is not None else None
         )
-        
         db.session.add(new_user)
+        db.session.flush()
+        if face_sample is not None:
+            # Keep the crop for future re-training
+            record_face_samples(new_user.id, [enrollment_crop_archive.store(*face_sample)])
         db.session.commit()
         
         print(f"User created successfully with ID: {new_user.id}")
         
-        # Step 2: Capture face data
-        try:
-            # Capture frame from camera with improved error handling
-            cap = None
-            try:
-                cap = initialize_camera()
-                if not cap or not cap.isOpened():
-                    return jsonify({
-                        'status': 'partial_success',
-                        'message': 'User registered but could not initialize camera',
-                        'user_id': new_user.id
-                    }), 200
-                
-                # Try multiple frame captures for better reliability
-                ret, frame = None, None
-                for attempt in range(3):
-                    ret, frame = cap.read()
-                    if ret and frame is not None:
-                        break
-                    time.sleep(0.1)
-                
-                if not ret or frame is None:
-                    return jsonify({
-                        'status': 'partial_success',
-                        'message': 'User registered but could not capture face image from camera',
-                        'user_id': new_user.id
-                    }), 200
-            except Exception as cam_error:
-                return jsonify({
-                    'status': 'partial_success',
-                    'message': f'User registered but camera error: {str(cam_error)}',
-                    'user_id': new_user.id
-                }), 200
-            finally:
-                if cap:
-                    cap.release()
-            
-            # Detect faces in the captured frame
-            faces = face_detector.detect_faces(frame)
-            
-            if len(faces) == 0:
-                return jsonify({
-                    'status': 'partial_success',
-                    'message': 'User registered but no face detected in the image',
-                    'user_id': new_user.id
-                }), 200
-            
-            if len(faces) > 1:
-                return jsonify({
-                    'status': 'partial_success',
-                    'message': 'User registered but multiple faces detected. Please ensure only one person is in the frame',
-                    'user_id': new_user.id
-                }), 200
-            
-            # Extract features from the detected face
-            face_features = face_detector.extract_face_features(frame, faces[0])
-            
-            # Store face data
-            new_user.face_data = json.dumps(face_features)
-            db.session.commit()
-            
-            print(f"Face data captured and stored for user ID: {new_user.id}")
-            
-            return jsonify({
-                'status': 'success',
-                'message': 'User registered and face data captured successfully',
-                'user_id': new_user.id,
-                'person_id': new_user.person_id,
-                'face_captured': True
-            }), 200
-            
-        except Exception as face_error:
-            print(f"Face capture error: {str(face_error)}")
+        if face_data is None:
             return jsonify({
                 'status': 'partial_success',
-                'message': f'User registered but face capture failed: {str(face_error)}',
+                'message': f'User registered but {face_error}',
                 'user_id': new_user.id,
                 'face_captured': False
             }), 200
         
+        # Patch the new face into the gallery instead of invalidating it
+        refresh_face_gallery_entry(new_user.id, face_data)
+        print(f"Face data captured and stored for user ID: {new_user.id}")
+        
+        return jsonify({
+            'status': 'success',
+            'message': 'User registered and face data captured successfully',
+            'user_id': new_user.id,
+            'person_id': new_user.person_id,
+            'face_captured': True,
+            'duplicate_of': duplicate
+        }), 200
+        
     except Exception as e:
         print(f"Registration with face error: {str(e)}")
         import traceback
@@ -1861,12 +5379,34 @@ def create_default_admin():
     except Exception as e:
         print(f"Failed to create default admin: {e}")
 
+def ensure_indexes():
+    """Create model indexes that db.create_all() skips on tables that already exist"""
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            try:
+                index.create(bind=db.engine, checkfirst=True)
+            except Exception as e:
+                print(f"Failed to create index {index.name}: {e}")
+
 def initialize_app():
     """Initialize the application"""
     with app.app_context():
         try:
+            configure_storage_engine(db.engine)
+            
             # Create database tables
             db.create_all()
+            ensure_indexes()
+            
+            ensure_counter(USERS_VERSION)
+            ensure_counter(FACE_GALLERY_VERSION)
+            ensure_counter(FACE_GALLERY_EPOCH, int.from_bytes(os.urandom(6), 'big'))
+            ensure_person_id_sequence()
+            
+            # Logs up to this id predate the rollups; migrate_database.py folds them in
+            ensure_counter(STATS_BACKFILL_UPTO, db.session.query(db.func.max(RecognitionLog.id)).scalar() or 0)
+            if get_counter(STATS_BACKFILL_UPTO):
+                print("[!] Existing recognition logs are not in the statistics yet - run: python migrate_database.py")
             
             # Create default admin
             create_default_admin()
@@ -0,0 +1,202 @@
+"""
+ASGI Entry Point
+Serves the face detection and recognition APIs asynchronously. Image decoding,
+face detection and feature extraction run in the shared process pool, and the
+gallery match and database work run in a small thread pool, so one event-loop
+process keeps hundreds of requests in flight instead of pinning a worker each.
+
+Every other route is handed to the Flask app unchanged (requires asgiref).
+
+    uvicorn asgi_app:app --host 0.0.0.0 --port 5000
+"""
+
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# One event-loop process serves many requests at once; the app sizes batching and admission for that
+os.environ.setdefault('SERVER_MODE', 'asgi')
+
+from app_opencv_face_detection import (
+    app as flask_app, get_process_pool, shutdown_process_pool,
+    detect_faces_in_image, extract_recognition_face, match_recognized_face, recognition_session_key,
+    recognition_crop_archive, recognition_log_writer, admission_controller, AdmissionRejected,
+    latency_metrics, metrics_endpoint
+)
+
+try:
+    from asgiref.wsgi import WsgiToAsgi
+except ImportError:
+    WsgiToAsgi = None
+
+# Database access (gallery version check, user lookup) is blocking, so it runs on threads
+_db_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get('ASGI_DB_THREADS', 8)), thread_name_prefix='asgi-db'
+)
+_flask_asgi = WsgiToAsgi(flask_app) if WsgiToAsgi else None
+
+
+async def send_json(send, payload, status=200, extra_headers=()):
+    body = json.dumps(payload).encode()
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode()),
+                    *extra_headers]
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def read_json(receive):
+    """Request body as JSON, or None if it is too large or not valid JSON"""
+    limit = flask_app.config['MAX_CONTENT_LENGTH']
+    chunks = []
+    size = 0
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        chunk = message.get('body', b'')
+        size += len(chunk)
+        if size > limit:
+            return None
+        chunks.append(chunk)
+        if not message.get('more_body'):
+            break
+    try:
+        return json.loads(b''.join(chunks) or b'null')
+    except ValueError:
+        return None
+
+
+async def admit(admission_class):
+    """Wait for an admission slot without blocking the event loop; raises AdmissionRejected"""
+    loop = asyncio.get_running_loop()
+    granted = loop.create_future()
+
+    def on_grant():
+        loop.call_soon_threadsafe(lambda: granted.done() or granted.set_result(True))
+
+    waiter = admission_controller.request(admission_class, on_grant)
+    if waiter is None:
+        return
+    try:
+        await asyncio.wait_for(asyncio.shield(granted), admission_controller.queue_timeout)
+    except asyncio.TimeoutError:
+        if admission_controller.cancel(waiter):
+            raise AdmissionRejected(admission_class, 'timed out in queue')
+
+
+async def run_in_pool(endpoint, func, *args):
+    """Run func in the process pool; the time until its result arrives is the endpoint's process_pool stage"""
+    start = time.perf_counter()
+    try:
+        return await asyncio.get_running_loop().run_in_executor(get_process_pool(), func, *args)
+    finally:
+        latency_metrics.observe_stage('process_pool', time.perf_counter() - start, endpoint)
+
+
+def match_in_app_context(face_features, crop, session_key, rect):
+    with flask_app.app_context(), metrics_endpoint('recognize_from_image'):
+        return match_recognized_face(face_features, recognition_crop_archive.store_crop(crop), session_key, rect)
+
+
+async def detect_faces(data, scope):
+    """Detect faces in an image and return coordinates"""
+    faces, (height, width) = await run_in_pool('detect_faces', detect_faces_in_image, data['image'])
+    return {
+        'status': 'success',
+        'faces': [{'x': x, 'y': y, 'w': w, 'h': h} for x, y, w, h in faces],
+        'count': len(faces),
+        'image_size': f"{width}x{height}"
+    }, 200
+
+
+async def recognize_from_image(data, scope):
+    """Recognize face from provided image"""
+    result = await run_in_pool('recognize_from_image', extract_recognition_face, data['image'])
+    if result is None:
+        return {
+            'status': 'error',
+            'message': 'No face detected in image. Please ensure your face is clearly visible with good lighting.'
+        }, 200
+    face_features, crop, rect = result
+    headers = dict(scope.get('headers') or [])
+    session_key = recognition_session_key(
+        data.get('session_id') or headers.get(b'x-recognition-session', b'').decode('latin-1'),
+        (scope.get('client') or ('unknown',))[0]
+    )
+    payload = await asyncio.get_running_loop().run_in_executor(
+        _db_executor, match_in_app_context, face_features, crop, session_key, rect
+    )
+    return payload, 200
+
+
+# path -> (handler, admission class)
+ROUTES = {
+    '/api/detect_faces': (detect_faces, 'preview'),
+    '/api/recognize_from_image': (recognize_from_image, 'recognition')
+}
+
+
+async def handle(handler, admission_class, scope, receive, send):
+    """Serve one request on a native route; returns the response status"""
+    data = await read_json(receive)
+    if not isinstance(data, dict) or not data.get('image'):
+        await send_json(send, {'status': 'error', 'message': 'No image data provided'}, 400)
+        return 400
+    try:
+        await admit(admission_class)
+    except AdmissionRejected as rejection:
+        await send_json(send, {
+            'status': 'error',
+            'message': f'Server busy ({rejection.reason}), please retry shortly'
+        }, 503, [(b'retry-after', str(admission_controller.retry_after).encode())])
+        return 503
+    try:
+        payload, status = await handler(data, scope)
+    except Exception as e:
+        print(f"Async {scope['path']} error: {e}")
+        payload, status = {'status': 'error', 'message': str(e)}, 500
+    finally:
+        admission_controller.release(admission_class)
+    await send_json(send, payload, status)
+    return status
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            get_process_pool()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            recognition_log_writer.stop()
+            shutdown_process_pool()
+            _db_executor.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+
+    route = ROUTES.get(scope.get('path'))
+    if scope['type'] == 'http' and route and scope['method'] == 'POST':
+        handler, admission_class = route
+        started = time.perf_counter()
+        status = await handle(handler, admission_class, scope, receive, send)
+        latency_metrics.observe_request(handler.__name__, 'POST', status, time.perf_counter() - started)
+        return
+
+    if _flask_asgi is None:
+        if scope['type'] == 'http':
+            return await send_json(send, {
+                'status': 'error',
+                'message': 'Only the recognition APIs are served here; install asgiref to serve the full app'
+            }, 404)
+        return
+    return await _flask_asgi(scope, receive, send)
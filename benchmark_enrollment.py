@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Enrollment Latency Benchmark
+Measures /api/train_from_images latency against the number of uploaded images,
+comparing sequential processing with the process pool fan-out
+"""
+
+import argparse
+import base64
+import os
+import statistics
+import tempfile
+import time
+
+# Point the app at a scratch database before importing it
+SCRATCH_DIR = tempfile.mkdtemp(prefix='enrollment_bench_')
+os.environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(SCRATCH_DIR, 'app.db')}")
+os.environ.setdefault('CROP_ARCHIVE_FOLDER', os.path.join(SCRATCH_DIR, 'face_crops'))
+os.environ.setdefault('FACE_GALLERY_FOLDER', os.path.join(SCRATCH_DIR, 'face_gallery'))
+
+from app_opencv_face_detection import (
+    app, db, User, build_face_model, get_process_pool, process_training_image
+)
+
+
+def load_images(paths):
+    images = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            images.append('data:image/jpeg;base64,' + base64.b64encode(f.read()).decode())
+    return images
+
+
+def sequential_enrollment(images):
+    """The pre-pool behaviour: every image processed one after another on the request thread"""
+    captured_features = [result[0] for result in map(process_training_image, images) if result is not None]
+    return build_face_model(captured_features) if captured_features else None
+
+
+def time_call(func, repeats):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Enrollment latency against image count')
+    parser.add_argument('images', nargs='+', help='face images to upload (cycled to reach each count)')
+    parser.add_argument('--counts', default='3,5,10,20', help='comma separated image counts')
+    parser.add_argument('--repeats', type=int, default=3, help='runs per measurement (median reported)')
+    parser.add_argument('--target-samples', type=int, default=5, help='early-stop target for the last column')
+    args = parser.parse_args()
+
+    source_images = load_images(args.images)
+    counts = [int(count) for count in args.counts.split(',')]
+
+    with app.app_context():
+        db.create_all()
+        user = User(person_id='BENCH', name='Bench User', email='bench@example.com')
+        db.session.add(user)
+        db.session.commit()
+        user_id = user.id
+
+    client = app.test_client()
+
+    def pooled_enrollment(images, target_samples=0):
+        response = client.post('/api/train_from_images', json={
+            'user_id': user_id, 'images': images, 'target_samples': target_samples
+        })
+        if response.status_code == 500:
+            raise RuntimeError(response.get_json().get('message'))
+
+    # Start the pool workers before timing anything
+    list(get_process_pool().map(process_training_image, source_images))
+
+    print("Face Enrollment Latency Benchmark")
+    print("=" * 72)
+    print(f"{app.config['PROCESS_POOL_WORKERS']} pool workers, median of {args.repeats} runs")
+    print(f"{'images':>8} {'sequential':>14} {'pool':>14} {'speedup':>9} {f'pool, stop@{args.target_samples}':>18}")
+    for count in counts:
+        images = [source_images[i % len(source_images)] for i in range(count)]
+        sequential = time_call(lambda: sequential_enrollment(images), args.repeats)
+        pooled = time_call(lambda: pooled_enrollment(images), args.repeats)
+        early = time_call(lambda: pooled_enrollment(images, args.target_samples), args.repeats)
+        print(f"{count:>8} {sequential * 1000:>11.0f} ms {pooled * 1000:>11.0f} ms "
+              f"{sequential / pooled:>8.2f}x {early * 1000:>15.0f} ms")
+
+    print(f"\nScratch directory: {SCRATCH_DIR}")
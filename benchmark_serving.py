@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Serving Throughput Benchmark
+Compares the shipped gunicorn setup (the Procfile/start.sh gthread workers) with the ASGI entry point
+(asgi_app.py under uvicorn, CPU work in the process pool) under many
+concurrent /api/recognize_from_image or /api/detect_faces requests
+"""
+
+import argparse
+import base64
+import http.client
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+# Point the app at a scratch database before importing it
+SCRATCH_DIR = tempfile.mkdtemp(prefix='serving_bench_')
+os.environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(SCRATCH_DIR, 'app.db')}")
+os.environ.setdefault('CROP_ARCHIVE_FOLDER', os.path.join(SCRATCH_DIR, 'face_crops'))
+os.environ.setdefault('FACE_GALLERY_FOLDER', os.path.join(SCRATCH_DIR, 'face_gallery'))
+
+import cv2
+
+from app_opencv_face_detection import app, db, User, face_detector, build_face_model, dump_face_model
+
+
+def enroll_benchmark_user(image_path):
+    """Give the gallery one enrolled face so recognition exercises the full match path"""
+    frame = cv2.imread(image_path)
+    faces = face_detector.detect_faces(frame)
+    if len(faces) == 0:
+        raise SystemExit(f"No face found in {image_path}")
+    with app.app_context():
+        db.create_all()
+        if not User.query.filter_by(email='bench@example.com').first():
+            user = User(person_id='BENCH', name='Bench User', email='bench@example.com')
+            user.face_data = dump_face_model(build_face_model([face_detector.extract_face_features(frame, faces[0])]))
+            db.session.add(user)
+            db.session.commit()
+
+
+def wait_for_server(port, process, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise SystemExit(f"Server exited with code {process.returncode}")
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            conn.request('GET', '/api/system/status')
+            conn.getresponse().read()
+            return
+        except OSError:
+            time.sleep(0.5)
+    raise SystemExit(f"Server on port {port} did not start")
+
+
+def run_load(port, path, body, concurrency, duration):
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    stop_at = time.perf_counter() + duration
+
+    def client():
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=120)
+        while time.perf_counter() < stop_at:
+            start = time.perf_counter()
+            try:
+                conn.request('POST', path, body=body, headers={'Content-Type': 'application/json'})
+                response = conn.getresponse()
+                response.read()
+                ok = response.status == 200
+            except OSError:
+                conn.close()
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=120)
+                ok = False
+            elapsed = time.perf_counter() - start
+            with lock:
+                if ok:
+                    latencies.append(elapsed)
+                else:
+                    errors[0] += 1
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors[0], time.perf_counter() - start
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def benchmark(label, command, port, path, body, args, extra_env=None):
+    env = dict(os.environ, PROCESS_POOL_WORKERS=str(args.workers), **(extra_env or {}))
+    process = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for_server(port, process)
+        run_load(port, path, body, args.workers, 2)  # warm up
+        latencies, errors, elapsed = run_load(port, path, body, args.concurrency, args.duration)
+    finally:
+        process.terminate()
+        process.wait()
+
+    print(f"\n{label}")
+    print("-" * 60)
+    print(f"Completed: {len(latencies)} requests in {elapsed:.1f}s -> {len(latencies) / elapsed:.1f} req/s ({errors} errors)")
+    print(f"Latency: p50={percentile(latencies, 50) * 1000:.0f} ms  p99={percentile(latencies, 99) * 1000:.0f} ms")
+    return len(latencies) / elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compare the Procfile gunicorn gthread workers with the ASGI entry point')
+    parser.add_argument('image', help='face image sent with every request')
+    parser.add_argument('--endpoint', choices=('recognize_from_image', 'detect_faces'), default='recognize_from_image')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn workers / process pool size')
+    parser.add_argument('--threads', type=int, default=8, help='threads per gunicorn worker (SERVER_THREADS)')
+    parser.add_argument('--concurrency', type=int, default=64, help='concurrent client connections')
+    parser.add_argument('--duration', type=float, default=20, help='seconds of load per server')
+    parser.add_argument('--port', type=int, default=5081)
+    args = parser.parse_args()
+
+    for tool in ('gunicorn', 'uvicorn'):
+        if not shutil.which(tool):
+            raise SystemExit(f"{tool} is required for this benchmark")
+
+    enroll_benchmark_user(args.image)
+    with open(args.image, 'rb') as f:
+        body = json.dumps({'image': 'data:image/jpeg;base64,' + base64.b64encode(f.read()).decode()})
+    path = f"/api/{args.endpoint}"
+
+    print("Face Recognition Serving Benchmark")
+    print("=" * 60)
+    print(f"POST {path}, {args.concurrency} concurrent clients, {args.duration:.0f}s per server, "
+          f"{args.workers} CPU workers each")
+
+    # Same command as the Procfile and start.sh
+    threaded = benchmark(
+        f"gunicorn, {args.workers} gthread workers x {args.threads} threads",
+        ['gunicorn', 'app_opencv_face_detection:app', '--bind', f"127.0.0.1:{args.port}", '--worker-class', 'gthread',
+         '--workers', str(args.workers), '--threads', str(args.threads), '--timeout', '120'],
+        args.port, path, body, args, {'SERVER_THREADS': str(args.threads)}
+    )
+    asgi = benchmark(
+        f"uvicorn asgi_app:app, 1 process + {args.workers} pool workers",
+        [sys.executable, '-m', 'uvicorn', 'asgi_app:app', '--host', '127.0.0.1', '--port', str(args.port + 1),
+         '--log-level', 'warning'],
+        args.port + 1, path, body, args
+    )
+
+    print(f"\nThroughput change: {asgi / threaded:.2f}x")
+    print(f"Scratch directory: {SCRATCH_DIR}")
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Concurrent Write Benchmark
+Compares the default SQLite setup against the tuned storage layer
+(WAL, busy timeout, synchronous=NORMAL) under concurrent registrations,
+recognition logging and face capture updates from several processes
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+# Point the app at a scratch database before importing it
+SCRATCH_DIR = tempfile.mkdtemp(prefix='storage_bench_')
+os.environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(SCRATCH_DIR, 'app.db')}")
+
+from sqlalchemy import create_engine, update
+from sqlalchemy.exc import OperationalError
+
+from app_opencv_face_detection import (
+    db, User, RecognitionLog, storage_engine_options, configure_storage_engine
+)
+
+OPERATIONS = ('register', 'log', 'capture')
+FACE_DATA = json.dumps({'histogram': [0.0039] * 256, 'lbp': [0.0039] * 256})
+
+
+def make_engine(url, tuned):
+    """Engine with the app's tuned storage settings, or SQLAlchemy defaults"""
+    if tuned:
+        engine = create_engine(url, **storage_engine_options(url))
+        configure_storage_engine(engine)
+    else:
+        engine = create_engine(url)
+    return engine
+
+
+def run_operation(conn, operation, worker_key, counter):
+    if operation == 'register':
+        conn.execute(User.__table__.insert(), {
+            'person_id': f"B{worker_key}-{counter}",
+            'name': f"Bench User {counter}",
+            'email': f"bench-{worker_key}-{counter}@example.com",
+            'created_at': datetime.utcnow(),
+            'is_active': True
+        })
+    elif operation == 'log':
+        conn.execute(RecognitionLog.__table__.insert(), {
+            'user_id': None,
+            'confidence': random.random(),
+            'status': 'unknown',
+            'timestamp': datetime.utcnow()
+        })
+    else:
+        conn.execute(update(User.__table__).where(User.__table__.c.id == random.randint(1, 50)).values(face_data=FACE_DATA))
+
+
+def worker_process(url, tuned, threads, ops_per_thread, process_index, results):
+    engine = make_engine(url, tuned)
+    latencies = {operation: [] for operation in OPERATIONS}
+    errors = {'locked': 0, 'other': 0}
+    lock = threading.Lock()
+
+    def worker_thread(thread_index):
+        worker_key = f"{process_index}-{thread_index}"
+        for counter in range(ops_per_thread):
+            operation = OPERATIONS[counter % len(OPERATIONS)]
+            start = time.perf_counter()
+            try:
+                with engine.begin() as conn:
+                    run_operation(conn, operation, worker_key, counter)
+            except OperationalError as e:
+                with lock:
+                    errors['locked' if 'locked' in str(e) else 'other'] += 1
+                continue
+            except Exception:
+                with lock:
+                    errors['other'] += 1
+                continue
+            with lock:
+                latencies[operation].append(time.perf_counter() - start)
+
+    pool = [threading.Thread(target=worker_thread, args=(i,)) for i in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    engine.dispose()
+    results.put((latencies, errors))
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def run_benchmark(tuned, processes, threads, ops_per_thread):
+    url = f"sqlite:///{os.path.join(SCRATCH_DIR, 'tuned.db' if tuned else 'baseline.db')}"
+    engine = make_engine(url, tuned)
+    db.metadata.create_all(engine)
+    with engine.begin() as conn:
+        for i in range(50):
+            run_operation(conn, 'register', 'seed', i)
+    engine.dispose()
+
+    results = multiprocessing.Queue()
+    start = time.perf_counter()
+    workers = [
+        multiprocessing.Process(target=worker_process, args=(url, tuned, threads, ops_per_thread, i, results))
+        for i in range(processes)
+    ]
+    for worker in workers:
+        worker.start()
+    collected = [results.get() for _ in workers]
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+
+    latencies = {operation: [] for operation in OPERATIONS}
+    errors = {'locked': 0, 'other': 0}
+    for worker_latencies, worker_errors in collected:
+        for operation in OPERATIONS:
+            latencies[operation].extend(worker_latencies[operation])
+        for key in errors:
+            errors[key] += worker_errors[key]
+
+    completed = sum(len(values) for values in latencies.values())
+    print(f"\n{'Tuned (WAL, busy timeout, synchronous=NORMAL)' if tuned else 'Baseline (SQLAlchemy defaults)'}")
+    print("-" * 60)
+    print(f"Completed: {completed} ops in {elapsed:.2f}s -> {completed / elapsed:.0f} ops/s")
+    print(f"Errors: {errors['locked']} 'database is locked', {errors['other']} other")
+    for operation in OPERATIONS:
+        values = latencies[operation]
+        print(f"   - {operation:<8} n={len(values):<6} p50={percentile(values, 50) * 1000:7.2f} ms  "
+              f"p99={percentile(values, 99) * 1000:8.2f} ms")
+    return completed / elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Concurrent write benchmark for the storage layer')
+    parser.add_argument('--processes', type=int, default=4, help='worker processes (like gunicorn workers)')
+    parser.add_argument('--threads', type=int, default=4, help='threads per process')
+    parser.add_argument('--ops', type=int, default=150, help='operations per thread')
+    args = parser.parse_args()
+
+    print("Face Recognition Storage Benchmark")
+    print("=" * 60)
+    print(f"{args.processes} processes x {args.threads} threads x {args.ops} ops "
+          f"(registration, logging and face capture, round-robin)")
+
+    baseline = run_benchmark(False, args.processes, args.threads, args.ops)
+    tuned = run_benchmark(True, args.processes, args.threads, args.ops)
+
+    print(f"\nThroughput change: {tuned / baseline:.2f}x")
+    print(f"Scratch databases: {SCRATCH_DIR}")
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Bulk User Import
+Creates users from a CSV or NDJSON file and enrolls their faces from a
+directory of images per person (<images-dir>/<image_dir or email>/*.jpg)
+"""
+
+import argparse
+import json
+import os
+import sys
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Bulk import users and enroll their faces')
+    parser.add_argument('records', help='CSV or NDJSON file with name, email and optional profile fields')
+    parser.add_argument('--images-dir', help='directory containing one sub-directory of images per person')
+    parser.add_argument('--format', choices=('csv', 'ndjson'), help='record format (default: from file extension)')
+    parser.add_argument('--batch-size', type=int, default=200, help='users inserted per transaction')
+    parser.add_argument('--workers', type=int, help='processes used for face detection and feature extraction')
+    parser.add_argument('--min-images', type=int, default=3, help='face images required to enroll a person')
+    parser.add_argument('--report', help='write the per-row report to this JSON file')
+    args = parser.parse_args()
+
+    if args.workers:
+        os.environ['PROCESS_POOL_WORKERS'] = str(args.workers)
+
+    from app_opencv_face_detection import app, import_users, parse_user_records, summarize_import
+
+    record_format = args.format or ('ndjson' if args.records.lower().endswith(('.ndjson', '.jsonl')) else 'csv')
+    if args.images_dir and not os.path.isdir(args.images_dir):
+        print(f"Image directory not found: {args.images_dir}")
+        return 1
+
+    print(f"Importing users from {args.records} ({record_format})...")
+    with app.app_context():
+        with open(args.records, 'r', encoding='utf-8-sig', newline='') as stream:
+            report = import_users(
+                parse_user_records(stream, record_format),
+                images_root=args.images_dir,
+                batch_size=args.batch_size,
+                min_images=args.min_images
+            )
+
+    for item in report:
+        if item['status'] == 'error':
+            print(f"   - Row {item['row']} ({item.get('email') or 'no email'}): {item['error']}")
+        elif item.get('face_error'):
+            print(f"   - Row {item['row']} ({item['email']}): created as {item['person_id']}, face not enrolled: {item['face_error']}")
+
+    summary = summarize_import(report)
+    print(f"\nRows: {summary['rows']}  Created: {summary['created']}  "
+          f"Failed: {summary['failed']}  Faces enrolled: {summary['faces_enrolled']}")
+
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as out:
+            json.dump({'summary': summary, 'rows': report}, out, indent=2)
+        print(f"Report written to {args.report}")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
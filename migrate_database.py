@@ -1,120 +1,575 @@
 #!/usr/bin/env python3
 """
-Database Migration Script
-Migrates the existing database to support the new user fields
+Database Migration Runner
+Applies versioned schema steps and resumable, batched backfills.
+
+Every step records its progress in the schema_migration table. Backfills commit a
+checkpoint with each batch, so the runner can be interrupted (Ctrl+C) and resumed
+later, and can be throttled to run while the app keeps serving traffic.
+
+Usage:
+    python migrate_database.py                       # apply all pending steps
+    python migrate_database.py --list                # show step status
+    python migrate_database.py --batch-size 500 --max-rate 2000 --sleep 0.05
 """
 
-import sqlite3
+import argparse
+import base64
+import json
 import os
+import sys
+import time
 from datetime import datetime
 
-def migrate_database():
-    """Migrate database to new schema with person_id and additional fields"""
-    
-    db_path = 'instance/face_recognition.db'
-    
-    # Create instance directory if it doesn't exist
-    os.makedirs('instance', exist_ok=True)
-    
-    print("Starting database migration...")
-    
-    try:
-        # Connect to database
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        
-        # Check if person_id column already exists
-        cursor.execute("PRAGMA table_info(user)")
-        columns = [column[1] for column in cursor.fetchall()]
-        
-        if 'person_id' not in columns:
-            print("Adding new columns to user table...")
-            
-            # Add new columns to user table
-            new_columns = [
-                "ALTER TABLE user ADD COLUMN person_id VARCHAR(20)",
-                "ALTER TABLE user ADD COLUMN phone VARCHAR(20)",
-                "ALTER TABLE user ADD COLUMN address TEXT",
-                "ALTER TABLE user ADD COLUMN city VARCHAR(100)",
-                "ALTER TABLE user ADD COLUMN college_name VARCHAR(200)",
-                "ALTER TABLE user ADD COLUMN course VARCHAR(100)",
-                "ALTER TABLE user ADD COLUMN year_of_study VARCHAR(20)"
-            ]
-            
-            for sql in new_columns:
+import numpy as np
+import sqlalchemy as sa
+
+DEFAULT_DATABASE_URL = 'sqlite:///face_recognition.db'
+
+# Must match the bucket used by the app for all-time counters
+STAT_TOTAL_BUCKET = datetime(1970, 1, 1)
+
+user_table = sa.table(
+    'user',
+    sa.column('id', sa.Integer),
+    sa.column('person_id', sa.String),
+    sa.column('face_data', sa.Text),
+)
+log_table = sa.table(
+    'recognition_log',
+    sa.column('id', sa.Integer),
+    sa.column('user_id', sa.Integer),
+    sa.column('timestamp', sa.DateTime),
+    sa.column('status', sa.String),
+)
+counter_table = sa.table(
+    'app_counter',
+    sa.column('name', sa.String),
+    sa.column('value', sa.BigInteger),
+)
+stat_table = sa.table(
+    'recognition_stat',
+    sa.column('id', sa.Integer),
+    sa.column('period', sa.String),
+    sa.column('bucket_start', sa.DateTime),
+    sa.column('total', sa.Integer),
+    sa.column('recognized', sa.Integer),
+    sa.column('unknown', sa.Integer),
+    sa.column('unique_users', sa.Integer),
+)
+stat_user_table = sa.table(
+    'recognition_stat_user',
+    sa.column('period', sa.String),
+    sa.column('bucket_start', sa.DateTime),
+    sa.column('user_id', sa.Integer),
+)
+
+
+class MigrationDeferred(Exception):
+    """A step cannot run until the app has created the tables it needs"""
+
+
+metadata = sa.MetaData()
+migration_table = sa.Table(
+    'schema_migration', metadata,
+    sa.Column('version', sa.Integer, primary_key=True),
+    sa.Column('name', sa.String(100), nullable=False),
+    sa.Column('status', sa.String(20), nullable=False),  # running or done
+    sa.Column('checkpoint', sa.Text, nullable=True),
+    sa.Column('rows_done', sa.BigInteger, nullable=False, default=0),
+    sa.Column('updated_at', sa.DateTime, nullable=False),
+)
+
+
+def resolve_database_url(url):
+    """Resolve relative SQLite paths against the app's instance/ folder, like Flask-SQLAlchemy does"""
+    if url.startswith('mysql://'):
+        return 'mysql+pymysql://' + url[len('mysql://'):]
+    if url.startswith('sqlite:///') and not url.startswith('sqlite:////'):
+        path = url[len('sqlite:///'):]
+        if path and path != ':memory:' and not os.path.isabs(path):
+            instance_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance')
+            os.makedirs(instance_dir, exist_ok=True)
+            return 'sqlite:///' + os.path.join(instance_dir, path)
+    return url
+
+
+def create_migration_engine(url):
+    engine = sa.create_engine(url)
+    if engine.dialect.name == 'sqlite':
+        @sa.event.listens_for(engine, 'connect')
+        def configure_sqlite(dbapi_connection, connection_record):
+            # Wait for app writers instead of failing with "database is locked"
+            cursor = dbapi_connection.cursor()
+            cursor.execute("PRAGMA busy_timeout = 30000")
+            cursor.execute("PRAGMA journal_mode = WAL")
+            cursor.close()
+    return engine
+
+
+class MigrationContext:
+    """Per-step state: checkpoint persistence, throttling and progress reporting"""
+
+    def __init__(self, engine, version, name, checkpoint, rows_done, batch_size, sleep, max_rate):
+        self.engine = engine
+        self.version = version
+        self.name = name
+        self.checkpoint = checkpoint
+        self.rows_done = rows_done
+        self.batch_size = batch_size
+        self.sleep = sleep
+        self.max_rate = max_rate
+        self.total_rows = None
+        self._started = time.monotonic()
+        self._started_rows = rows_done
+
+    def save(self, conn, checkpoint, rows):
+        """Persist the checkpoint inside the batch's own transaction"""
+        self.checkpoint = checkpoint
+        self.rows_done += rows
+        conn.execute(
+            migration_table.update()
+            .where(migration_table.c.version == self.version)
+            .values(checkpoint=json.dumps(checkpoint), rows_done=self.rows_done, updated_at=datetime.utcnow())
+        )
+
+    def throttle(self):
+        """Pause between batches, and long enough to stay under --max-rate"""
+        if self.sleep:
+            time.sleep(self.sleep)
+        if self.max_rate:
+            processed = self.rows_done - self._started_rows
+            minimum_elapsed = processed / self.max_rate
+            elapsed = time.monotonic() - self._started
+            if minimum_elapsed > elapsed:
+                time.sleep(minimum_elapsed - elapsed)
+
+    def report(self):
+        processed = self.rows_done - self._started_rows
+        elapsed = max(time.monotonic() - self._started, 1e-6)
+        rate = processed / elapsed
+        line = f"   [{self.version:03d} {self.name}] {self.rows_done} rows"
+        if self.total_rows:
+            remaining = max(self.total_rows - self.rows_done, 0)
+            percent = min(self.rows_done / self.total_rows * 100, 100.0)
+            eta = remaining / rate if rate > 0 else 0
+            line += f" / {self.total_rows} ({percent:.1f}%) ETA {eta:.0f}s"
+        line += f" at {rate:.0f} rows/s"
+        print(line, flush=True)
+
+
+def column_names(engine, table):
+    inspector = sa.inspect(engine)
+    if not inspector.has_table(table):
+        return set()
+    return {column['name'] for column in inspector.get_columns(table)}
+
+
+def index_names(engine, table):
+    inspector = sa.inspect(engine)
+    if not inspector.has_table(table):
+        return set()
+    return {index['name'] for index in inspector.get_indexes(table)}
+
+
+def quote(engine, name):
+    return engine.dialect.identifier_preparer.quote(name)
+
+
+# Migration steps -------------------------------------------------------------
+
+def add_user_profile_columns(ctx):
+    """Add the person_id and profile columns to user tables created by early versions"""
+    existing = column_names(ctx.engine, 'user')
+    if not existing:
+        print("   - user table does not exist yet (the app creates it on first start)")
+        return
+    new_columns = [
+        ('person_id', 'VARCHAR(20)'),
+        ('phone', 'VARCHAR(20)'),
+        ('address', 'TEXT'),
+        ('city', 'VARCHAR(100)'),
+        ('college_name', 'VARCHAR(200)'),
+        ('department', 'VARCHAR(100)'),
+        ('course', 'VARCHAR(100)'),
+        ('year_of_study', 'VARCHAR(20)'),
+    ]
+    with ctx.engine.begin() as conn:
+        for name, column_type in new_columns:
+            if name in existing:
+                continue
+            conn.execute(sa.text(f"ALTER TABLE {quote(ctx.engine, 'user')} ADD COLUMN {name} {column_type}"))
+            print(f"   - Added column: {name}")
+
+
+def backfill_person_ids(ctx):
+    """Give users without a person_id the next P00N number, one batch per transaction"""
+    if 'person_id' not in column_names(ctx.engine, 'user'):
+        return
+
+    checkpoint = ctx.checkpoint
+    with ctx.engine.connect() as conn:
+        if 'next_number' not in checkpoint:
+            highest = 0
+            for (person_id,) in conn.execute(sa.select(user_table.c.person_id).where(user_table.c.person_id.like('P%'))):
+                if person_id[1:].isdigit():
+                    highest = max(highest, int(person_id[1:]))
+            checkpoint = {'last_id': 0, 'next_number': highest + 1}
+        ctx.total_rows = ctx.rows_done + conn.execute(
+            sa.select(sa.func.count()).select_from(user_table)
+            .where(user_table.c.person_id.is_(None), user_table.c.id > checkpoint['last_id'])
+        ).scalar()
+
+    while True:
+        with ctx.engine.begin() as conn:
+            ids = [row[0] for row in conn.execute(
+                sa.select(user_table.c.id)
+                .where(user_table.c.person_id.is_(None), user_table.c.id > checkpoint['last_id'])
+                .order_by(user_table.c.id).limit(ctx.batch_size)
+            )]
+            if not ids:
+                break
+            next_number = checkpoint['next_number']
+            conn.execute(
+                user_table.update().where(user_table.c.id == sa.bindparam('user_id')).values(person_id=sa.bindparam('new_person_id')),
+                [{'user_id': user_id, 'new_person_id': f"P{str(next_number + offset).zfill(3)}"}
+                 for offset, user_id in enumerate(ids)]
+            )
+            checkpoint = {'last_id': ids[-1], 'next_number': next_number + len(ids)}
+            ctx.save(conn, checkpoint, len(ids))
+        ctx.report()
+        ctx.throttle()
+
+
+def create_person_id_index(ctx):
+    if not column_names(ctx.engine, 'user') or 'idx_user_person_id' in index_names(ctx.engine, 'user'):
+        return
+    with ctx.engine.begin() as conn:
+        conn.execute(sa.text(f"CREATE UNIQUE INDEX idx_user_person_id ON {quote(ctx.engine, 'user')} (person_id)"))
+    print("   - Created unique index on person_id")
+
+
+def create_log_indexes(ctx):
+    """Indexes used by log pagination, filters and the dashboard"""
+    wanted = [
+        ('recognition_log', 'ix_recognition_log_timestamp_id', 'timestamp, id'),
+        ('recognition_log', 'ix_recognition_log_user_timestamp', 'user_id, timestamp, id'),
+        ('recognition_log', 'ix_recognition_log_status_timestamp', 'status, timestamp, id'),
+        ('user', 'ix_user_created_at', 'created_at'),
+    ]
+    for table, name, columns in wanted:
+        if not column_names(ctx.engine, table) or name in index_names(ctx.engine, table):
+            continue
+        with ctx.engine.begin() as conn:
+            conn.execute(sa.text(f"CREATE INDEX {name} ON {quote(ctx.engine, table)} ({columns})"))
+        print(f"   - Created index {name}")
+
+
+def seed_counters(ctx):
+    """Create the shared counter table and seed the person ID sequence"""
+    if not sa.inspect(ctx.engine).has_table('app_counter'):
+        with ctx.engine.begin() as conn:
+            conn.execute(sa.text(
+                "CREATE TABLE app_counter (name VARCHAR(50) NOT NULL PRIMARY KEY, value BIGINT NOT NULL)"
+            ))
+        print("   - Created app_counter table")
+
+    if not column_names(ctx.engine, 'user'):
+        return
+    with ctx.engine.begin() as conn:
+        existing = {row[0] for row in conn.execute(sa.select(counter_table.c.name))}
+        if 'person_id_seq' not in existing:
+            highest = 0
+            for (person_id,) in conn.execute(sa.select(user_table.c.person_id).where(user_table.c.person_id.like('P%'))):
+                if person_id[1:].isdigit():
+                    highest = max(highest, int(person_id[1:]))
+            conn.execute(counter_table.insert(), {'name': 'person_id_seq', 'value': highest})
+            print(f"   - Seeded person ID sequence at {highest}")
+        if 'users_version' not in existing:
+            conn.execute(counter_table.insert(), {'name': 'users_version', 'value': 0})
+
+
+def bucket_start(period, timestamp):
+    if period == 'hour':
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+    if period == 'day':
+        return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+    return STAT_TOTAL_BUCKET
+
+
+def apply_stat_batch(conn, rows):
+    """Add a batch of (timestamp, status, user_id) log rows to the rollup tables"""
+    counters = {}
+    bucket_users = {}
+    for timestamp, status, user_id in rows:
+        timestamp = timestamp or STAT_TOTAL_BUCKET
+        for period in ('hour', 'day', 'total'):
+            key = (period, bucket_start(period, timestamp))
+            counts = counters.setdefault(key, [0, 0, 0])
+            counts[0] += 1
+            if status == 'recognized':
+                counts[1] += 1
+            elif status == 'unknown':
+                counts[2] += 1
+            if user_id:
+                bucket_users.setdefault(key, set()).add(user_id)
+
+    for (period, start), (total, recognized, unknown) in counters.items():
+        new_users = 0
+        user_ids = bucket_users.get((period, start))
+        if user_ids:
+            counted = {row[0] for row in conn.execute(
+                sa.select(stat_user_table.c.user_id).where(
+                    stat_user_table.c.period == period,
+                    stat_user_table.c.bucket_start == start,
+                    stat_user_table.c.user_id.in_(user_ids)
+                )
+            )}
+            new_user_ids = user_ids - counted
+            if new_user_ids:
+                conn.execute(stat_user_table.insert(), [
+                    {'period': period, 'bucket_start': start, 'user_id': user_id} for user_id in new_user_ids
+                ])
+                new_users = len(new_user_ids)
+
+        updated = conn.execute(
+            stat_table.update()
+            .where(stat_table.c.period == period, stat_table.c.bucket_start == start)
+            .values(
+                total=stat_table.c.total + total,
+                recognized=stat_table.c.recognized + recognized,
+                unknown=stat_table.c.unknown + unknown,
+                unique_users=stat_table.c.unique_users + new_users
+            )
+        ).rowcount
+        if not updated:
+            conn.execute(stat_table.insert(), {
+                'period': period, 'bucket_start': start, 'total': total,
+                'recognized': recognized, 'unknown': unknown, 'unique_users': new_users
+            })
+
+
+def backfill_recognition_stats(ctx):
+    """Fold logs written before the rollup tables existed into the statistics rollups
+
+    The app records the highest log id that predates the rollups as stats_backfill_upto;
+    newer logs are already counted by the log writer, so only ids up to it are folded in.
+    """
+    inspector = sa.inspect(ctx.engine)
+    if not inspector.has_table('recognition_log') or not inspector.has_table('recognition_stat'):
+        raise MigrationDeferred('the rollup tables do not exist yet; start the app once, then run this again')
+
+    checkpoint = ctx.checkpoint
+    with ctx.engine.begin() as conn:
+        if 'upto' not in checkpoint:
+            upto = conn.execute(
+                sa.select(counter_table.c.value).where(counter_table.c.name == 'stats_backfill_upto')
+            ).scalar()
+            if upto is None:
+                # The app has not started with rollups yet, so nothing is counted so far
+                upto = conn.execute(sa.select(sa.func.max(log_table.c.id))).scalar() or 0
+                conn.execute(counter_table.insert(), {'name': 'stats_backfill_upto', 'value': upto})
+            checkpoint = {'last_id': 0, 'upto': upto}
+        ctx.total_rows = ctx.rows_done + conn.execute(
+            sa.select(sa.func.count()).select_from(log_table)
+            .where(log_table.c.id > checkpoint['last_id'], log_table.c.id <= checkpoint['upto'])
+        ).scalar()
+
+    while True:
+        with ctx.engine.begin() as conn:
+            rows = conn.execute(
+                sa.select(log_table.c.id, log_table.c.timestamp, log_table.c.status, log_table.c.user_id)
+                .where(log_table.c.id > checkpoint['last_id'], log_table.c.id <= checkpoint['upto'])
+                .order_by(log_table.c.id).limit(ctx.batch_size)
+            ).all()
+            if not rows:
+                conn.execute(
+                    counter_table.update().where(counter_table.c.name == 'stats_backfill_upto').values(value=0)
+                )
+                break
+            apply_stat_batch(conn, [(timestamp, status, user_id) for _, timestamp, status, user_id in rows])
+            checkpoint = {'last_id': rows[-1][0], 'upto': checkpoint['upto']}
+            ctx.save(conn, checkpoint, len(rows))
+        ctx.report()
+        ctx.throttle()
+
+
+def add_enrollment_job_owner(ctx):
+    """Add the owner column that lets queued enrollment jobs be re-queued when their process is gone"""
+    existing = column_names(ctx.engine, 'enrollment_job')
+    if not existing:
+        print("   - enrollment_job table does not exist yet (the app creates it on first start)")
+        return
+    if 'owner' in existing:
+        return
+    with ctx.engine.begin() as conn:
+        conn.execute(sa.text(f"ALTER TABLE {quote(ctx.engine, 'enrollment_job')} ADD COLUMN owner VARCHAR(100)"))
+    print("   - Added column: owner")
+
+
+def pack_face_model(face_data):
+    """Same layout as the app's dump_face_model: float32 arrays as base64, no stored std
+
+    A model that only has the std keeps its spread as M2 (std squared times the sample count).
+    """
+    def pack(values):
+        return base64.b64encode(np.asarray(values, dtype='<f4').tobytes()).decode('ascii')
+
+    count = int(face_data.get('num_samples') or 1)
+    for field in ('histogram', 'lbp'):
+        std = face_data.pop(f'{field}_std', None)
+        if std is not None and f'{field}_m2' not in face_data:
+            face_data[f'{field}_m2'] = np.asarray(std, dtype=np.float64) ** 2 * count
+    for field in ('histogram', 'lbp', 'histogram_m2', 'lbp_m2'):
+        if isinstance(face_data.get(field), (list, np.ndarray)):
+            face_data[field] = pack(face_data[field])
+    for prototype in face_data.get('prototypes') or []:
+        for field in ('histogram', 'lbp'):
+            if isinstance(prototype.get(field), list):
+                prototype[field] = pack(prototype[field])
+    return json.dumps(face_data)
+
+
+def pack_face_models(ctx):
+    """Rewrite stored face models as packed float32 arrays, one batch of users per transaction"""
+    checkpoint = ctx.checkpoint or {'last_id': 0}
+    with ctx.engine.connect() as conn:
+        ctx.total_rows = ctx.rows_done + conn.execute(
+            sa.select(sa.func.count()).select_from(user_table)
+            .where(user_table.c.face_data.isnot(None), user_table.c.id > checkpoint['last_id'])
+        ).scalar()
+
+    while True:
+        with ctx.engine.begin() as conn:
+            rows = conn.execute(
+                sa.select(user_table.c.id, user_table.c.face_data)
+                .where(user_table.c.face_data.isnot(None), user_table.c.id > checkpoint['last_id'])
+                .order_by(user_table.c.id).limit(ctx.batch_size)
+            ).all()
+            if not rows:
+                break
+            updates = []
+            for user_id, face_data in rows:
                 try:
-                    cursor.execute(sql)
-                    print(f"Added column: {sql.split('ADD COLUMN')[1].split()[0]}")
-                except sqlite3.OperationalError as e:
-                    if "duplicate column name" in str(e):
-                        print(f"Column already exists: {sql.split('ADD COLUMN')[1].split()[0]}")
-                    else:
-                        print(f"Error adding column: {e}")
-            
-            # Generate person_id for existing users
-            cursor.execute("SELECT id FROM user WHERE person_id IS NULL")
-            users_without_person_id = cursor.fetchall()
-            
-            if users_without_person_id:
-                print(f"Generating person IDs for {len(users_without_person_id)} existing users...")
-                
-                for i, (user_id,) in enumerate(users_without_person_id, 1):
-                    person_id = f"P{str(i).zfill(3)}"
-                    cursor.execute("UPDATE user SET person_id = ? WHERE id = ?", (person_id, user_id))
-                    print(f"User ID {user_id} -> Person ID {person_id}")
-            
-            # Create unique index on person_id
-            try:
-                cursor.execute("CREATE UNIQUE INDEX idx_user_person_id ON user(person_id)")
-                print("Created unique index on person_id")
-            except sqlite3.OperationalError as e:
-                if "already exists" in str(e):
-                    print("Index on person_id already exists")
-                else:
-                    print(f"Error creating index: {e}")
-            
-            conn.commit()
-            print("Database migration completed successfully!")
-            
-        else:
-            print("Database already has new schema - no migration needed")
-        
-        # Verify the migration
-        cursor.execute("PRAGMA table_info(user)")
-        columns = cursor.fetchall()
-        
-        print("\nCurrent user table schema:")
-        for column in columns:
-            print(f"   - {column[1]} ({column[2]})")
-        
-        # Show existing users with person_ids
-        cursor.execute("SELECT person_id, name, email FROM user ORDER BY person_id")
-        users = cursor.fetchall()
-        
-        if users:
-            print(f"\nExisting users ({len(users)}):")
-            for person_id, name, email in users:
-                print(f"   - {person_id}: {name} ({email})")
-        else:
-            print("\nNo existing users found")
-        
-        conn.close()
-        
-    except Exception as e:
-        print(f"Migration failed: {e}")
-        return False
-    
+                    packed = pack_face_model(json.loads(face_data))
+                except (ValueError, TypeError, AttributeError) as e:
+                    print(f"   - Skipping face model of user {user_id}: {e}")
+                    continue
+                if len(packed) < len(face_data):
+                    updates.append({'user_id': user_id, 'packed': packed})
+            if updates:
+                conn.execute(
+                    user_table.update().where(user_table.c.id == sa.bindparam('user_id')).values(face_data=sa.bindparam('packed')),
+                    updates
+                )
+            checkpoint = {'last_id': rows[-1][0]}
+            ctx.save(conn, checkpoint, len(rows))
+        ctx.report()
+        ctx.throttle()
+
+
+MIGRATIONS = [
+    (1, 'add_user_profile_columns', add_user_profile_columns),
+    (2, 'backfill_person_ids', backfill_person_ids),
+    (3, 'create_person_id_index', create_person_id_index),
+    (4, 'create_log_indexes', create_log_indexes),
+    (5, 'seed_counters', seed_counters),
+    (6, 'backfill_recognition_stats', backfill_recognition_stats),
+    (7, 'add_enrollment_job_owner', add_enrollment_job_owner),
+    (8, 'pack_face_models', pack_face_models),
+]
+
+
+def load_state(engine):
+    metadata.create_all(engine, tables=[migration_table])
+    with engine.connect() as conn:
+        return {row.version: row for row in conn.execute(sa.select(migration_table))}
+
+
+def list_migrations(engine):
+    state = load_state(engine)
+    print("Migration steps:")
+    for version, name, _ in MIGRATIONS:
+        row = state.get(version)
+        status = f"{row.status} ({row.rows_done} rows)" if row else 'pending'
+        print(f"   - {version:03d} {name}: {status}")
+
+
+def migrate_database(database_url, batch_size=500, sleep=0.0, max_rate=None, target=None):
+    """Apply pending migration steps, resuming any interrupted backfill from its checkpoint"""
+    engine = create_migration_engine(database_url)
+    state = load_state(engine)
+
+    for version, name, step in MIGRATIONS:
+        if target is not None and version > target:
+            break
+        row = state.get(version)
+        if row and row.status == 'done':
+            continue
+
+        checkpoint = json.loads(row.checkpoint) if row and row.checkpoint else {}
+        rows_done = row.rows_done if row else 0
+        with engine.begin() as conn:
+            if row:
+                print(f"Resuming {version:03d} {name} from checkpoint {checkpoint}")
+            else:
+                print(f"Applying {version:03d} {name}")
+                conn.execute(migration_table.insert(), {
+                    'version': version, 'name': name, 'status': 'running',
+                    'checkpoint': None, 'rows_done': 0, 'updated_at': datetime.utcnow()
+                })
+
+        ctx = MigrationContext(engine, version, name, checkpoint, rows_done, batch_size, sleep, max_rate)
+        try:
+            step(ctx)
+        except MigrationDeferred as e:
+            with engine.begin() as conn:
+                conn.execute(migration_table.delete().where(migration_table.c.version == version))
+            print(f"Deferred {version:03d} {name}: {e}")
+            break
+
+        with engine.begin() as conn:
+            conn.execute(
+                migration_table.update().where(migration_table.c.version == version)
+                .values(status='done', updated_at=datetime.utcnow())
+            )
+        print(f"Completed {version:03d} {name}")
+
+    engine.dispose()
     return True
 
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Apply versioned, resumable database migrations')
+    parser.add_argument('--database', default=os.environ.get('DATABASE_URL', DEFAULT_DATABASE_URL),
+                        help='database URL (default: DATABASE_URL or the app database in instance/)')
+    parser.add_argument('--batch-size', type=int, default=500, help='rows per backfill transaction')
+    parser.add_argument('--sleep', type=float, default=0.0, help='pause in seconds between batches')
+    parser.add_argument('--max-rate', type=float, help='maximum backfill rate in rows per second')
+    parser.add_argument('--target', type=int, help='stop after this migration version')
+    parser.add_argument('--list', action='store_true', help='show migration status and exit')
+    args = parser.parse_args()
+
+    database_url = resolve_database_url(args.database)
+
     print("Face Recognition Database Migration")
     print("=" * 50)
-    
-    success = migrate_database()
-    
+    print(f"Database: {database_url}")
+
+    if args.list:
+        list_migrations(create_migration_engine(database_url))
+        sys.exit(0)
+
+    try:
+        success = migrate_database(database_url, args.batch_size, args.sleep, args.max_rate, args.target)
+    except KeyboardInterrupt:
+        print("\nMigration interrupted. Progress is checkpointed; run the command again to resume.")
+        sys.exit(130)
+    except Exception as e:
+        print(f"\nMigration failed: {e}")
+        print("Fix the problem and run the command again; completed batches are kept.")
+        sys.exit(1)
+
     if success:
         print("\nMigration completed successfully!")
         print("You can now start the application with: python app_opencv_face_detection.py")
-    else:
-        print("\nMigration failed!")
-        print("Please check the error messages above and try again.")
@@ -3,10 +3,29 @@
 
 echo "Starting Face Recognition App..."
 
+# SERVER_MODE=asgi serves the recognition APIs from asgi_app.py (needs uvicorn and asgiref)
+if [ "${SERVER_MODE}" = "asgi" ] && command -v uvicorn &> /dev/null; then
+    echo "Using uvicorn (ASGI)..."
+    uvicorn asgi_app:app --host 0.0.0.0 --port ${PORT:-5000}
 # Check if gunicorn is available
-if command -v gunicorn &> /dev/null; then
-    echo "Using gunicorn..."
-    gunicorn app_opencv_face_detection:app --bind 0.0.0.0:${PORT:-5000} --workers 2 --timeout 120
+elif command -v gunicorn &> /dev/null; then
+    # STREAMING_MODE=separate serves the MJPEG video feeds from their own threaded worker
+    # group on STREAM_PORT, so open streams never occupy the API's sync workers
+    if [ "${STREAMING_MODE}" = "separate" ]; then
+        STREAM_PORT=${STREAM_PORT:-5001}
+        echo "Using gunicorn (video streams on port ${STREAM_PORT})..."
+        STREAM_MAX_CONCURRENT=${STREAM_MAX_CONCURRENT:-8} SERVER_THREADS=${STREAM_THREADS:-10} gunicorn app_opencv_face_detection:app \
+            --bind 0.0.0.0:${STREAM_PORT} --worker-class gthread --workers 1 \
+            --threads ${STREAM_THREADS:-10} --timeout 120 &
+        export STREAM_SERVER_PORT=${STREAM_PORT}
+    else
+        echo "Using gunicorn..."
+    fi
+    # Threaded workers, so an open video stream holds one thread rather than a whole worker
+    # (streams take at most half of SERVER_THREADS per worker unless STREAM_MAX_CONCURRENT is set)
+    export SERVER_THREADS=${SERVER_THREADS:-8}
+    gunicorn app_opencv_face_detection:app --bind 0.0.0.0:${PORT:-5000} --worker-class gthread \
+        --workers 2 --threads ${SERVER_THREADS} --timeout 120
 else
     echo "Gunicorn not found, using Python directly..."
     python app_opencv_face_detection.py